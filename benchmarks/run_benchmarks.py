@@ -0,0 +1,259 @@
+"""
+run_benchmarks.py
+
+Benchmarks the data-prep and reward hot paths on synthetic datasets.
+
+Every benchmark runs in a fresh process (so peak RSS is its own) inside an empty working
+directory with datasets caching disabled, so no cache from an earlier run is reused.
+Rows/sec and peak RSS (the process or its largest worker) are written to a JSON results
+file. With --baseline the results are compared against a stored run, and the script
+exits with status 1 when a benchmark got slower or bigger than the tolerances allow.
+
+Usage:
+    python -m benchmarks.run_benchmarks --sizes 10k 100k --tokenizer /path/to/tokenizer
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import (
+    DUPLICATE_RATE,
+    EMPTY_RATE,
+    NON_ENGLISH_RATE,
+    synthetic_completions,
+    synthetic_dataset,
+)
+
+RESULTS_PATH = "data/benchmarks/results.json"
+SIZES = ["10k", "100k"]
+REWARD_BATCH_SIZE = 8  # TRAIN_MICRO_BATCH_SIZE * NUM_GENERATIONS
+SPEED_TOLERANCE = 0.2
+RSS_TOLERANCE = 0.25
+
+
+def parse_size(size):
+    """"10k" -> 10_000, "1M" -> 1_000_000."""
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = size[-1].lower()
+    return int(float(size[:-1]) * multipliers[suffix]) if suffix in multipliers else int(size)
+
+
+def bench_clean_openmath(dataset, tokenizer, num_proc):
+    from data_cleaning.clean_openmath import clean_openmath
+    clean_openmath(dataset, num_proc=num_proc)
+
+
+def bench_clean_deepwriting(dataset, tokenizer, num_proc):
+    from data_cleaning.clean_deepwriting import clean_deepwriting
+    clean_deepwriting(dataset, num_proc=num_proc)
+
+
+def bench_shuffle_and_split(dataset, tokenizer, num_proc):
+    from data_cleaning.split_openmath import shuffle_and_split
+    for split in shuffle_and_split(dataset):
+        split.flatten_indices()
+
+
+def bench_hash_split(dataset, tokenizer, num_proc):
+    from data_cleaning.split_openmath import split_dataset
+    for split in split_dataset(dataset, mode="hash", num_proc=num_proc):
+        split.flatten_indices()
+
+
+def bench_format_openmath(dataset, tokenizer, num_proc):
+    from data_formatting.format_openmath_sft import format_dataset
+    format_dataset(dataset, tokenizer=tokenizer, num_proc=num_proc)
+
+
+def bench_format_deepwriting(dataset, tokenizer, num_proc):
+    from data_formatting.format_deepwriting_sft import format_dataset
+    format_dataset(dataset, tokenizer=tokenizer, num_proc=num_proc)
+
+
+def bench_format_openmath_text(dataset, tokenizer, num_proc):
+    from data_formatting.format_openmath_sft import format_dataset
+    format_dataset(dataset, num_proc=num_proc)
+
+
+def bench_format_deepwriting_text(dataset, tokenizer, num_proc):
+    from data_formatting.format_deepwriting_sft import format_dataset
+    format_dataset(dataset, num_proc=num_proc)
+
+
+def bench_inspect_token_lengths(dataset, tokenizer, num_proc):
+    from data_formatting.inspect_token_lengths import inspect_token_lengths
+    dataset = dataset.rename_column("generated_solution", "text")
+    inspect_token_lengths(dataset, tokenizer, num_proc=num_proc, cache_dir=None)
+
+
+def bench_combined_reward(data, tokenizer, num_proc):
+    from grpo.rewards import combined_reward
+    prompts, completions, answers, questions = data
+    for start in range(0, len(completions), REWARD_BATCH_SIZE):
+        end = start + REWARD_BATCH_SIZE
+        combined_reward(prompts[start:end], completions[start:end], answers[start:end],
+                        log_every=0, question=questions[start:end])
+
+
+# name -> (input data, needs a tokenizer, function)
+BENCHMARKS = {
+    "clean_openmath": ("openmath", False, bench_clean_openmath),
+    "clean_deepwriting": ("deepwriting", False, bench_clean_deepwriting),
+    "shuffle_and_split": ("openmath", False, bench_shuffle_and_split),
+    "hash_split": ("openmath", False, bench_hash_split),
+    "format_openmath": ("openmath", True, bench_format_openmath),
+    "format_deepwriting": ("deepwriting", True, bench_format_deepwriting),
+    "format_openmath_text": ("openmath", False, bench_format_openmath_text),
+    "format_deepwriting_text": ("deepwriting", False, bench_format_deepwriting_text),
+    "inspect_token_lengths": ("openmath", True, bench_inspect_token_lengths),
+    "combined_reward": ("completions", False, bench_combined_reward),
+}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux; children reports the largest finished worker
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / 1024
+
+
+def _run_in_process(name, data_args, tokenizer_path, num_proc, queue):
+    """Child process: loads inputs, then times one benchmark in an empty working directory."""
+    import datasets
+    datasets.disable_caching()
+    datasets.disable_progress_bars()
+
+    kind, needs_tokenizer, fn = BENCHMARKS[name]
+    if kind == "completions":
+        data = synthetic_completions(data_args["num_rows"], seed=data_args["seed"])
+    else:
+        data = synthetic_dataset(kind, **data_args)
+    tokenizer = None
+    if needs_tokenizer:
+        from data_formatting.tokenization import load_tokenizer
+        tokenizer = load_tokenizer(tokenizer_path)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        start = time.perf_counter()
+        fn(data, tokenizer, num_proc)
+        seconds = time.perf_counter() - start
+    queue.put({"seconds": seconds, "peak_rss_mb": _peak_rss_mb()})
+
+
+def run_benchmark(name, data_args, tokenizer_path=None, num_proc=None):
+    """Runs one benchmark in a fresh process; returns seconds, rows/sec and peak RSS."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_in_process, args=(name, data_args, tokenizer_path, num_proc, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark {name} failed with exit code {process.exitcode}")
+    result = queue.get()
+    result["rows"] = data_args["num_rows"]
+    result["rows_per_sec"] = data_args["num_rows"] / result["seconds"]
+    return result
+
+
+def compare(results, baseline, speed_tolerance=SPEED_TOLERANCE, rss_tolerance=RSS_TOLERANCE):
+    """Returns regression messages for benchmarks slower or bigger than the baseline allows."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        if result["rows_per_sec"] < reference["rows_per_sec"] * (1 - speed_tolerance):
+            regressions.append(
+                f"{key}: {result['rows_per_sec']:.0f} rows/sec vs baseline {reference['rows_per_sec']:.0f}"
+            )
+        if result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + rss_tolerance):
+            regressions.append(
+                f"{key}: peak RSS {result['peak_rss_mb']:.0f} MB vs baseline {reference['peak_rss_mb']:.0f} MB"
+            )
+    return regressions
+
+
+def _write_json(path, payload):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark data-prep and reward hot paths.")
+    parser.add_argument("--sizes", nargs="+", default=SIZES, help="Row counts, e.g. 10k 100k 1M.")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Benchmarks to run (default: all).")
+    parser.add_argument("--tokenizer", default=os.environ.get("TOKENIZER_NAME"),
+                        help="Local tokenizer directory; tokenizer benchmarks are skipped without one.")
+    parser.add_argument("--num-proc", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per benchmark; the fastest is kept.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--duplicate-rate", type=float, default=DUPLICATE_RATE)
+    parser.add_argument("--empty-rate", type=float, default=EMPTY_RATE)
+    parser.add_argument("--non-english-rate", type=float, default=NON_ENGLISH_RATE)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", help="Baseline results to compare against.")
+    parser.add_argument("--save-baseline", help="Also write the results to this baseline file.")
+    parser.add_argument("--speed-tolerance", type=float, default=SPEED_TOLERANCE)
+    parser.add_argument("--rss-tolerance", type=float, default=RSS_TOLERANCE)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        data_args = {
+            "num_rows": parse_size(size), "seed": args.seed, "duplicate_rate": args.duplicate_rate,
+            "empty_rate": args.empty_rate, "non_english_rate": args.non_english_rate,
+        }
+        for kind in ("openmath", "deepwriting"):
+            synthetic_dataset(kind, **data_args)  # generate once, outside the timings
+
+        for name, (kind, needs_tokenizer, _) in BENCHMARKS.items():
+            if args.only and name not in args.only:
+                continue
+            if needs_tokenizer and not args.tokenizer:
+                print(f"Skipping {name}: no --tokenizer given")
+                continue
+            inputs = {"num_rows": data_args["num_rows"], "seed": args.seed} if kind == "completions" else data_args
+            runs = [run_benchmark(name, inputs, args.tokenizer, args.num_proc) for _ in range(args.repeat)]
+            best = min(runs, key=lambda run: run["seconds"])
+            best["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+            results[f"{name}/{size}"] = best
+            print(f"{name}/{size}: {best['seconds']:.2f}s, {best['rows_per_sec']:.0f} rows/sec, "
+                  f"peak RSS {best['peak_rss_mb']:.0f} MB")
+
+    payload = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "num_proc": args.num_proc,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    _write_json(args.output, payload)
+    print(f"Results written to {args.output}")
+    if args.save_baseline:
+        _write_json(args.save_baseline, payload)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.speed_tolerance, args.rss_tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
@@ -0,0 +1,120 @@
+"""
+synthetic.py
+
+Synthetic OpenMath-shaped and DeepWriting-shaped datasets for the benchmarks.
+
+Rows have the same columns as the real datasets. A configurable share of rows are exact
+duplicates of an earlier row's key (question / prompt), have an empty required field,
+or are written in a non-English vocabulary. Generation is seeded and the datasets are
+saved under BENCH_DATA_DIR, so every benchmark run reads identical data.
+
+Functions:
+- synthetic_batch(kind, num_rows, rng, ...): one batch of columns.
+- synthetic_dataset(kind, num_rows, ...): cached Dataset of num_rows rows.
+- synthetic_completions(num_rows, seed): GRPO-style completions and answers for the reward benchmarks.
+"""
+
+import os
+
+import numpy as np
+from datasets import Dataset, concatenate_datasets, load_from_disk
+
+from grpo.prompts import format_prompt
+
+BENCH_DATA_DIR = "data/.bench"
+GENERATE_BATCH_SIZE = 10_000
+
+DUPLICATE_RATE = 0.05
+EMPTY_RATE = 0.01
+NON_ENGLISH_RATE = 0.05
+
+ENGLISH_WORDS = (
+    "the a number of apples is total each there are how many more than twice half sum find "
+    "value if then what remaining students books price costs dollars per week day story write "
+    "character city night letter friend memory describe journey why because after before and"
+).split()
+NON_ENGLISH_WORDS = "的 一 是 在 不 了 有 和 人 这 中 大 为 上 个 国 我 以 要 他 时 来 用 们 生 到 作 地 于 出".split()
+
+
+def _texts(rng, words, num_rows, min_words, max_words):
+    lengths = rng.integers(min_words, max_words, size=num_rows)
+    indices = rng.integers(0, len(words), size=int(lengths.sum()))
+    vocabulary = np.array(words, dtype=object)[indices]
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [" ".join(vocabulary[bounds[i]:bounds[i + 1]]) for i in range(num_rows)]
+
+
+def synthetic_batch(kind, num_rows, rng, duplicate_rate=DUPLICATE_RATE, empty_rate=EMPTY_RATE,
+                    non_english_rate=NON_ENGLISH_RATE):
+    """Returns one batch of OpenMath ("openmath") or DeepWriting ("deepwriting") shaped columns."""
+    non_english = rng.random(num_rows) < non_english_rate
+    english_prompts = _texts(rng, ENGLISH_WORDS, num_rows, 15, 60)
+    other_prompts = _texts(rng, NON_ENGLISH_WORDS, num_rows, 15, 60)
+    prompts = [other if flag else english for english, other, flag in zip(english_prompts, other_prompts, non_english)]
+    solutions = _texts(rng, ENGLISH_WORDS, num_rows, 50, 400)
+
+    # Duplicates repeat the key of an earlier row in the batch
+    duplicates = np.flatnonzero(rng.random(num_rows) < duplicate_rate)
+    duplicates = duplicates[duplicates > 0]
+    for i, source in zip(duplicates, rng.integers(0, duplicates, size=len(duplicates))):
+        prompts[i] = prompts[source]
+    for i in np.flatnonzero(rng.random(num_rows) < empty_rate):
+        solutions[i] = ""
+
+    if kind == "openmath":
+        answers = rng.integers(0, 1000, size=num_rows).astype(str).tolist()
+        return {
+            "question": prompts,
+            "generated_solution": solutions,
+            "expected_answer": answers,
+            "predicted_answer": answers,
+            "error_message": [""] * num_rows,
+            "is_correct": [True] * num_rows,
+            "dataset": ["gsm8k"] * num_rows,
+        }
+    if kind == "deepwriting":
+        return {"prompt": prompts, "solution": solutions}
+    raise ValueError(f"Unknown dataset kind: {kind}")
+
+
+def synthetic_dataset(kind, num_rows, seed=42, duplicate_rate=DUPLICATE_RATE, empty_rate=EMPTY_RATE,
+                      non_english_rate=NON_ENGLISH_RATE, data_dir=BENCH_DATA_DIR):
+    """Returns the synthetic dataset, generating and saving it on first use."""
+    save_dir = os.path.join(
+        data_dir, f"{kind}-{num_rows}-{seed}-{duplicate_rate}-{empty_rate}-{non_english_rate}"
+    )
+    if os.path.exists(save_dir):
+        return load_from_disk(save_dir)
+
+    print(f"Generating {num_rows} synthetic {kind} rows...")
+    rng = np.random.default_rng(seed)
+    batches = [
+        Dataset.from_dict(synthetic_batch(
+            kind, min(GENERATE_BATCH_SIZE, num_rows - start), rng,
+            duplicate_rate=duplicate_rate, empty_rate=empty_rate, non_english_rate=non_english_rate,
+        ))
+        for start in range(0, num_rows, GENERATE_BATCH_SIZE)
+    ]
+    concatenate_datasets(batches).save_to_disk(save_dir)
+    return load_from_disk(save_dir)
+
+
+def synthetic_completions(num_rows, seed=42):
+    """Returns (prompts, completions, answers, questions) mixing well-formed, partial and malformed outputs."""
+    rng = np.random.default_rng(seed)
+    reasoning = _texts(rng, ENGLISH_WORDS, num_rows, 20, 300)
+    answers = rng.integers(0, 1000, size=num_rows)
+    guesses = np.where(rng.random(num_rows) < 0.5, answers, answers + rng.integers(-100, 100, size=num_rows))
+    shapes = rng.integers(0, 4, size=num_rows)
+    completions = []
+    for text, guess, shape in zip(reasoning, guesses, shapes):
+        if shape == 0:
+            completions.append(f"<reasoning>{text}</reasoning><answer>{guess}</answer>")
+        elif shape == 1:
+            completions.append(f"<reasoning>{text}</reasoning>\n<answer>The answer is {guess}</answer>\n")
+        elif shape == 2:
+            completions.append(f"{text} so the answer is {guess}")
+        else:
+            completions.append(f"<reasoning>{text}<answer>{guess}</answer><answer>{guess}")
+    questions = _texts(rng, ENGLISH_WORDS, num_rows, 15, 60)
+    return [format_prompt(question) for question in questions], completions, answers.astype(str).tolist(), questions
@@ -0,0 +1,156 @@
+"""
+arrow_text.py
+
+pyarrow.compute string kernels for the cleaning and formatting hot paths.
+
+The cleaning modules strip whitespace and check for empty fields, and the formatting
+modules join fields into the <reasoning>/<answer> SFT template. Done per row in Python,
+most of that time is interpreter overhead; these helpers do the same on whole Arrow
+columns, and their output is byte-identical to the Python versions:
+- strip() trims exactly the characters str.strip() trims (every c with c.isspace()),
+  passed explicitly so the result does not depend on Arrow's whitespace tables.
+- word_counts() matches len(text.split()), truncate_words() " ".join(text.split()[:n]).
+- Non-string columns are converted with str(), like the f-strings they replace.
+
+BACKEND selects the default path ("arrow" or "python") for the modules that offer both.
+
+Functions:
+- as_string(column): string column, converting other types with str().
+- strip(column): str.strip() on every value; nulls stay null.
+- non_empty(column): True where the value is not null and not only whitespace.
+- word_counts(text): len(text.split()) for every value.
+- truncate_words(text, max_words): text cut to max_words whitespace-separated words, and word counts.
+- join_template(parts): element-wise concatenation of columns and literal strings.
+- normalise_table(table, fields): strips the given fields of an Arrow table.
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+BACKEND = "arrow"
+
+# Every character str.strip() / str.split() treat as whitespace, i.e. every c with c.isspace()
+PY_WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005"
+    "\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+_NON_ASCII_WHITESPACE = "[" + "".join(c for c in PY_WHITESPACE if ord(c) > 127) + "]"
+
+
+def _combined(column):
+    return column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+
+
+def as_string(column):
+    """Returns a string column; other types are converted value by value with str()."""
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return column
+    return pa.array([str(value) if value is not None else None for value in column.to_pylist()], pa.string())
+
+
+def strip(column):
+    """str(value).strip() for every value, keeping nulls."""
+    return pc.utf8_trim(as_string(column), characters=PY_WHITESPACE)
+
+
+def non_empty(column):
+    """True where `value is not None and str(value).strip() != ""`."""
+    return pc.fill_null(pc.greater(pc.utf8_length(strip(column)), 0), False)
+
+
+def _words(text):
+    """(offsets, data, is_word, is_start) over the UTF-8 bytes of a string array.
+
+    Non-ASCII whitespace is first replaced by a space, so every byte >= 0x80 is part of a
+    word and words can be found byte by byte; offsets are rebased to the data.
+    """
+    text = _combined(as_string(text))
+    if not pc.all(pc.string_is_ascii(text)).as_py():
+        text = pc.replace_substring_regex(text, _NON_ASCII_WHITESPACE, " ")
+    _, offsets, data = text.buffers()
+    offset_type = np.int64 if pa.types.is_large_string(text.type) else np.int32
+    offsets = np.frombuffer(offsets, offset_type)[text.offset:text.offset + len(text) + 1].astype(np.int64)
+    data = np.frombuffer(data, np.uint8) if data is not None else np.empty(0, np.uint8)
+    data = data[offsets[0]:offsets[-1]]
+    offsets -= offsets[0]
+
+    # ASCII whitespace is \t..\r (9-13) and \x1c..space (28-32); uint8 subtraction wraps around
+    is_word = ~(((data - np.uint8(9)) < 5) | ((data - np.uint8(28)) < 5))
+    is_start = np.empty_like(is_word)
+    if len(data):
+        is_start[0] = is_word[0]
+        np.greater(is_word[1:], is_word[:-1], out=is_start[1:])
+        # A value's first byte starts a word if it is not whitespace, whatever precedes it
+        firsts = offsets[:-1][offsets[:-1] < len(data)]
+        is_start[firsts] = is_word[firsts]
+    return offsets, data, is_word, is_start
+
+
+def _word_counts(text):
+    """(int64 counts, offsets, data, is_word, word start positions); counts are 0 for nulls."""
+    offsets, data, is_word, is_start = _words(text)
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.searchsorted(starts, offsets))
+    return counts, offsets, data, is_word, starts
+
+
+def word_counts(text):
+    """len(value.split()) for every value (null for nulls), as an int64 array.
+
+    Counts word starts directly on the UTF-8 buffer, instead of materialising the words.
+    """
+    counts = _word_counts(text)[0]
+    return pa.array(counts, pa.int64(), mask=_combined(text).is_null().to_numpy(zero_copy_only=False))
+
+
+def _first_words(data, is_word, start, cut):
+    """" ".join(value.split()) for the value bytes data[start:cut], where cut is the start of a word."""
+    words = is_word[start:cut]
+    keep = words.copy()
+    # Whitespace runs collapse to their first byte, turned into a space, and the last one goes
+    keep[1:] |= words[:-1]
+    return np.where(words, data[start:cut], np.uint8(32))[keep][:-1]
+
+
+def truncate_words(text, max_words):
+    """Returns (text, num_tokens): like `" ".join(value.split()[:max_words])` on values over max_words words.
+
+    Values within max_words are returned unchanged, with num_tokens = len(value.split());
+    truncated values get num_tokens = max_words.
+    """
+    text = _combined(as_string(text))
+    counts, offsets, data, is_word, starts = _word_counts(text)
+    nulls = text.is_null().to_numpy(zero_copy_only=False)
+    too_long = (counts > max_words) & ~nulls
+    if not too_long.any():
+        return text, pa.array(counts, pa.int64(), mask=nulls)
+
+    rows = np.flatnonzero(too_long)
+    # Each truncated value is cut where its (max_words + 1)-th word starts
+    cuts = starts[np.searchsorted(starts, offsets[rows]) + max_words]
+    pieces = [_first_words(data, is_word, offsets[row], cut) if max_words else np.empty(0, np.uint8)
+              for row, cut in zip(rows, cuts)]
+    new_offsets = np.concatenate([[0], np.cumsum([len(piece) for piece in pieces])]).astype(np.int32)
+    truncated = pa.StringArray.from_buffers(len(rows), pa.py_buffer(new_offsets),
+                                            pa.py_buffer(np.concatenate(pieces)))
+    text = pc.replace_with_mask(text, pa.array(too_long), truncated.cast(text.type))
+    return text, pa.array(np.where(too_long, max_words, counts), pa.int64(), mask=nulls)
+
+
+def join_template(parts):
+    """Concatenates columns and literal strings element-wise: join_template([question, "\\n<reasoning>\\n", ...])."""
+    length = next(len(part) for part in parts if not isinstance(part, str))
+    columns = [pa.array([part] * length, pa.string()) if isinstance(part, str) else _combined(as_string(part))
+               for part in parts]
+    return pc.binary_join_element_wise(*columns, "")
+
+
+def normalise_table(table, fields):
+    """Returns the table with every present field stripped (converted to string, like str(value).strip())."""
+    for field in fields:
+        if field in table.column_names:
+            index = table.column_names.index(field)
+            stripped = strip(table.column(field))
+            table = table.set_column(index, pa.field(field, stripped.type), stripped)
+    return table
@@ -1,10 +1,24 @@
-from datasets import load_from_disk, Dataset
-from langdetect import detect, DetectorFactory
+import os
+
+import pyarrow.compute as pc
+from datasets import load_from_disk
+
+from data_cleaning import arrow_text
+from data_cleaning.arrow_text import BACKEND
+from data_cleaning.decontaminate import find_clean_rows, load_index
+from data_cleaning.dedup import deduplicate, find_duplicates
+from data_cleaning.key_store import find_unseen
+from data_cleaning.language_filter import LANGUAGE_CACHE_PATH, SAMPLE_CHARS, filter_language, find_language_rows
+from data_cleaning.near_dedup import find_near_duplicates
+from data_cleaning.pipeline import filter_step, run_pipeline, select_step, transform_step
+from data_pipeline.stage_cache import run_stage
+from data_pipeline.instrumentation import instrumented
 
 # #Relative path
 CLEANED_SAVE_DIR = "data/deepwriting_cleaned"
+NEAR_DEDUP_INDEX_DIR = "data/deepwriting_minhash_index"
 
-DetectorFactory.seed = 0  # For consistent language detection results
+TEXT_FIELDS = ['prompt', 'solution']
 
 def inspect_dataset(dataset):
     """Provides summary statistics of empty fields, duplicates."""
@@ -18,81 +32,136 @@ def inspect_dataset(dataset):
     print(f"Number of empty solution' fields: {num_empty_solutions}")
 
 
-def filter_english_text(dataset, prompt_field='prompt', solution_field='solution'):
-    """Filters the dataset to retain only English text."""
-    def is_english(row):
-        try:
-            prompt_text = str(row.get(prompt_field, "")).strip()
-            solution_text = str(row.get(solution_field, "")).strip()
+@instrumented
+def filter_english_text(dataset, prompt_field='prompt', solution_field='solution', num_proc=None,
+                        max_chars=SAMPLE_CHARS, cache_path=LANGUAGE_CACHE_PATH):
+    """Filters the dataset to retain only English text.
 
-            if not prompt_text or not solution_text:
-                return False
-            return detect(prompt_text) == 'en' and detect(solution_text) == 'en'
-        except Exception:
-            return False
-
-    english_rows = [row for row in dataset if is_english(row)]
-    filtered_dataset = Dataset.from_list(english_rows)
+    Detection runs on a bounded sample of each text in a process pool, skips the solution
+    once the prompt fails and is memoised on disk (see language_filter.py).
+    """
+    filtered_dataset = filter_language(
+        dataset, [prompt_field, solution_field], language='en', num_proc=num_proc,
+        max_chars=max_chars, cache_path=cache_path,
+    )
     print(f"Filtered dataset to retain only English text. New length: {len(filtered_dataset)}")
     return filtered_dataset
 
-def remove_empty_rows(dataset):
+def has_prompt_and_solution(batch):
+    """Batched predicate: True for rows with a non-empty prompt and solution."""
+    return [
+        prompt is not None and str(prompt).strip() != "" and
+        solution is not None and str(solution).strip() != ""
+        for prompt, solution in zip(batch["prompt"], batch["solution"])
+    ]
+
+def normalise_batch(batch):
+    """Batched transform: strips whitespace from the prompt and solution fields."""
+    for field in TEXT_FIELDS:
+        if field in batch:
+            batch[field] = [str(value).strip() if value is not None else None for value in batch[field]]
+    return batch
+
+def has_prompt_and_solution_arrow(table):
+    """Arrow version of has_prompt_and_solution(), on a pyarrow Table."""
+    mask = arrow_text.non_empty(table.column(TEXT_FIELDS[0]))
+    for field in TEXT_FIELDS[1:]:
+        mask = pc.and_(mask, arrow_text.non_empty(table.column(field)))
+    return mask.to_numpy(zero_copy_only=False)
+
+def normalise_table(table):
+    """Arrow version of normalise_batch(), on a pyarrow Table."""
+    return arrow_text.normalise_table(table, TEXT_FIELDS)
+
+@instrumented
+def remove_empty_rows(dataset, backend=BACKEND):
     """Removes rows with empty prompt or solution fields."""
-
-    def is_row_valid(row):
-        prompt = row.get("prompt")
-        solution = row.get("solution")
-
-        return (
-            prompt is not None and str(prompt).strip() != "" and
-            solution is not None and str(solution).strip() != ""
-        )
-    valid_rows = [row for row in dataset if is_row_valid(row)]
-    cleaned_dataset = Dataset.from_list(valid_rows)
+    if backend == "arrow":
+        steps = [filter_step("Removing Empty Rows", has_prompt_and_solution_arrow, TEXT_FIELDS, arrow=True)]
+    else:
+        steps = [filter_step("Removing Empty Rows", has_prompt_and_solution, TEXT_FIELDS)]
+    cleaned_dataset, _ = run_pipeline(dataset, steps, verbose=False)
 
     print(f"Removed {len(dataset) - len(cleaned_dataset)} rows with empty 'prompt' or 'solution' fields.")
     return cleaned_dataset
 
-def remove_duplicate_prompts(dataset):
-    """Removes duplicate prompts from the dataset."""
-    seen = set()
-    unique_rows= []
-
-    for row in dataset:
-        prompt_key = str(row['prompt'])
-
-        if prompt_key not in seen:
-            unique_rows.append(row)
-            seen.add(prompt_key)
-
-    deduped_dataset = Dataset.from_list(unique_rows)
-    print(f"Removed {len(dataset) - len(deduped_dataset)} duplicate prompts.")
+@instrumented
+def remove_duplicate_prompts(dataset, num_proc=None):
+    """Removes duplicate prompts from the dataset, keeping the first occurrence."""
+    deduped_dataset, duplicate_count = deduplicate(dataset, 'prompt', num_proc=num_proc)
+    print(f"Removed {duplicate_count} duplicate prompts.")
     return deduped_dataset
 
-def normalise_text(dataset):
+@instrumented
+def normalise_text(dataset, backend=BACKEND):
     """Normalises text fields by stripping whitespace."""
-    def normalize_row(row):
-        if "prompt" in row and row["prompt"] is not None:
-            row["prompt"] = str(row["prompt"]).strip()
-        if "solution" in row and row["solution"] is not None:
-            row["solution"] = str(row["solution"]).strip()
-        return row
-
-    normalized_dataset = dataset.map(normalize_row)
+    if backend == "arrow":
+        normalized_dataset = dataset.with_format("arrow").map(normalise_table, batched=True).with_format(None)
+    else:
+        normalized_dataset = dataset.map(normalise_batch, batched=True)
     print("Normalized text fields by stripping whitespace.")
     return normalized_dataset
 
 
-def clean_deepwriting(dataset, save=False, save_dir=CLEANED_SAVE_DIR):
-    """Cleans the DeepWriting dataset by removing duplicates, empty rows, and normalizing text, with optional saving."""
+def cleaning_steps(near_dedup_threshold=None, near_dedup_index_dir=NEAR_DEDUP_INDEX_DIR,
+                   decontamination_index_dirs=None, backend=BACKEND, key_store=None):
+    """English filter, dedup, optional near-dedup, empty-row removal and normalisation as fused pipeline steps.
+
+    With a key_store (see key_store.py), dedup also drops keys seen in earlier runs and
+    records the new ones, so only a delta needs cleaning.
+    """
+    if key_store is None:
+        dedup = lambda dataset, num_proc: find_duplicates(dataset, 'prompt', num_proc=num_proc)[0]
+    else:
+        dedup = lambda dataset, num_proc: find_unseen(dataset, 'prompt', key_store, num_proc=num_proc)
+    steps = [
+        select_step(
+            "After Filtering English Text",
+            lambda dataset, num_proc: find_language_rows(dataset, TEXT_FIELDS, language='en', num_proc=num_proc),
+        ),
+        select_step("After Removing Duplicates", dedup),
+    ]
+    if near_dedup_threshold is not None:
+        steps.append(select_step(
+            "After Removing Near Duplicates",
+            lambda dataset, num_proc: find_near_duplicates(
+                dataset, 'prompt', threshold=near_dedup_threshold,
+                num_proc=num_proc, index_dir=near_dedup_index_dir,
+            )[0],
+        ))
+    if decontamination_index_dirs:
+        indexes = [load_index(index_dir) for index_dir in decontamination_index_dirs]
+        steps.append(select_step(
+            "After Decontamination",
+            lambda dataset, num_proc: find_clean_rows(dataset, TEXT_FIELDS, indexes, num_proc=num_proc),
+        ))
+    if backend == "arrow":
+        steps.append(filter_step("After Removing Empty Rows", has_prompt_and_solution_arrow, TEXT_FIELDS, arrow=True))
+        steps.append(transform_step("After Normalisation", normalise_table, TEXT_FIELDS, arrow=True))
+    else:
+        steps.append(filter_step("After Removing Empty Rows", has_prompt_and_solution, TEXT_FIELDS))
+        steps.append(transform_step("After Normalisation", normalise_batch, TEXT_FIELDS))
+    return steps
+
+
+@instrumented
+def clean_deepwriting(dataset, save=False, save_dir=CLEANED_SAVE_DIR, num_proc=None,
+                      near_dedup_threshold=None, near_dedup_index_dir=NEAR_DEDUP_INDEX_DIR,
+                      decontamination_index_dirs=None, backend=BACKEND, key_store=None):
+    """Cleans the DeepWriting dataset by removing duplicates, empty rows, and normalizing text, with optional saving.
+
+    All steps run as one fused pass, so the cleaned table is written once.
+    Set near_dedup_threshold (e.g. 0.8) to also drop paraphrased prompts via MinHash/LSH.
+    Pass decontamination_index_dirs (built by decontaminate.py) to drop rows overlapping eval sets.
+    backend="python" runs the empty-row check and normalisation per row instead of with Arrow kernels.
+    Pass a key_store to clean a delta: keys already in the store count as duplicates.
+    """
     print("Inspecting dataset before cleaning...")
     inspect_dataset(dataset)
 
-    dataset = filter_english_text(dataset)
-    dataset = remove_duplicate_prompts(dataset)
-    dataset = remove_empty_rows(dataset)
-    dataset = normalise_text(dataset)
-  
+    steps = cleaning_steps(near_dedup_threshold, near_dedup_index_dir, decontamination_index_dirs, backend,
+                           key_store)
+    dataset, _ = run_pipeline(dataset, steps, num_proc=num_proc)
 
     print("Final stats:")
     inspect_dataset(dataset)
@@ -113,7 +182,12 @@ if __name__ == "__main__":
     print(dataset[0]['prompt'])
     print(type(dataset[0]['prompt']))
 
-    cleaned_dataset = clean_deepwriting(dataset, save=True)
+    cleaned_dataset = run_stage(
+        "clean_deepwriting", clean_deepwriting,
+        inputs={"dataset": dataset},
+        run_kwargs={"num_proc": os.cpu_count()},
+        save_dirs={"output": CLEANED_SAVE_DIR},
+    )["output"]
 
     #Final inspection
     print("\nFinal sample after cleaning:")
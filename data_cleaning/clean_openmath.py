@@ -1,7 +1,24 @@
-from datasets import load_from_disk, Dataset
+import os
+
+import pyarrow.compute as pc
+from datasets import load_from_disk
+
+from data_cleaning import arrow_text
+from data_cleaning.arrow_text import BACKEND
+from data_cleaning.decontaminate import find_clean_rows, load_index
+from data_cleaning.dedup import deduplicate, find_duplicates
+from data_cleaning.key_store import find_unseen
+from data_cleaning.near_dedup import find_near_duplicates
+from data_cleaning.pipeline import filter_step, run_pipeline, select_step, transform_step
+from data_pipeline.stage_cache import run_stage
+from data_pipeline.instrumentation import instrumented
 
 # #Relative path
 CLEANED_SAVE_DIR = "data/openmath_cleaned"
+NEAR_DEDUP_INDEX_DIR = "data/openmath_minhash_index"
+
+# only question, generated_solution, expected_answer are relevant for model learning
+REQUIRED_FIELDS = ['question', 'generated_solution', 'expected_answer']
 
 def inspect_dataset(dataset):
     """Provides summary statistics of empty fields, duplicates and rows with errors,before cleaning."""
@@ -9,7 +26,6 @@ def inspect_dataset(dataset):
     
     print("Dataset length:", len(dataset))
     #Count empty fields
-    # only question, generated_solution, expected_answer are relevant for model learning
     num_empty_questions = sum(1 for x in dataset ['question'] if not x or str(x).strip() == "")
     num_empty_solutions = sum(1 for x in dataset ['generated_solution'] if not x or str(x).strip() == "")
     num_empty_answers = sum(1 for x in dataset ['expected_answer'] if not x or str(x).strip() == "")
@@ -17,58 +33,62 @@ def inspect_dataset(dataset):
     print(f"Number of empty 'generated solution' fields: {num_empty_solutions}")
     print(f"Number of empty 'expected answer' fields: {num_empty_answers}")
 
-def count_duplicate_questions(dataset):
+@instrumented
+def count_duplicate_questions(dataset, num_proc=None):
     """Counts duplicate questions in the dataset."""
-    seen = set()
-    duplicate_count = 0
-
-    for q in dataset['question']:
-        if q in seen:
-            duplicate_count += 1
-        else:
-            seen.add(q)
-
+    _, duplicate_count = find_duplicates(dataset, 'question', num_proc=num_proc)
     return duplicate_count
 
-def remove_duplicate_questions(dataset):
-    """Removes duplicate questions from the dataset."""
-    unique_questions = set()
-    unique_rows= []
-
-    for row in dataset:
-        if row['question'] not in unique_questions:
-            unique_rows.append(row)
-            unique_questions.add(row['question'])
-
-    deduped_dataset = Dataset.from_list(unique_rows)
-    print(f"Removed {len(dataset) - len(deduped_dataset)} duplicate questions.")
+@instrumented
+def remove_duplicate_questions(dataset, num_proc=None):
+    """Removes duplicate questions from the dataset, keeping the first occurrence."""
+    deduped_dataset, duplicate_count = deduplicate(dataset, 'question', num_proc=num_proc)
+    print(f"Removed {duplicate_count} duplicate questions.")
     return deduped_dataset
 
-def remove_empty_rows(dataset):
+def has_required_fields(batch):
+    """Batched predicate: True for rows whose required fields are all non-empty."""
+    return [
+        all(value is not None and str(value).strip() != "" for value in values)
+        for values in zip(*(batch[field] for field in REQUIRED_FIELDS))
+    ]
+
+def normalise_batch(batch):
+    """Batched transform: strips whitespace from the required text fields."""
+    for field in REQUIRED_FIELDS:
+        if field in batch:
+            batch[field] = [str(value).strip() if value is not None else None for value in batch[field]]
+    return batch
+
+def has_required_fields_arrow(table):
+    """Arrow version of has_required_fields(), on a pyarrow Table."""
+    mask = arrow_text.non_empty(table.column(REQUIRED_FIELDS[0]))
+    for field in REQUIRED_FIELDS[1:]:
+        mask = pc.and_(mask, arrow_text.non_empty(table.column(field)))
+    return mask.to_numpy(zero_copy_only=False)
+
+def normalise_table(table):
+    """Arrow version of normalise_batch(), on a pyarrow Table."""
+    return arrow_text.normalise_table(table, REQUIRED_FIELDS)
+
+@instrumented
+def remove_empty_rows(dataset, backend=BACKEND):
     """Removes rows with empty question, generated_solution, or expected_answer fields."""
-
-    required_fields = ['question', 'generated_solution', 'expected_answer'] 
-    
-    def is_row_valid(row):
-        for field in required_fields:
-            value = row.get(field)
-            if value is None or str(value).strip() == "":
-                return False
-        return True
-    clean_rows = [row for row in dataset if is_row_valid(row)]
-    non_empty_dataset = Dataset.from_list(clean_rows)
+    if backend == "arrow":
+        steps = [filter_step("Removing Empty Rows", has_required_fields_arrow, REQUIRED_FIELDS, arrow=True)]
+    else:
+        steps = [filter_step("Removing Empty Rows", has_required_fields, REQUIRED_FIELDS)]
+    non_empty_dataset, _ = run_pipeline(dataset, steps, verbose=False)
     print(f"Removed {len(dataset) - len(non_empty_dataset)} rows with empty required fields.")
     return non_empty_dataset
 
-def normalise_text(dataset):
+@instrumented
+def normalise_text(dataset, backend=BACKEND):
     """Normalises text fields by stripping whitespace."""
-    def normalize_row(row):
-        for field in ['question', 'generated_solution', 'expected_answer']:
-            if field in row and row[field] is not None:
-                row[field] = str(row[field]).strip()
-        return row
-
-    normalized_dataset = dataset.map(normalize_row)
+    if backend == "arrow":
+        normalized_dataset = dataset.with_format("arrow").map(normalise_table, batched=True).with_format(None)
+    else:
+        normalized_dataset = dataset.map(normalise_batch, batched=True)
     print("Normalized text fields by stripping whitespace.")
     return normalized_dataset
                                                       
@@ -88,18 +108,59 @@ def print_stats(dataset, label):
     print(f"\n--- {label} ---")
     print("Dataset length:", len(dataset))
 
-def clean_openmath(dataset, save=False, save_dir=CLEANED_SAVE_DIR):
-    """Cleans the OpenMath dataset by removing duplicates, empty rows, and normalizing text, with optional saving."""
+def cleaning_steps(near_dedup_threshold=None, near_dedup_index_dir=NEAR_DEDUP_INDEX_DIR,
+                   decontamination_index_dirs=None, backend=BACKEND, key_store=None):
+    """Dedup, optional near-dedup, empty-row removal and normalisation as fused pipeline steps.
+
+    With a key_store (see key_store.py), dedup also drops keys seen in earlier runs and
+    records the new ones, so only a delta needs cleaning.
+    """
+    if key_store is None:
+        dedup = lambda dataset, num_proc: find_duplicates(dataset, 'question', num_proc=num_proc)[0]
+    else:
+        dedup = lambda dataset, num_proc: find_unseen(dataset, 'question', key_store, num_proc=num_proc)
+    steps = [select_step("After Removing Duplicates", dedup)]
+    if near_dedup_threshold is not None:
+        steps.append(select_step(
+            "After Removing Near Duplicates",
+            lambda dataset, num_proc: find_near_duplicates(
+                dataset, 'question', threshold=near_dedup_threshold,
+                num_proc=num_proc, index_dir=near_dedup_index_dir,
+            )[0],
+        ))
+    if decontamination_index_dirs:
+        indexes = [load_index(index_dir) for index_dir in decontamination_index_dirs]
+        steps.append(select_step(
+            "After Decontamination",
+            lambda dataset, num_proc: find_clean_rows(
+                dataset, ['question', 'generated_solution'], indexes, num_proc=num_proc,
+            ),
+        ))
+    if backend == "arrow":
+        steps.append(filter_step("After Removing Empty Rows", has_required_fields_arrow, REQUIRED_FIELDS, arrow=True))
+        steps.append(transform_step("After Normalisation", normalise_table, REQUIRED_FIELDS, arrow=True))
+    else:
+        steps.append(filter_step("After Removing Empty Rows", has_required_fields, REQUIRED_FIELDS))
+        steps.append(transform_step("After Normalisation", normalise_batch, REQUIRED_FIELDS))
+    return steps
+
+@instrumented
+def clean_openmath(dataset, save=False, save_dir=CLEANED_SAVE_DIR, num_proc=None,
+                   near_dedup_threshold=None, near_dedup_index_dir=NEAR_DEDUP_INDEX_DIR,
+                   decontamination_index_dirs=None, backend=BACKEND, key_store=None):
+    """Cleans the OpenMath dataset by removing duplicates, empty rows, and normalizing text, with optional saving.
+
+    All steps run as one fused pass, so the cleaned table is written once.
+    Set near_dedup_threshold (e.g. 0.8) to also drop paraphrased questions via MinHash/LSH.
+    Pass decontamination_index_dirs (built by decontaminate.py) to drop rows overlapping eval sets.
+    backend="python" runs the empty-row check and normalisation per row instead of with Arrow kernels.
+    Pass a key_store to clean a delta: keys already in the store count as duplicates.
+    """
     print_stats(dataset, "Before Cleaning")
 
-    dataset = remove_duplicate_questions(dataset)
-    print_stats(dataset, "After Removing Duplicates")
-
-    dataset = remove_empty_rows(dataset)
-    print_stats(dataset, "After Removing Empty Rows")
-
-    dataset = normalise_text(dataset)
-    print_stats(dataset, "After Normalisation")
+    steps = cleaning_steps(near_dedup_threshold, near_dedup_index_dir, decontamination_index_dirs, backend,
+                           key_store)
+    dataset, _ = run_pipeline(dataset, steps, num_proc=num_proc)
 
     if save:
         dataset.save_to_disk(save_dir)
@@ -111,7 +172,12 @@ if __name__ == "__main__":
     print("Loading merged dataset from disk")
     dataset = load_from_disk("data/openmath_merged")
 
-    cleaned_dataset = clean_openmath(dataset, save=True)
+    cleaned_dataset = run_stage(
+        "clean_openmath", clean_openmath,
+        inputs={"dataset": dataset},
+        run_kwargs={"num_proc": os.cpu_count()},
+        save_dirs={"output": CLEANED_SAVE_DIR},
+    )["output"]
 
     #Final inspection
     print("\nFinal sample after cleaning:")
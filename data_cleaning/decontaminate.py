@@ -0,0 +1,270 @@
+"""
+decontaminate.py
+
+N-gram decontamination of the training data against evaluation sets (e.g. the GSM8K test
+questions scored by the notebook's evaluate()).
+
+Each eval set gets a persisted index of the hashes of its word n-grams, normalised like
+near_dedup.py (lowercase, punctuation and thousands separators dropped). The index is a
+Bloom filter, which rejects almost every training n-gram with a few bit lookups, plus
+the sorted exact hashes, which confirm the rare Bloom hits so false positives never
+flag a row. N-gram hashes are rolled from per-word hashes, so hashing is vectorised.
+
+Training rows are streamed through the indexes in batched, optionally parallel `map`
+passes. A row is contaminated when one of its fields shares at least min_hits n-grams
+with an eval set; contaminated rows are dropped or flagged with per-eval-set hit counts.
+Eval texts shorter than the n-gram size are indexed as a single n-gram of all their
+words, and only match training text with exactly those words.
+
+Functions:
+- ngram_hashes(texts, ngram_size): uint64 n-gram hashes and the text each belongs to.
+- build_index(name, paths, field, index_dir): builds (or reuses) the index of one eval set.
+- load_index(index_dir): a persisted index.
+- find_contaminated(dataset, fields, indexes): per-row hit counts for every index.
+- find_clean_rows(dataset, fields, indexes): indices of uncontaminated rows (a cleaning select step).
+- decontaminate(dataset, fields, indexes, mode): drops or flags contaminated rows.
+"""
+
+import json
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from datasets import load_from_disk
+
+from data_cleaning.near_dedup import normalise_for_minhash
+from data_loading.pushdown import scan_dataset
+from data_pipeline.instrumentation import instrumented
+
+INDEX_DIR = "data/decontamination_index"
+DECONTAMINATION_NGRAM = 13
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+MIN_HITS = 1
+DECONTAMINATION_BATCH_SIZE = 1000
+
+# name -> local eval files and the text field to index
+EVAL_SETS = {
+    "gsm8k_test": {"paths": ["data/eval/gsm8k_test.jsonl"], "field": "question"},
+}
+# cleaned dataset -> text fields checked against the eval sets
+DATASETS = {
+    "data/openmath_cleaned": ["question", "generated_solution"],
+    "data/deepwriting_cleaned": ["prompt", "solution"],
+}
+
+_ROLL_MULTIPLIER = np.uint64(0x100000001B3)
+
+NgramIndex = namedtuple("NgramIndex", ["name", "ngram_size", "bloom", "num_bits", "num_hashes", "hashes"])
+
+
+def ngram_hashes(texts, ngram_size=DECONTAMINATION_NGRAM):
+    """Returns (hashes, text_ids): one uint64 per word n-gram of every text and the index of its text."""
+    words = [normalise_for_minhash(text) for text in texts]
+    lengths = np.array([len(text_words) for text_words in words], dtype=np.int64)
+    flat = [word for text_words in words for word in text_words]
+    if not flat:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    word_hashes = pd.util.hash_array(np.array(flat, dtype=object))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+
+    # Roll ngram_size consecutive word hashes into one; short texts roll over all their words
+    span = np.minimum(lengths, ngram_size)
+    num_grams = np.where(lengths > 0, lengths - span + 1, 0)
+    text_ids = np.repeat(np.arange(len(texts)), num_grams)
+    first_gram = np.repeat(np.cumsum(num_grams) - num_grams, num_grams)
+    gram_starts = starts[text_ids] + np.arange(num_grams.sum()) - first_gram
+    gram_spans = span[text_ids]
+
+    hashes = np.zeros(len(gram_starts), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(ngram_size):
+            active = offset < gram_spans
+            hashes[active] = hashes[active] * _ROLL_MULTIPLIER ^ word_hashes[gram_starts[active] + offset]
+    return hashes, text_ids
+
+
+def _bloom_size(num_items, false_positive_rate):
+    num_bits = max(64, int(-num_items * np.log(false_positive_rate) / np.log(2) ** 2))
+    num_hashes = max(1, round(num_bits / max(num_items, 1) * np.log(2)))
+    return num_bits, num_hashes
+
+
+def _bloom_positions(hashes, num_bits, num_hashes):
+    """Double hashing: positions h1 + i * h2 (mod num_bits) from the two 32-bit halves of each hash."""
+    first = hashes & np.uint64(0xFFFFFFFF)
+    second = (hashes >> np.uint64(32)) | np.uint64(1)
+    steps = np.arange(num_hashes, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        return (first[:, None] + steps[None, :] * second[:, None]) % np.uint64(num_bits)
+
+
+def _bloom_add(bloom, hashes, num_bits, num_hashes):
+    positions = _bloom_positions(hashes, num_bits, num_hashes).ravel()
+    np.bitwise_or.at(bloom, positions >> np.uint64(6), np.uint64(1) << (positions & np.uint64(63)))
+
+
+def _bloom_contains(bloom, hashes, num_bits, num_hashes):
+    positions = _bloom_positions(hashes, num_bits, num_hashes)
+    bits = (bloom[positions >> np.uint64(6)] >> (positions & np.uint64(63))) & np.uint64(1)
+    return bits.all(axis=1)
+
+
+def _index_params(name, paths, field, ngram_size, false_positive_rate):
+    return {
+        "name": name,
+        "files": [[os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)] for path in paths],
+        "field": field,
+        "ngram_size": ngram_size,
+        "false_positive_rate": false_positive_rate,
+    }
+
+
+@instrumented
+def build_index(name, paths, field="question", index_dir=None, ngram_size=DECONTAMINATION_NGRAM,
+                false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+    """Builds the n-gram index of one eval set from local files, reusing the persisted one if it matches."""
+    index_dir = index_dir or os.path.join(INDEX_DIR, name)
+    params = _index_params(name, paths, field, ngram_size, false_positive_rate)
+    index_file = os.path.join(index_dir, "index.json")
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            if json.load(f)["params"] == params:
+                print(f"Reusing decontamination index {index_dir}")
+                return load_index(index_dir)
+
+    texts = scan_dataset(paths, columns=[field])[field]
+    hashes = np.unique(ngram_hashes(texts, ngram_size)[0])
+    num_bits, num_hashes = _bloom_size(len(hashes), false_positive_rate)
+    bloom = np.zeros(-(-num_bits // 64), dtype=np.uint64)
+    _bloom_add(bloom, hashes, num_bits, num_hashes)
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "bloom.npy"), bloom)
+    np.save(os.path.join(index_dir, "hashes.npy"), hashes)
+    with open(index_file, "w") as f:
+        json.dump({"params": params, "num_bits": num_bits, "num_hashes": num_hashes,
+                   "num_texts": len(texts), "num_ngrams": len(hashes)}, f, indent=2)
+    print(f"Indexed {len(hashes)} {ngram_size}-grams of {len(texts)} {name} texts in {index_dir} "
+          f"({bloom.nbytes / 2**10:.0f} KiB Bloom filter, {num_hashes} hashes)")
+    return NgramIndex(name, ngram_size, bloom, num_bits, num_hashes, hashes)
+
+
+def load_index(index_dir):
+    """Loads a persisted index (small enough to be copied into every worker process)."""
+    with open(os.path.join(index_dir, "index.json")) as f:
+        meta = json.load(f)
+    return NgramIndex(
+        meta["params"]["name"], meta["params"]["ngram_size"],
+        np.load(os.path.join(index_dir, "bloom.npy")), meta["num_bits"], meta["num_hashes"],
+        np.load(os.path.join(index_dir, "hashes.npy")),
+    )
+
+
+def _hits_column(index):
+    return f"{index.name}_hits"
+
+
+def _contamination_batch(*columns, indexes):
+    """Batched: for every index, the most n-grams any one field of a row shares with the eval set."""
+    num_rows = len(columns[0])
+    output = {_hits_column(index): np.zeros(num_rows, dtype=np.int32) for index in indexes}
+    for texts in columns:
+        for ngram_size in {index.ngram_size for index in indexes}:
+            hashes, text_ids = ngram_hashes(texts, ngram_size)
+            for index in indexes:
+                if index.ngram_size != ngram_size or len(hashes) == 0:
+                    continue
+                candidates = _bloom_contains(index.bloom, hashes, index.num_bits, index.num_hashes)
+                candidate_hashes = hashes[candidates]
+                # Confirm Bloom hits against the exact hashes
+                positions = np.searchsorted(index.hashes, candidate_hashes)
+                found = positions < len(index.hashes)
+                found[found] = index.hashes[positions[found]] == candidate_hashes[found]
+                hits = np.bincount(text_ids[candidates][found], minlength=num_rows)
+                name = _hits_column(index)
+                output[name] = np.maximum(output[name], hits)
+    return output
+
+
+@instrumented
+def find_contaminated(dataset, fields, indexes, num_proc=None, batch_size=DECONTAMINATION_BATCH_SIZE):
+    """Returns {eval set name: per-row hit counts} and the rows/sec of the pass."""
+    start = time.perf_counter()
+    hits = dataset.select_columns(list(fields)).map(
+        _contamination_batch,
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc,
+        input_columns=list(fields),
+        remove_columns=list(fields),
+        fn_kwargs={"indexes": list(indexes)},
+        desc="Decontamination",
+    )
+    counts = {index.name: hits.data.column(_hits_column(index)).to_numpy() for index in indexes}
+    seconds = time.perf_counter() - start
+    return counts, len(dataset) / seconds if seconds > 0 else float("inf")
+
+
+def _contaminated_mask(counts, min_hits):
+    contaminated = None
+    for name, hits in counts.items():
+        flagged = hits >= min_hits
+        print(f"{name}: {int(flagged.sum())} contaminated rows, {int(hits.sum())} n-gram hits")
+        contaminated = flagged if contaminated is None else contaminated | flagged
+    return contaminated
+
+
+def find_clean_rows(dataset, fields, indexes, min_hits=MIN_HITS, num_proc=None):
+    """Returns the sorted indices of rows below min_hits for every index."""
+    counts, rows_per_sec = find_contaminated(dataset, fields, indexes, num_proc=num_proc)
+    contaminated = _contaminated_mask(counts, min_hits)
+    print(f"Checked {len(dataset)} rows at {rows_per_sec:.0f} rows/sec")
+    return np.flatnonzero(~contaminated) if contaminated is not None else np.arange(len(dataset))
+
+
+@instrumented
+def decontaminate(dataset, fields, indexes, mode="drop", min_hits=MIN_HITS, num_proc=None):
+    """Drops (mode="drop") or flags (mode="flag") rows sharing at least min_hits n-grams with an eval set.
+
+    Flagging adds a "<eval set>_hits" column per index and a boolean "contaminated" column.
+    """
+    counts, rows_per_sec = find_contaminated(dataset, fields, indexes, num_proc=num_proc)
+    contaminated = _contaminated_mask(counts, min_hits)
+    if contaminated is None:
+        contaminated = np.zeros(len(dataset), dtype=bool)
+    print(f"Checked {len(dataset)} rows at {rows_per_sec:.0f} rows/sec: {int(contaminated.sum())} contaminated")
+
+    if mode == "flag":
+        for name, hits in counts.items():
+            dataset = dataset.add_column(f"{name}_hits", hits.tolist())
+        return dataset.add_column("contaminated", contaminated.tolist())
+    if mode != "drop":
+        raise ValueError(f"Unknown decontamination mode: {mode}")
+    if not contaminated.any():
+        return dataset
+    return dataset.select(np.flatnonzero(~contaminated))
+
+
+def build_eval_indexes(eval_sets=EVAL_SETS, index_dir=INDEX_DIR):
+    """Builds (or reuses) the index of every eval set whose files exist locally."""
+    indexes = []
+    for name, spec in eval_sets.items():
+        missing = [path for path in spec["paths"] if not os.path.exists(path)]
+        if missing:
+            print(f"Skipping eval set {name}: {missing} not found")
+            continue
+        indexes.append(build_index(name, spec["paths"], spec["field"], os.path.join(index_dir, name)))
+    return indexes
+
+
+if __name__ == "__main__":
+    indexes = build_eval_indexes()
+    for data_dir, fields in DATASETS.items():
+        if not indexes or not os.path.exists(data_dir):
+            print(f"Skipping {data_dir}")
+            continue
+        print(f"\n--- {data_dir} ---")
+        decontaminate(load_from_disk(data_dir), fields, indexes, mode="flag", num_proc=os.cpu_count())
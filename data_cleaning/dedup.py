@@ -0,0 +1,85 @@
+"""
+dedup.py
+
+Columnar exact-duplicate detection shared by the cleaning scripts.
+
+The key column is hashed batch by batch straight from the Arrow table, so rows are
+never materialised as Python dicts. Survivors are returned as an index selection over
+the original (memory-mapped) table instead of a rebuilt dataset.
+
+Functions:
+- hash_key_column(dataset, column): 64-bit hash of every key, optionally across processes.
+- find_duplicates(dataset, column): indices of first occurrences and the duplicate count.
+- deduplicate(dataset, column): dataset.select() of the first occurrences.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from data_pipeline.instrumentation import instrumented
+
+HASH_BATCH_SIZE = 100_000
+
+
+def _hash_batches(dataset, column, batch_size, hash_key):
+    """Hashes the key column of a dataset one Arrow batch at a time."""
+    hash_kwargs = {} if hash_key is None else {"hash_key": hash_key}
+    keys_only = dataset.select_columns([column]).with_format("arrow")
+
+    hashes = []
+    for batch in keys_only.iter(batch_size=batch_size):
+        keys = batch.column(column)
+        if not (pa.types.is_string(keys.type) or pa.types.is_large_string(keys.type)):
+            keys = pc.cast(keys, pa.string())
+        hashes.append(pd.util.hash_array(keys.to_numpy(zero_copy_only=False), **hash_kwargs))
+
+    if not hashes:
+        return np.empty(0, dtype=np.uint64)
+    return np.concatenate(hashes)
+
+
+def _hash_shard(args):
+    """Worker entry point: hashes one contiguous shard of the dataset."""
+    dataset, column, index, num_shards, batch_size, hash_key = args
+    shard = dataset.shard(num_shards=num_shards, index=index, contiguous=True)
+    return _hash_batches(shard, column, batch_size, hash_key)
+
+
+def hash_key_column(dataset, column, num_proc=None, batch_size=HASH_BATCH_SIZE, hash_key=None):
+    """Returns a uint64 hash for every value of `column`, in row order."""
+    if not num_proc or num_proc <= 1 or len(dataset) <= batch_size:
+        return _hash_batches(dataset, column, batch_size, hash_key)
+
+    # Contiguous shards keep the concatenated hashes in row order.
+    jobs = [(dataset, column, i, num_proc, batch_size, hash_key) for i in range(num_proc)]
+    with ProcessPoolExecutor(max_workers=num_proc) as pool:
+        return np.concatenate(list(pool.map(_hash_shard, jobs)))
+
+
+def first_occurrence_indices(hashes):
+    """Returns the sorted row indices of the first occurrence of every distinct hash."""
+    _, first_indices = np.unique(hashes, return_index=True)
+    first_indices.sort()
+    return first_indices
+
+
+@instrumented
+def find_duplicates(dataset, column, num_proc=None, batch_size=HASH_BATCH_SIZE):
+    """Returns the indices of rows to keep and the number of exact duplicates of `column`."""
+    hashes = hash_key_column(dataset, column, num_proc=num_proc, batch_size=batch_size)
+    keep_indices = first_occurrence_indices(hashes)
+    return keep_indices, len(hashes) - len(keep_indices)
+
+
+@instrumented
+def deduplicate(dataset, column, num_proc=None, batch_size=HASH_BATCH_SIZE):
+    """Keeps the first occurrence of every `column` value as an index selection over the dataset."""
+    keep_indices, duplicate_count = find_duplicates(
+        dataset, column, num_proc=num_proc, batch_size=batch_size
+    )
+    if duplicate_count == 0:
+        return dataset, 0
+    return dataset.select(keep_indices), duplicate_count
@@ -0,0 +1,68 @@
+"""
+hash_split.py
+
+Deterministic hash-based train/validation split shared by the split scripts.
+
+Every row is assigned from a seeded 64-bit hash of its key (question / prompt), computed
+in one vectorized pass over the Arrow key column. A row's split depends only on its own
+key and the seed, so appending rows never moves existing rows between splits, and rows
+with the same key always land in the same split. Both splits are sorted index
+selections, so they are written out by reading the source table sequentially, with no
+shuffle or train_test_split indices mapping.
+
+Functions:
+- split_hash_key(seed): the 16-character pandas hash_key derived from a seed.
+- train_mask(hashes, train_ratio): True for rows assigned to train.
+- hash_split(dataset, column, train_ratio, seed): (train, validation) datasets.
+- hash_split_stream(stream, column, train_ratio, seed): the same split on an IterableDataset.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from data_cleaning.dedup import HASH_BATCH_SIZE, hash_key_column
+from data_pipeline.instrumentation import instrumented
+
+
+def split_hash_key(seed):
+    """16-character hash_key for pd.util.hash_array, derived from the split seed."""
+    return hashlib.sha256(f"split-{seed}".encode()).hexdigest()[:16]
+
+
+def train_mask(hashes, train_ratio):
+    """Rows whose hash, read as a uniform number in [0, 1), falls below train_ratio go to train."""
+    # Top 53 bits are exactly representable as a float64
+    buckets = (np.asarray(hashes, dtype=np.uint64) >> np.uint64(11)).astype(np.float64) / 2.0**53
+    return buckets < train_ratio
+
+
+@instrumented
+def hash_split(dataset, column, train_ratio=0.1, seed=42, num_proc=None, batch_size=HASH_BATCH_SIZE):
+    """Returns (train, validation) as sorted index selections, assigned by a seeded hash of `column`."""
+    print("Splitting dataset by key hash...")
+    hashes = hash_key_column(
+        dataset, column, num_proc=num_proc, batch_size=batch_size, hash_key=split_hash_key(seed)
+    )
+    mask = train_mask(hashes, train_ratio)
+    return dataset.select(np.flatnonzero(mask)), dataset.select(np.flatnonzero(~mask))
+
+
+def _stream_mask(batch, column, train_ratio, hash_key, keep_train):
+    keys = np.asarray([key if key is None or isinstance(key, str) else str(key) for key in batch[column]],
+                      dtype=object)
+    mask = train_mask(pd.util.hash_array(keys, hash_key=hash_key), train_ratio)
+    return (mask if keep_train else ~mask).tolist()
+
+
+def hash_split_stream(stream, column, train_ratio=0.1, seed=42, batch_size=1000):
+    """Returns (train, validation) IterableDatasets with the same assignment as hash_split()."""
+    hash_key = split_hash_key(seed)
+    return tuple(
+        stream.filter(
+            _stream_mask, batched=True, batch_size=batch_size,
+            fn_kwargs={"column": column, "train_ratio": train_ratio, "hash_key": hash_key, "keep_train": keep_train},
+        )
+        for keep_train in (True, False)
+    )
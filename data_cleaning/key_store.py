@@ -0,0 +1,130 @@
+"""
+key_store.py
+
+Persistent store of the dedup keys already seen, for incremental (append) cleaning.
+
+The keys are the 64-bit hashes dedup.py computes for the question / prompt column. They
+are kept on disk as sorted uint64 .npy segments, one per append, that are memory-mapped
+and probed with np.searchsorted, so checking a delta costs O(delta * log(corpus)) and
+only touches the pages it needs; nothing proportional to the corpus is loaded. When
+there are more than MAX_SEGMENTS segments they are merged into one, so lookups stay at
+a few binary searches. segments.json lists the segments and the fingerprint of the data
+each one came from, so applying the same delta twice is detected.
+
+New keys are collected in the store's pending list while a delta is being cleaned and
+only written by commit(), once the delta's outputs have been saved.
+
+Functions:
+- open_key_store(store_dir): KeyStore with the memory-mapped segments.
+- num_keys(store): number of committed keys.
+- contains(store, hashes): True for the hashes already in the store.
+- find_unseen(dataset, column, store): indices of first occurrences whose key is not in the store.
+- has_source(store, fingerprint): whether a delta with this fingerprint was committed.
+- commit(store, fingerprint): writes the pending keys as a new segment.
+"""
+
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from data_cleaning.dedup import HASH_BATCH_SIZE, first_occurrence_indices, hash_key_column
+from data_pipeline.instrumentation import instrumented
+
+MAX_SEGMENTS = 8
+SEGMENTS_FILE = "segments.json"
+
+KeyStore = namedtuple("KeyStore", ["store_dir", "segments", "sources", "pending"])
+
+
+def _read_manifest(store_dir):
+    path = os.path.join(store_dir, SEGMENTS_FILE)
+    if not os.path.exists(path):
+        return {"segments": [], "sources": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(store_dir, manifest):
+    tmp_path = os.path.join(store_dir, f"{SEGMENTS_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(store_dir, SEGMENTS_FILE))
+
+
+def open_key_store(store_dir):
+    """Opens the store in store_dir (empty if it does not exist yet), memory-mapping its segments."""
+    manifest = _read_manifest(store_dir)
+    segments = [np.load(os.path.join(store_dir, segment["file"]), mmap_mode="r") for segment in manifest["segments"]]
+    return KeyStore(store_dir, segments, manifest["sources"], [])
+
+
+def num_keys(store):
+    return sum(len(segment) for segment in store.segments)
+
+
+def contains(store, hashes):
+    """True for every hash that is in one of the committed segments."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    found = np.zeros(len(hashes), dtype=bool)
+    for segment in store.segments:
+        if not len(segment):
+            continue
+        positions = np.searchsorted(segment, hashes)
+        positions[positions == len(segment)] = 0
+        found |= segment[positions] == hashes
+    return found
+
+
+@instrumented
+def find_unseen(dataset, column, store, num_proc=None, batch_size=HASH_BATCH_SIZE):
+    """Returns the sorted indices of rows to keep: first occurrences of keys not in the store.
+
+    The kept rows' hashes are added to store.pending, to be written by commit().
+    """
+    hashes = hash_key_column(dataset, column, num_proc=num_proc, batch_size=batch_size)
+    first_indices = first_occurrence_indices(hashes)
+    keep_indices = first_indices[~contains(store, hashes[first_indices])]
+    store.pending.append(hashes[keep_indices])
+    print(f"{len(first_indices) - len(keep_indices)} of {len(first_indices)} distinct keys were already seen "
+          f"({num_keys(store)} keys in {store.store_dir})")
+    return keep_indices
+
+
+def has_source(store, fingerprint):
+    return fingerprint in store.sources
+
+
+def _merge(store_dir, manifest):
+    """Merges all segments into one sorted segment."""
+    keys = np.unique(np.concatenate([
+        np.load(os.path.join(store_dir, segment["file"]), mmap_mode="r") for segment in manifest["segments"]
+    ]))
+    file_name = f"segment-{manifest['next_segment']:05d}.npy"
+    np.save(os.path.join(store_dir, file_name), keys)
+    old_files = [segment["file"] for segment in manifest["segments"]]
+    manifest["segments"] = [{"file": file_name, "num_keys": len(keys)}]
+    manifest["next_segment"] += 1
+    return old_files
+
+
+def commit(store, fingerprint):
+    """Writes the pending keys as a new segment, recording the delta's fingerprint; returns the reopened store."""
+    os.makedirs(store.store_dir, exist_ok=True)
+    manifest = _read_manifest(store.store_dir)
+    manifest.setdefault("next_segment", len(manifest["segments"]))
+
+    keys = np.unique(np.concatenate(store.pending)) if store.pending else np.empty(0, dtype=np.uint64)
+    file_name = f"segment-{manifest['next_segment']:05d}.npy"
+    np.save(os.path.join(store.store_dir, file_name), keys)
+    manifest["segments"].append({"file": file_name, "num_keys": len(keys)})
+    manifest["next_segment"] += 1
+    manifest["sources"].append(fingerprint)
+
+    old_files = _merge(store.store_dir, manifest) if len(manifest["segments"]) > MAX_SEGMENTS else []
+    _write_manifest(store.store_dir, manifest)
+    for old_file in old_files:
+        os.remove(os.path.join(store.store_dir, old_file))
+    print(f"Added {len(keys)} keys to {store.store_dir}")
+    return open_key_store(store.store_dir)
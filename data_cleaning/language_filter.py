@@ -0,0 +1,154 @@
+"""
+language_filter.py
+
+Parallel, cached language filtering used by clean_deepwriting.py.
+
+Each text is classified on a bounded sample (head and tail) instead of the full string,
+fields are checked in order so later fields are skipped once a row already fails, and
+detections run in a process pool over batches. Results are memoised in an on-disk
+SQLite cache keyed by the hash of the sampled text, so re-runs and repeated prompts
+cost nothing. The survivors are returned as an index selection over the input table.
+
+Functions:
+- sample_text(text, max_chars): bounded sample that is actually classified.
+- find_language_rows(dataset, fields, language): indices of rows whose fields all match.
+- filter_language(dataset, fields, language): dataset.select() of those rows.
+"""
+
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from langdetect import detect, DetectorFactory
+from data_pipeline.instrumentation import instrumented
+
+DetectorFactory.seed = 0  # For consistent language detection results, also in worker processes
+
+LANGUAGE_CACHE_PATH = "data/.cache/langdetect.sqlite"
+SAMPLE_CHARS = 2000
+LANGUAGE_BATCH_SIZE = 2000
+_SQLITE_MAX_PARAMS = 900
+
+
+def sample_text(text, max_chars=SAMPLE_CHARS):
+    """Returns the stripped text, or its head and tail when it is longer than max_chars."""
+    text = str(text or "").strip()
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return text[:half] + "\n" + text[-half:]
+
+
+def _text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _detect_many(texts):
+    """Worker entry point: detects the language of every text, '' when detection fails."""
+    languages = []
+    for text in texts:
+        try:
+            languages.append(detect(text))
+        except Exception:
+            languages.append("")
+    return languages
+
+
+class LanguageCache:
+    """SQLite-backed memo of detected languages keyed by text hash."""
+
+    def __init__(self, path=LANGUAGE_CACHE_PATH):
+        self.connection = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.connection = sqlite3.connect(path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS languages (key TEXT PRIMARY KEY, language TEXT)"
+            )
+
+    def get_many(self, keys):
+        if self.connection is None:
+            return {}
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), _SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + _SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(self.connection.execute(
+                f"SELECT key, language FROM languages WHERE key IN ({placeholders})", chunk
+            ))
+        return found
+
+    def put_many(self, items):
+        if self.connection is None or not items:
+            return
+        self.connection.executemany("INSERT OR REPLACE INTO languages VALUES (?, ?)", items.items())
+        self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def _detect_languages(samples, cache, pool, num_chunks):
+    """Returns {text key: language} for the samples, detecting only cache misses."""
+    keyed = {_text_key(text): text for text in samples}
+    languages = cache.get_many(keyed)
+    missing = [(key, text) for key, text in keyed.items() if key not in languages]
+    if not missing:
+        return languages
+
+    texts = [text for _, text in missing]
+    if pool is None:
+        detected = _detect_many(texts)
+    else:
+        chunk_size = max(1, -(-len(texts) // num_chunks))
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        detected = [lang for chunk in pool.map(_detect_many, chunks) for lang in chunk]
+
+    new_languages = {key: lang for (key, _), lang in zip(missing, detected)}
+    cache.put_many(new_languages)
+    languages.update(new_languages)
+    return languages
+
+
+@instrumented
+def find_language_rows(dataset, fields, language="en", num_proc=None, max_chars=SAMPLE_CHARS,
+                       cache_path=LANGUAGE_CACHE_PATH, batch_size=LANGUAGE_BATCH_SIZE):
+    """Returns the indices of rows whose `fields` are all non-empty and detected as `language`."""
+    cache = LanguageCache(cache_path)
+    pool = ProcessPoolExecutor(max_workers=num_proc) if num_proc and num_proc > 1 else None
+    keep_indices = []
+    offset = 0
+    try:
+        columns = dataset.select_columns(list(fields)).with_format("arrow")
+        for batch in columns.iter(batch_size=batch_size):
+            candidates = list(range(batch.num_rows))
+            for field in fields:
+                values = batch.column(field).to_pylist()
+                samples = {row: sample_text(values[row], max_chars) for row in candidates}
+                samples = {row: text for row, text in samples.items() if text}
+                languages = _detect_languages(samples.values(), cache, pool, num_proc or 1)
+                # Later fields are only classified for rows that still pass.
+                candidates = [row for row, text in samples.items() if languages[_text_key(text)] == language]
+            keep_indices.extend(offset + row for row in candidates)
+            offset += batch.num_rows
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        cache.close()
+    return keep_indices
+
+
+@instrumented
+def filter_language(dataset, fields, language="en", num_proc=None, max_chars=SAMPLE_CHARS,
+                    cache_path=LANGUAGE_CACHE_PATH, batch_size=LANGUAGE_BATCH_SIZE):
+    """Keeps rows whose `fields` are all detected as `language`, as an index selection."""
+    keep_indices = find_language_rows(
+        dataset, fields, language=language, num_proc=num_proc, max_chars=max_chars,
+        cache_path=cache_path, batch_size=batch_size,
+    )
+    if len(keep_indices) == len(dataset):
+        return dataset
+    return dataset.select(keep_indices)
@@ -0,0 +1,241 @@
+"""
+near_dedup.py
+
+Optional near-duplicate removal for OpenMath questions and DeepWriting prompts.
+
+MinHash signatures of normalised word n-grams are built in batched (optionally parallel)
+`map` passes, then grouped with a banded LSH index: rows only become candidates when
+they share a band bucket, so lookup stays sublinear instead of comparing all pairs.
+Candidates are verified against the Jaccard threshold on their signatures.
+
+Signatures are persisted next to an index.json describing how they were built, so later
+runs over the same dataset only recompute the (cheap) band keys.
+
+Functions:
+- minhash_signatures(dataset, column): signature dataset, reused from index_dir if possible.
+- find_near_duplicates(dataset, column, threshold): indices to keep and the duplicate count.
+- remove_near_duplicates(dataset, column, threshold): dataset.select() of the kept rows.
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from datasets import Features, Sequence, Value, load_from_disk
+from data_pipeline.instrumentation import instrumented
+
+NUM_PERM = 128
+NGRAM_SIZE = 3
+DEFAULT_THRESHOLD = 0.8
+SIGNATURE_BATCH_SIZE = 1000
+SHINGLE_CHUNK = 8192  # 8192 x NUM_PERM uint64 = 8 MB of permuted hashes at a time
+MINHASH_SEED = 1
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SIGNATURE_COLUMN = "minhash"
+_THOUSANDS_SEPARATOR = re.compile(r"(?<=\d),(?=\d{3})")
+_PUNCTUATION = re.compile(r"[^\w\s.]|(?<!\d)\.|\.(?!\d)")
+
+
+def normalise_for_minhash(text):
+    """Lowercases, drops punctuation and thousands separators so trivial rewrites shingle alike."""
+    text = _THOUSANDS_SEPARATOR.sub("", str(text or "").lower())
+    return _PUNCTUATION.sub(" ", text).split()
+
+
+def _shingles(text, ngram_size):
+    words = normalise_for_minhash(text)
+    if len(words) <= ngram_size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + ngram_size]) for i in range(len(words) - ngram_size + 1)]
+
+
+def _permutations(num_perm, seed):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def _minhash_batch(texts, perm_a, perm_b, ngram_size, shingle_chunk=SHINGLE_CHUNK):
+    """Computes one MinHash signature per text for a batch, vectorised over chunks of shingles.
+
+    The permuted hashes are shingles x num_perm uint64, so they are built shingle_chunk
+    shingles at a time and folded into the signatures, bounding memory for long texts.
+    """
+    shingles, rows = [], []
+    for row, text in enumerate(texts):
+        text_shingles = _shingles(text, ngram_size)
+        shingles.extend(text_shingles)
+        rows.extend([row] * len(text_shingles))
+
+    shingle_hashes = pd.util.hash_array(np.array(shingles, dtype=object)) & _MAX_HASH
+    rows = np.array(rows)
+    signatures = np.full((len(texts), len(perm_a)), _MAX_HASH, dtype=np.uint64)
+    for start in range(0, len(shingle_hashes), shingle_chunk):
+        chunk_rows = rows[start:start + shingle_chunk]
+        permuted = (shingle_hashes[start:start + shingle_chunk, None] * perm_a + perm_b) % _MERSENNE_PRIME & _MAX_HASH
+        # Rows are contiguous runs of shingles; a row may continue into the next chunk
+        starts = np.flatnonzero(np.r_[True, chunk_rows[1:] != chunk_rows[:-1]])
+        chunk_rows = chunk_rows[starts]
+        signatures[chunk_rows] = np.minimum(signatures[chunk_rows], np.minimum.reduceat(permuted, starts, axis=0))
+    return {_SIGNATURE_COLUMN: signatures.astype(np.uint32)}
+
+
+def _index_params(dataset, column, num_perm, ngram_size, seed):
+    return {
+        "fingerprint": dataset._fingerprint,
+        "column": column,
+        "num_perm": num_perm,
+        "ngram_size": ngram_size,
+        "seed": seed,
+    }
+
+
+@instrumented
+def minhash_signatures(dataset, column, num_perm=NUM_PERM, ngram_size=NGRAM_SIZE,
+                       seed=MINHASH_SEED, num_proc=None, index_dir=None):
+    """Returns a dataset with one `minhash` signature per row, reusing a persisted one if it matches."""
+    params = _index_params(dataset, column, num_perm, ngram_size, seed)
+    index_file = os.path.join(index_dir, "index.json") if index_dir else None
+
+    if index_file and os.path.exists(index_file):
+        with open(index_file) as f:
+            if json.load(f) == params:
+                print(f"Reusing MinHash signatures from {index_dir}")
+                return load_from_disk(os.path.join(index_dir, "signatures"))
+
+    perm_a, perm_b = _permutations(num_perm, seed)
+    signatures = dataset.select_columns([column]).map(
+        _minhash_batch,
+        batched=True,
+        batch_size=SIGNATURE_BATCH_SIZE,
+        num_proc=num_proc,
+        input_columns=[column],
+        remove_columns=[column],
+        features=Features({_SIGNATURE_COLUMN: Sequence(Value("uint32"), length=num_perm)}),
+        fn_kwargs={"perm_a": perm_a, "perm_b": perm_b, "ngram_size": ngram_size},
+        desc="MinHash signatures",
+    )
+
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+        for name in os.listdir(index_dir):
+            if name.startswith("lsh_bands_"):
+                os.remove(os.path.join(index_dir, name))  # band keys of stale signatures
+        signatures.save_to_disk(os.path.join(index_dir, "signatures"))
+        with open(index_file, "w") as f:
+            json.dump(params, f, indent=2)
+        print(f"MinHash signatures saved to {index_dir}")
+    return signatures
+
+
+def signature_matrix(signatures):
+    """Reads the signature column into a (rows, num_perm) uint32 array."""
+    column = signatures.with_format("arrow")[:][_SIGNATURE_COLUMN]
+    num_perm = column.type.list_size
+    return np.concatenate([chunk.flatten().to_numpy().reshape(-1, num_perm) for chunk in column.chunks])
+
+
+def optimal_bands(threshold, num_perm):
+    """Picks (bands, rows) minimising the false positive + false negative area around the threshold."""
+    similarities = np.linspace(0.0, 1.0, 1001)
+    below = similarities < threshold
+    best, best_error = (1, num_perm), float("inf")
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            candidate_prob = 1 - (1 - similarities ** rows) ** bands
+            false_positive = candidate_prob[below].mean() * threshold if below.any() else 0.0
+            false_negative = (1 - candidate_prob[~below]).mean() * (1 - threshold)
+            if false_positive + false_negative < best_error:
+                best, best_error = (bands, rows), false_positive + false_negative
+    return best
+
+
+def lsh_band_keys(matrix, bands, rows):
+    """Hashes each band of every signature to a single uint64 bucket key."""
+    keys = np.empty((matrix.shape[0], bands), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for band in range(bands):
+            key = np.full(matrix.shape[0], band, dtype=np.uint64)
+            for column in matrix[:, band * rows:(band + 1) * rows].T:
+                key = (key * np.uint64(0x100000001B3)) ^ column.astype(np.uint64)
+            keys[:, band] = key
+    return keys
+
+
+def _candidate_pairs(band_keys):
+    """Pairs every row with the lowest row index sharing one of its band buckets."""
+    pairs = []
+    for band in band_keys.T:
+        order = np.argsort(band, kind="stable")
+        sorted_keys = band[order]
+        run_starts = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+        leaders = order[run_starts][np.cumsum(run_starts) - 1]
+        is_member = leaders != order
+        pairs.append(np.stack([leaders[is_member], order[is_member]], axis=1))
+
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+    return np.unique(pairs, axis=0)
+
+
+def _connected_components(num_rows, pairs):
+    """Labels every row with the smallest row index of its duplicate cluster."""
+    labels = np.arange(num_rows)
+    if len(pairs) == 0:
+        return labels
+    left, right = pairs[:, 0], pairs[:, 1]
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, right, labels[left])
+        np.minimum.at(labels, left, labels[right])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+@instrumented
+def find_near_duplicates(dataset, column, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM,
+                         ngram_size=NGRAM_SIZE, num_proc=None, index_dir=None):
+    """Returns the sorted indices of rows to keep and the number of near duplicates dropped."""
+    signatures = minhash_signatures(
+        dataset, column, num_perm=num_perm, ngram_size=ngram_size,
+        num_proc=num_proc, index_dir=index_dir,
+    )
+    matrix = signature_matrix(signatures)
+    bands, rows = optimal_bands(threshold, num_perm)
+
+    keys_file = os.path.join(index_dir, f"lsh_bands_{bands}x{rows}.npy") if index_dir else None
+    if keys_file and os.path.exists(keys_file):
+        band_keys = np.load(keys_file, mmap_mode="r")
+    else:
+        band_keys = lsh_band_keys(matrix, bands, rows)
+        if keys_file:
+            np.save(keys_file, band_keys)
+
+    pairs = _candidate_pairs(band_keys)
+    if len(pairs):
+        similarity = (matrix[pairs[:, 0]] == matrix[pairs[:, 1]]).mean(axis=1)
+        pairs = pairs[similarity >= threshold]
+
+    labels = _connected_components(len(matrix), pairs)
+    keep_indices = np.flatnonzero(labels == np.arange(len(matrix)))
+    print(f"LSH with {bands} bands x {rows} rows found {len(pairs)} verified near-duplicate pairs.")
+    return keep_indices, len(matrix) - len(keep_indices)
+
+
+@instrumented
+def remove_near_duplicates(dataset, column, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM,
+                           ngram_size=NGRAM_SIZE, num_proc=None, index_dir=None):
+    """Removes rows whose `column` is a near duplicate (estimated Jaccard >= threshold) of an earlier row."""
+    keep_indices, duplicate_count = find_near_duplicates(
+        dataset, column, threshold=threshold, num_perm=num_perm,
+        ngram_size=ngram_size, num_proc=num_proc, index_dir=index_dir,
+    )
+    print(f"Removed {duplicate_count} near-duplicate '{column}' rows (Jaccard >= {threshold}).")
+    if duplicate_count == 0:
+        return dataset
+    return dataset.select(keep_indices)
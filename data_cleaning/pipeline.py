@@ -0,0 +1,184 @@
+"""
+pipeline.py
+
+Fused, single-pass cleaning pipeline shared by clean_openmath.py and clean_deepwriting.py.
+
+A pipeline is an ordered list of steps:
+- select_step: a global step (dedup, language filter) that returns the row indices to
+  keep from the stored values, e.g. data_cleaning.dedup.find_duplicates.
+- filter_step: a batched row predicate, batch dict -> list of bools.
+- transform_step: a batched transform, batch dict -> batch dict.
+Filters and transforms created with arrow=True take and return pyarrow Tables instead
+(e.g. the data_cleaning.arrow_text kernels); batches are only converted between the two
+representations where consecutive steps differ.
+
+Select steps and predicates only read the columns they need and narrow an index
+selection over the input table; no intermediate dataset is written. All transforms are
+then fused into one batched `map` over the survivors, so the cleaned table is
+materialised exactly once. Per-step drop counts are reported along the way.
+
+Functions:
+- run_pipeline(dataset, steps, num_proc): cleaned dataset and per-step stats.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+from data_pipeline.instrumentation import instrumented
+
+PIPELINE_BATCH_SIZE = 10_000
+
+SELECT, FILTER, TRANSFORM = "select", "filter", "transform"
+
+Step = namedtuple("Step", ["label", "kind", "fn", "columns", "arrow"])
+
+
+def select_step(label, fn):
+    """fn(dataset, num_proc) -> sorted indices (into that dataset) of the rows to keep."""
+    return Step(label, SELECT, fn, None, False)
+
+
+def filter_step(label, fn, columns, arrow=False):
+    """fn(batch) -> one bool per row; rows mapped to False are dropped."""
+    return Step(label, FILTER, fn, list(columns), arrow)
+
+
+def transform_step(label, fn, columns, arrow=False):
+    """fn(batch) -> batch with `columns` rewritten; applied once, in the final fused pass."""
+    return Step(label, TRANSFORM, fn, list(columns), arrow)
+
+
+def _as_batch(values, arrow):
+    """Converts a batch to a pyarrow Table (arrow=True) or a dict of lists, if it is not one already."""
+    if arrow:
+        return values if isinstance(values, pa.Table) else pa.Table.from_pydict(values)
+    return values.to_pydict() if isinstance(values, pa.Table) else values
+
+
+def _keep_rows(values, mask):
+    if isinstance(values, pa.Table):
+        return values.filter(pa.array(mask))
+    return {name: [v for v, keep in zip(column, mask) if keep] for name, column in values.items()}
+
+
+def _evaluate_shard(args):
+    """Worker entry point: runs the filters (and any transforms they depend on) over one shard."""
+    dataset, steps, index, num_shards, batch_size = args
+    if num_shards > 1:
+        dataset = dataset.shard(num_shards=num_shards, index=index, contiguous=True)
+    columns = sorted({column for step in steps for column in step.columns})
+
+    kept, drops, offset = [], [0] * len(steps), 0
+    for batch in dataset.select_columns(columns).with_format("arrow").iter(batch_size=batch_size):
+        values = batch
+        rows = np.arange(batch.num_rows)
+        for i, step in enumerate(steps):
+            values = _as_batch(values, step.arrow)
+            if step.kind == TRANSFORM:
+                values = step.fn(values)
+                continue
+            mask = np.asarray(step.fn(values), dtype=bool)
+            drops[i] += int(len(mask) - mask.sum())
+            rows = rows[mask]
+            values = _keep_rows(values, mask)
+        kept.append(rows + offset)
+        offset += batch.num_rows
+
+    kept = np.concatenate(kept) if kept else np.empty(0, dtype=np.int64)
+    return kept, drops, len(dataset)
+
+
+def _evaluate_segment(dataset, steps, num_proc, batch_size):
+    """Returns the local indices surviving a run of filter/transform steps, and per-step drops."""
+    num_shards = num_proc if num_proc and num_proc > 1 and len(dataset) > batch_size else 1
+    jobs = [(dataset, steps, i, num_shards, batch_size) for i in range(num_shards)]
+    if num_shards == 1:
+        results = [_evaluate_shard(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=num_shards) as pool:
+            results = list(pool.map(_evaluate_shard, jobs))
+
+    kept, drops, offset = [], [0] * len(steps), 0
+    for shard_kept, shard_drops, shard_length in results:
+        kept.append(shard_kept + offset)
+        drops = [total + dropped for total, dropped in zip(drops, shard_drops)]
+        offset += shard_length
+    return np.concatenate(kept), drops
+
+
+def _apply_transforms(batch, transforms, arrow):
+    for transform, is_arrow in zip(transforms, arrow):
+        batch = transform(_as_batch(batch, is_arrow))
+    return _as_batch(batch, arrow[-1])
+
+
+def print_step(label, remaining, dropped):
+    print(f"\n--- {label} ---")
+    print("Dataset length:", remaining)
+    print(f"Removed {dropped} rows.")
+
+
+@instrumented
+def run_pipeline(dataset, steps, num_proc=None, batch_size=PIPELINE_BATCH_SIZE, verbose=True):
+    """Runs the cleaning steps in order, writing the cleaned table once.
+
+    Returns the cleaned dataset and a list of (label, remaining rows, dropped rows).
+    Select steps see the stored column values; filters see the output of the transforms
+    listed before them.
+    """
+    keep = np.arange(len(dataset))
+    stats = []
+
+    def record(label, remaining, dropped):
+        stats.append((label, remaining, dropped))
+        if verbose:
+            print_step(label, remaining, dropped)
+
+    i = 0
+    while i < len(steps):
+        if steps[i].kind == SELECT:
+            local = np.asarray(steps[i].fn(dataset.select(keep), num_proc), dtype=np.int64)
+            dropped = len(keep) - len(local)
+            keep = keep[local]
+            record(steps[i].label, len(keep), dropped)
+            i += 1
+            continue
+
+        # A run of filters/transforms up to the next select step; transforms that no
+        # later filter depends on are left for the final fused pass.
+        end = i
+        while end < len(steps) and steps[end].kind != SELECT:
+            end += 1
+        segment = steps[i:end]
+        filters = [j for j, step in enumerate(segment) if step.kind == FILTER]
+        if filters:
+            evaluated = segment[:filters[-1] + 1]
+            local, drops = _evaluate_segment(dataset.select(keep), evaluated, num_proc, batch_size)
+            remaining = len(keep)
+            keep = keep[local]
+            for step, dropped in zip(evaluated, drops):
+                if step.kind == FILTER:
+                    remaining -= dropped
+                    record(step.label, remaining, dropped)
+        i = end
+
+    transforms = [step for step in steps if step.kind == TRANSFORM]
+    cleaned = dataset.select(keep) if len(keep) < len(dataset) else dataset
+    if transforms:
+        # Arrow transforms get the batches as pyarrow Tables straight from the dataset
+        arrow_input = transforms[0].arrow
+        cleaned = (cleaned.with_format("arrow") if arrow_input else cleaned).map(
+            _apply_transforms,
+            batched=True,
+            batch_size=batch_size,
+            num_proc=num_proc,
+            fn_kwargs={"transforms": [step.fn for step in transforms], "arrow": [step.arrow for step in transforms]},
+            desc=", ".join(step.label for step in transforms),
+        )
+        if arrow_input:
+            cleaned = cleaned.with_format(None)
+        for step in transforms:
+            record(step.label, len(cleaned), 0)
+    return cleaned, stats
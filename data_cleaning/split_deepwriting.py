@@ -1,5 +1,11 @@
+import os
+
 from datasets import load_from_disk
 
+from data_cleaning.hash_split import hash_split
+from data_pipeline.stage_cache import run_stage
+from data_pipeline.instrumentation import instrumented
+
 # #Relative paths
 clean_data_dir = "data/deepwriting_cleaned"
 train_split_dir = "data/deepwriting_train"
@@ -9,6 +15,11 @@ validation_split_dir = "data/deepwriting_validation"
 train_ratio = 0.1
 random_seed = 42
 
+# "hash": stable per-row assignment from the prompt hash; "shuffle": the original shuffle split
+split_mode = "hash"
+KEY_FIELD = 'prompt'
+
+@instrumented
 def shuffle_and_split(dataset, train_ratio=0.1,seed=42):
     """Shuffles and splits the dataset into training and validation sets."""
     # Shuffle the dataset
@@ -23,6 +34,16 @@ def shuffle_and_split(dataset, train_ratio=0.1,seed=42):
     return train_dataset, validation_dataset
 
 
+@instrumented
+def split_dataset(dataset, mode=split_mode, train_ratio=0.1, seed=42, num_proc=None):
+    """Splits with the given mode: "hash" (by prompt) or "shuffle"."""
+    if mode == "hash":
+        return hash_split(dataset, KEY_FIELD, train_ratio=train_ratio, seed=seed, num_proc=num_proc)
+    if mode == "shuffle":
+        return shuffle_and_split(dataset, train_ratio=train_ratio, seed=seed)
+    raise ValueError(f"Unknown split mode: {mode}")
+
+
 
 if __name__ == "__main__":
 
@@ -31,7 +52,15 @@ if __name__ == "__main__":
     print("Loaded cleaned dataset length:", len(dataset))
 
     #Shuffle and split the cleaned dataset
-    train_dataset, validation_dataset = shuffle_and_split(dataset, train_ratio, random_seed)
+    splits = run_stage(
+        "split_deepwriting", split_dataset,
+        inputs={"dataset": dataset},
+        params={"mode": split_mode, "train_ratio": train_ratio, "seed": random_seed},
+        run_kwargs={"num_proc": os.cpu_count()},
+        output_names=("train", "validation"),
+        save_dirs={"train": train_split_dir, "validation": validation_split_dir},
+    )
+    train_dataset, validation_dataset = splits["train"], splits["validation"]
 
     assert len(train_dataset) + len(validation_dataset) == len(dataset)
 
@@ -41,10 +70,3 @@ if __name__ == "__main__":
     print(f"Train ratio: {len(train_dataset) / len(dataset):.3f}")
     print(f"Validation ratio: {len(validation_dataset) / len(dataset):.3f}")
 
-    #Save the splits to disk
-    train_dataset.save_to_disk(train_split_dir)
-    print(f"Training set saved to {train_split_dir}")
-
-    validation_dataset.save_to_disk(validation_split_dir)
-    print(f"Validation set saved to {validation_split_dir}")
-
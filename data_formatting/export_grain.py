@@ -0,0 +1,134 @@
+"""
+export_grain.py
+
+Exports question/answer datasets as memory-mapped Arrow shards for the GRPO notebook.
+
+Each row gets the fields the notebook's get_dataset() builds per element at training
+time: "prompts" (TEMPLATE filled with SYSTEM_PROMPT and the question), "question" and
+"answer". They are computed once here, in batched maps, and written as Arrow IPC files
+(one record batch per shard) that grpo.grain_source maps with O(1) random access.
+
+Given a tokenizer, a "prompt_ids" column is added too, encoded by grpo.prompt_encoder
+(the shared template prefix is tokenized once, only the question per row), and the
+manifest records the shared prefix length for samplers that can reuse a prefix cache and
+the pad id for batching (grpo.bucketing).
+
+A manifest.json lists the shards and the source fingerprint; an export whose source has
+not changed is skipped.
+
+Functions:
+- grpo_fields(batch, question_field, answer_field, hash_answers): batched prompts/question/answer.
+- export_grain(dataset, export_dir, tokenizer): writes the shards and manifest.
+"""
+
+import json
+import os
+import shutil
+
+import pyarrow as pa
+from datasets import load_dataset, load_from_disk
+
+from data_formatting.tokenization import TOKENIZER_NAME, load_tokenizer
+from grpo.prompt_encoder import PROMPT_IDS_FIELD, add_prompt_ids
+from grpo.prompts import extract_hash_answer, format_prompt
+from data_pipeline.instrumentation import instrumented
+
+#Relative paths
+DATASETS = {
+    "data/openmath_train": "data/openmath_grpo_train",
+    "data/openmath_validation": "data/openmath_grpo_validation",
+}
+GSM8K_EXPORT_DIRS = {"train": "data/gsm8k_grpo_train", "test": "data/gsm8k_grpo_test"}
+
+GRAIN_SHARD_SIZE = 50_000
+EXPORT_FIELDS = ["prompts", "question", "answer"]
+MANIFEST_FILE = "manifest.json"
+
+
+def grpo_fields(batch, question_field="question", answer_field="expected_answer", hash_answers=False):
+    """Batched: returns prompts/question/answer; hash_answers extracts GSM8K "#### answer" endings."""
+    questions = [str(question) for question in batch[question_field]]
+    answers = [
+        (extract_hash_answer(str(answer)) if hash_answers else str(answer).strip())
+        if answer is not None else None
+        for answer in batch[answer_field]
+    ]
+    return {
+        "prompts": [format_prompt(question) for question in questions],
+        "question": questions,
+        "answer": answers,
+    }
+
+
+def _is_current(export_dir, fingerprint):
+    path = os.path.join(export_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        return json.load(f).get("fingerprint") == fingerprint
+
+
+@instrumented
+def export_grain(dataset, export_dir, question_field="question", answer_field="expected_answer",
+                 hash_answers=False, shard_size=GRAIN_SHARD_SIZE, num_proc=None, tokenizer=None):
+    """Writes prompts/question/answer (and prompt_ids, given a tokenizer) as Arrow IPC shards with a manifest.
+
+    export_dir is replaced atomically.
+    """
+    fingerprint = f"{dataset._fingerprint}-{question_field}-{answer_field}-{hash_answers}-{shard_size}"
+    if tokenizer is not None:
+        fingerprint += f"-{tokenizer.name_or_path}"
+    if _is_current(export_dir, fingerprint):
+        print(f"{export_dir} is up to date, skipping export")
+        return export_dir
+
+    exported = dataset.map(
+        grpo_fields,
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=dataset.column_names,
+        fn_kwargs={"question_field": question_field, "answer_field": answer_field, "hash_answers": hash_answers},
+        desc="Building prompts",
+    )
+    fields = [(field, pa.string()) for field in EXPORT_FIELDS]
+    prefix_length = pad_id = None
+    if tokenizer is not None:
+        exported, prefix_length = add_prompt_ids(exported, tokenizer, num_proc=num_proc)
+        pad_id = tokenizer.pad_token_id
+        fields.append((PROMPT_IDS_FIELD, pa.list_(pa.int32())))
+    schema = pa.schema(fields)
+    table = exported.with_format("arrow")[:].select(schema.names).cast(schema)
+
+    tmp_dir = f"{export_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    shards = []
+    for start in range(0, table.num_rows, shard_size):
+        file_name = f"shard-{len(shards):05d}.arrow"
+        shard = table.slice(start, shard_size).combine_chunks()
+        with pa.OSFile(os.path.join(tmp_dir, file_name), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(shard, max_chunksize=shard.num_rows)
+        shards.append({"file": file_name, "num_rows": shard.num_rows})
+
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump({"fingerprint": fingerprint, "fields": schema.names, "prefix_length": prefix_length,
+                   "pad_id": pad_id, "shards": shards}, f, indent=2)
+    shutil.rmtree(export_dir, ignore_errors=True)
+    os.replace(tmp_dir, export_dir)
+    print(f"Exported {table.num_rows} rows in {len(shards)} shards to {export_dir}")
+    return export_dir
+
+
+if __name__ == "__main__":
+    tokenizer = load_tokenizer(TOKENIZER_NAME)
+
+    for data_dir, export_dir in DATASETS.items():
+        if not os.path.exists(data_dir):
+            print(f"Skipping {data_dir}: not found")
+            continue
+        export_grain(load_from_disk(data_dir), export_dir, num_proc=os.cpu_count(), tokenizer=tokenizer)
+
+    # GSM8K, as used by the notebook, with answers extracted from "#### answer"
+    for split, export_dir in GSM8K_EXPORT_DIRS.items():
+        export_grain(load_dataset("gsm8k", "main", split=split), export_dir,
+                     answer_field="answer", hash_answers=True, tokenizer=tokenizer)
@@ -1,5 +1,14 @@
+import os
+
+import pyarrow.compute as pc
 from datasets import load_from_disk
 
+from data_cleaning import arrow_text
+from data_cleaning.arrow_text import BACKEND
+from data_formatting.tokenization import TOKENIZER_NAME, encode_segments, load_tokenizer
+from data_pipeline.stage_cache import run_stage
+from data_pipeline.instrumentation import instrumented
+
 #Relative paths
 train_data_dir = "data/deepwriting_train"
 validation_data_dir = "data/deepwriting_validation"
@@ -10,8 +19,8 @@ formatted_validation_dir = "data/deepwriting_formatted_validation"
 
 MAX_SEQ_LENGTH = 1024 #Gemma 3 1B recommended max sequence length
 
-def format_for_sft(row):
-    """Converts DeepWriting dataset entries into required format for SFT training."""
+def sft_segments(row):
+    """Splits a DeepWriting entry into (text, truncatable) segments of the SFT template."""
     required_keys= ['prompt', 'solution']
     for key in required_keys:
         if key not in row or row[key] is None:
@@ -20,12 +29,18 @@ def format_for_sft(row):
     prompt = str(row['prompt']).strip()
     reasoning = str(row['solution']).strip()
     answer_placeholder = "See reasoning"
-   
-    text = (
-        f"{prompt}\n"
-        f"<reasoning>\n{reasoning}\n</reasoning>\n"
-        f"<answer>\n{answer_placeholder}\n</answer>"
-    )
+
+    return [
+        (prompt, True),
+        ("\n<reasoning>\n", False),
+        (reasoning, True),
+        (f"\n</reasoning>\n<answer>\n{answer_placeholder}\n</answer>", False),
+    ]
+
+
+def format_for_sft(row):
+    """Converts DeepWriting dataset entries into required format for SFT training."""
+    text = "".join(segment for segment, _ in sft_segments(row))
 
     #Output validation
     if not isinstance(text, str) or len(text.strip()) == 0:
@@ -41,8 +56,44 @@ def format_for_sft(row):
     return formatted_row
 
 
+def format_table(table, max_length=MAX_SEQ_LENGTH):
+    """Arrow version of format_for_sft() followed by truncate_example(), on a batch as a pyarrow Table.
+
+    Returns the table with "text" and "num_tokens" added.
+    """
+    for key in ['prompt', 'solution']:
+        if key not in table.column_names or table.column(key).null_count:
+            raise ValueError(f"Missing required key: {key}")
+
+    # The tags are literal parts of the template, so unlike format_for_sft() there is nothing to validate
+    text = arrow_text.join_template([
+        arrow_text.strip(table.column('prompt')),
+        "\n<reasoning>\n",
+        arrow_text.strip(table.column('solution')),
+        "\n</reasoning>\n<answer>\nSee reasoning\n</answer>",
+    ])
+
+    text, num_tokens = arrow_text.truncate_words(text, max_length)
+
+    for name, column in [("text", text), ("num_tokens", num_tokens)]:
+        if name in table.column_names:
+            table = table.drop_columns([name])
+        table = table.append_column(name, column)
+    return table
+
+
+def tokenize_for_sft(batch, tokenizer, max_length=MAX_SEQ_LENGTH):
+    """Batched: formats and tokenizes entries, truncating the reasoning at the token level.
+
+    Adds text, input_ids, attention_mask and num_tokens (real tokenizer tokens). The
+    closing </reasoning> and <answer> block is never truncated.
+    """
+    rows = [dict(zip(batch, values)) for values in zip(*batch.values())]
+    return encode_segments([sft_segments(row) for row in rows], tokenizer, max_length)
+
+
 def truncate_example(example, max_length=MAX_SEQ_LENGTH):
-    """Truncates text to max_length tokens if necessary."""
+    """Truncates text to max_length whitespace-separated words if necessary (no-tokenizer fallback)."""
     tokens = example["text"].split()
     if len(tokens) > max_length:
         example["text"] = " ".join(tokens[:max_length])
@@ -50,13 +101,36 @@ def truncate_example(example, max_length=MAX_SEQ_LENGTH):
     return example
 
 
-def format_dataset(dataset):
-    """Formats the entire dataset for SFT training."""
-    #Formatting
-    formatted_dataset = dataset.map(format_for_sft)
-
-    #Truncation
-    truncated_dataset = formatted_dataset.map(truncate_example)
+@instrumented
+def format_dataset(dataset, tokenizer=None, max_length=MAX_SEQ_LENGTH, num_proc=None, backend=BACKEND):
+    """Formats the entire dataset for SFT training.
+
+    With a tokenizer, also emits input_ids/attention_mask truncated to max_length tokens,
+    so training can memory-map the ids instead of re-tokenizing every epoch.
+    Without one, backend="arrow" formats and truncates with Arrow kernels, "python" row by row.
+    """
+    if tokenizer is not None:
+        #Formatting, tokenization and token-level truncation in one batched pass
+        truncated_dataset = dataset.map(
+            tokenize_for_sft,
+            batched=True,
+            num_proc=num_proc,
+            fn_kwargs={"tokenizer": tokenizer, "max_length": max_length},
+        )
+    elif backend == "arrow":
+        #Formatting and truncation in one batched Arrow pass
+        truncated_dataset = dataset.with_format("arrow").map(
+            format_table,
+            batched=True,
+            num_proc=num_proc,
+            fn_kwargs={"max_length": max_length},
+        ).with_format(None)
+    else:
+        #Formatting
+        formatted_dataset = dataset.map(format_for_sft, num_proc=num_proc)
+
+        #Truncation
+        truncated_dataset = formatted_dataset.map(truncate_example, fn_kwargs={"max_length": max_length})
 
     # #Optional filter
     # final_formatted_dataset = truncated_dataset.filter(
@@ -64,7 +138,8 @@ def format_dataset(dataset):
        
     #Compute and print stats
     total = len(truncated_dataset)
-    truncated_count = sum (1 for x in truncated_dataset if x['num_tokens']== MAX_SEQ_LENGTH)
+    num_tokens = truncated_dataset.with_format("arrow")['num_tokens']
+    truncated_count = pc.sum(pc.equal(num_tokens, max_length)).as_py() or 0
     retained_count = total - truncated_count
 
     print(f"Total samples: {total}")
@@ -77,6 +152,8 @@ def format_dataset(dataset):
 
 
 if __name__ == "__main__":
+    tokenizer = load_tokenizer(TOKENIZER_NAME)
+
     # Load training and validation datasets
     train_dataset = load_from_disk(train_data_dir)
     validation_dataset = load_from_disk(validation_data_dir)
@@ -85,21 +162,24 @@ if __name__ == "__main__":
     print("Loaded validation dataset length:", len(validation_dataset))
 
     # Format datasets for SFT
-    formatted_train_dataset = format_dataset(train_dataset)
-    formatted_validation_dataset = format_dataset(validation_dataset)
+    # Cached per input split, MAX_SEQ_LENGTH, tokenizer and formatter code
+    formatted = {}
+    for split, dataset, save_dir in [
+        ("train", train_dataset, formatted_train_dir),
+        ("validation", validation_dataset, formatted_validation_dir),
+    ]:
+        formatted[split] = run_stage(
+            "format_deepwriting", format_dataset,
+            inputs={"dataset": dataset},
+            params={"max_length": MAX_SEQ_LENGTH},
+            run_kwargs={"tokenizer": tokenizer, "num_proc": os.cpu_count()},
+            key_extras={"tokenizer": TOKENIZER_NAME},
+            save_dirs={"output": save_dir},
+        )["output"]
+    formatted_train_dataset, formatted_validation_dataset = formatted["train"], formatted["validation"]
 
 
     print("Formatted training dataset length:", len(formatted_train_dataset))
     print("Formatted validation dataset length:", len(formatted_validation_dataset))
 
     print("Sample formatted training entry:\n", formatted_train_dataset[0])
-
-    # Save formatted datasets to disk
-    formatted_train_dataset.save_to_disk(formatted_train_dir)
-    print(f"Formatted training set saved to {formatted_train_dir}")
-
-    formatted_validation_dataset.save_to_disk(formatted_validation_dir)
-    print(f"Formatted validation set saved to {formatted_validation_dir}")
-
-
-
@@ -1,5 +1,14 @@
+import os
+
+import pyarrow as pa
 from datasets import load_from_disk
 
+from data_cleaning import arrow_text
+from data_cleaning.arrow_text import BACKEND
+from data_formatting.tokenization import TOKENIZER_NAME, encode_segments, load_tokenizer
+from data_pipeline.stage_cache import run_stage
+from data_pipeline.instrumentation import instrumented
+
 #Relative paths
 train_data_dir = "data/openmath_train"
 validation_data_dir = "data/openmath_validation"
@@ -8,23 +17,25 @@ validation_data_dir = "data/openmath_validation"
 formatted_train_dir = "data/openmath_formatted_train"
 formatted_validation_dir = "data/openmath_formatted_validation"
 
-def format_for_sft(row):
-    """Converts OpenMath dataset entries into required format for SFT training."""
+MAX_SEQ_LENGTH = 1024 #Gemma 3 1B recommended max sequence length
+
+def sft_segments(row):
+    """Splits an OpenMath entry into (text, truncatable) segments of the SFT template."""
     required_keys= ['question', 'generated_solution', 'expected_answer']
     for key in required_keys:
         if key not in row or row[key] is None:
             raise ValueError(f"Missing required key: {key}")
 
-    prompt = row['question']
-    response = (
-        "<reasoning>\n" 
-        f"{row['generated_solution']}\n"
-        "</reasoning>\n"
-        "<answer>\n"
-        f"{row['expected_answer']}\n"
-        "</answer>"
-    )
-    text = prompt + "\n" + response
+    return [
+        (row['question'], True),
+        ("\n<reasoning>\n", False),
+        (f"{row['generated_solution']}", True),
+        (f"\n</reasoning>\n<answer>\n{row['expected_answer']}\n</answer>", False),
+    ]
+
+def format_for_sft(row):
+    """Converts OpenMath dataset entries into required format for SFT training."""
+    text = "".join(segment for segment, _ in sft_segments(row))
 
     #Output validatioon
     if not isinstance(text, str) or len(text.strip()) == 0:
@@ -38,12 +49,61 @@ def format_for_sft(row):
     
     return {"text": text}
 
-def format_dataset(dataset):
-    """Formats the entire dataset for SFT training."""
-    formatted_dataset = dataset.map(format_for_sft, remove_columns=dataset.column_names)
+def format_table(table):
+    """Arrow version of format_for_sft(), on a batch as a pyarrow Table: returns a table with the "text" column."""
+    required_keys = ['question', 'generated_solution', 'expected_answer']
+    for key in required_keys:
+        if key not in table.column_names or table.column(key).null_count:
+            raise ValueError(f"Missing required key: {key}")
+
+    # The tags are literal parts of the template, so unlike format_for_sft() there is nothing to validate
+    text = arrow_text.join_template([
+        table.column('question'),
+        "\n<reasoning>\n",
+        table.column('generated_solution'),
+        "\n</reasoning>\n<answer>\n",
+        table.column('expected_answer'),
+        "\n</answer>",
+    ])
+    return pa.table({"text": text})
+
+def tokenize_for_sft(batch, tokenizer, max_length=MAX_SEQ_LENGTH):
+    """Batched: formats and tokenizes entries, truncating the solution at the token level.
+
+    Returns text, input_ids and attention_mask; the closing </reasoning> tag and the
+    <answer> block are never truncated.
+    """
+    rows = [dict(zip(batch, values)) for values in zip(*batch.values())]
+    encoded = encode_segments([sft_segments(row) for row in rows], tokenizer, max_length)
+    return {key: encoded[key] for key in ("text", "input_ids", "attention_mask")}
+
+@instrumented
+def format_dataset(dataset, tokenizer=None, max_length=MAX_SEQ_LENGTH, num_proc=None, backend=BACKEND):
+    """Formats the entire dataset for SFT training.
+
+    With a tokenizer, also emits input_ids/attention_mask truncated to max_length tokens,
+    so training can memory-map the ids instead of re-tokenizing every epoch.
+    Without one, backend="arrow" builds the text with Arrow kernels, "python" row by row.
+    """
+    if tokenizer is None and backend == "arrow":
+        return dataset.with_format("arrow").map(
+            format_table, batched=True, remove_columns=dataset.column_names, num_proc=num_proc,
+        ).with_format(None)
+    if tokenizer is None:
+        return dataset.map(format_for_sft, remove_columns=dataset.column_names, num_proc=num_proc)
+
+    formatted_dataset = dataset.map(
+        tokenize_for_sft,
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=dataset.column_names,
+        fn_kwargs={"tokenizer": tokenizer, "max_length": max_length},
+    )
     return formatted_dataset
 
 if __name__ == "__main__":
+    tokenizer = load_tokenizer(TOKENIZER_NAME)
+
     # Load training and validation datasets
     train_dataset = load_from_disk(train_data_dir)
     validation_dataset = load_from_disk(validation_data_dir)
@@ -52,20 +112,26 @@ if __name__ == "__main__":
     print("Loaded validation dataset length:", len(validation_dataset))
 
     # Format datasets for SFT
-    formatted_train_dataset = format_dataset(train_dataset)
-    formatted_validation_dataset = format_dataset(validation_dataset)
+    # Cached per input split, MAX_SEQ_LENGTH, tokenizer and formatter code
+    formatted = {}
+    for split, dataset, save_dir in [
+        ("train", train_dataset, formatted_train_dir),
+        ("validation", validation_dataset, formatted_validation_dir),
+    ]:
+        formatted[split] = run_stage(
+            "format_openmath", format_dataset,
+            inputs={"dataset": dataset},
+            params={"max_length": MAX_SEQ_LENGTH},
+            run_kwargs={"tokenizer": tokenizer, "num_proc": os.cpu_count()},
+            key_extras={"tokenizer": TOKENIZER_NAME},
+            save_dirs={"output": save_dir},
+        )["output"]
+    formatted_train_dataset, formatted_validation_dataset = formatted["train"], formatted["validation"]
 
-    assert formatted_train_dataset.column_names == ["text"]
-    assert formatted_validation_dataset.column_names == ["text"]
+    assert formatted_train_dataset.column_names == ["text", "input_ids", "attention_mask"]
+    assert formatted_validation_dataset.column_names == ["text", "input_ids", "attention_mask"]
 
     print("Formatted training dataset length:", len(formatted_train_dataset))
     print("Formatted validation dataset length:", len(formatted_validation_dataset))
 
     print("Sample formatted training entry:\n", formatted_train_dataset[0])
-
-    # Save formatted datasets to disk
-    formatted_train_dataset.save_to_disk(formatted_train_dir)
-    print(f"Formatted training set saved to {formatted_train_dir}")
-
-    formatted_validation_dataset.save_to_disk(formatted_validation_dir)
-    print(f"Formatted validation set saved to {formatted_validation_dir}")
\ No newline at end of file
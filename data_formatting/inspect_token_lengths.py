@@ -1,8 +1,11 @@
+import os
+import re
+
 from datasets import load_from_disk
-from transformers import AutoTokenizer
 import numpy as np
 
-TOKENIZER_NAME = "google/gemma-3-1b-it"
+from data_formatting.tokenization import TOKENIZER_NAME, load_tokenizer, token_lengths
+from data_pipeline.instrumentation import instrumented
 
 DATASETS = {
     "OpenMath Train": "data/openmath_formatted_train",
@@ -11,39 +14,84 @@ DATASETS = {
     "DeepWriting Validation": "data/deepwriting_formatted_validation"
 }
 
+# Lengths are cached per (dataset fingerprint, tokenizer), so repeat runs are instant
+LENGTH_CACHE_DIR = "data/.cache/token_lengths"
+TOKENIZE_BATCH_SIZE = 1000
+HISTOGRAM_BIN_WIDTH = 64
+PERCENTILES = [90, 95, 99, 99.9]
+LENGTH_LIMITS = [256, 512, 1024, 2048]  # candidate MAX_PROMPT_LENGTH / MAX_SEQ_LENGTH values
+
+
+def length_cache_path(dataset, tokenizer, cache_dir=LENGTH_CACHE_DIR):
+    """Cache file for the token lengths of this dataset version under this tokenizer."""
+    tokenizer_slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", tokenizer.name_or_path).strip("_")
+    return os.path.join(cache_dir, f"{dataset._fingerprint}-{tokenizer_slug}.npz")
 
-def inspect_token_lengths(dataset, tokenizer):
-    lengths = []
 
-    for example in dataset:
-        tokens = tokenizer(
-            example["text"],
-            truncation=False,
-            add_special_tokens=True
-        )
-        lengths.append(len(tokens["input_ids"]))
+@instrumented
+def compute_token_lengths(dataset, tokenizer, num_proc=None, batch_size=TOKENIZE_BATCH_SIZE):
+    """Tokenizes the text column in batches across worker processes, keeping only lengths."""
+    lengths_dataset = dataset.map(
+        token_lengths,
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc,
+        input_columns=["text"],
+        remove_columns=dataset.column_names,
+        fn_kwargs={"tokenizer": tokenizer},
+        desc="Tokenizing",
+    )
+    return lengths_dataset.data.column("token_length").to_numpy().astype(np.int32)
 
-    lengths = np.array(lengths)
+
+def load_or_compute_token_lengths(dataset, tokenizer, num_proc=None, cache_dir=LENGTH_CACHE_DIR):
+    """Returns the token lengths from the cache, computing and caching them on a miss."""
+    cache_path = length_cache_path(dataset, tokenizer, cache_dir) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        print(f"Loaded cached token lengths from {cache_path}")
+        return np.load(cache_path)["lengths"]
+
+    lengths = compute_token_lengths(dataset, tokenizer, num_proc=num_proc)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        counts, edges = length_histogram(lengths)
+        np.savez_compressed(cache_path, lengths=lengths, histogram=counts, bin_edges=edges)
+    return lengths
+
+
+def length_histogram(lengths, bin_width=HISTOGRAM_BIN_WIDTH):
+    """Fixed-width histogram of token lengths."""
+    max_length = int(lengths.max()) if len(lengths) else 0
+    return np.histogram(lengths, bins=np.arange(0, max_length + 2 * bin_width, bin_width))
+
+
+@instrumented
+def inspect_token_lengths(dataset, tokenizer, num_proc=None, cache_dir=LENGTH_CACHE_DIR):
+    lengths = load_or_compute_token_lengths(dataset, tokenizer, num_proc=num_proc, cache_dir=cache_dir)
 
     print("\nToken length statistics:")
     print(f"Total samples: {len(lengths)}")
     print(f"Min tokens: {lengths.min()}")
     print(f"Mean tokens: {lengths.mean():.1f}")
     print(f"Median tokens: {np.median(lengths)}")
-    print(f"95th percentile: {np.percentile(lengths, 95)}")
+    for percentile, value in zip(PERCENTILES, np.percentile(lengths, PERCENTILES)):
+        print(f"{percentile}th percentile: {value}")
     print(f"Max tokens: {lengths.max()}")
+    for limit in LENGTH_LIMITS:
+        over = int((lengths > limit).sum())
+        print(f"Samples over {limit} tokens: {over} ({over / len(lengths) * 100:.2f}%)")
 
     return lengths
 
 
 if __name__ == "__main__":
 
-    print("Loading tokenizer...")
-    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+    print(f"Loading tokenizer {TOKENIZER_NAME}...")
+    tokenizer = load_tokenizer(TOKENIZER_NAME)
 
     for name, path in DATASETS.items():
         print(f"\nLoading dataset: {name} from {path}")
         dataset = load_from_disk(path)
-        inspect_token_lengths(dataset, tokenizer)
+        inspect_token_lengths(dataset, tokenizer, num_proc=os.cpu_count())
+
 
-    
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+pack_sft.py
+
+Sequence packing for the tokenized SFT datasets written by format_dataset (input_ids column).
+
+Short examples are binned into fixed-length rows with a best-fit-decreasing packer
+instead of each being padded to MAX_SEQ_LENGTH. Every packed row carries segment_ids
+(1, 2, ... per example, 0 for padding) and positions (restarting at 0 for each example),
+so attention can be masked at example boundaries.
+
+The input is processed in windows of PACKING_WINDOW examples and rows are streamed into
+an Arrow dataset, so memory stays bounded for millions of examples.
+"""
+
+import bisect
+import os
+
+import numpy as np
+from datasets import Dataset, Features, Sequence, Value, load_from_disk
+
+from data_formatting.format_deepwriting_sft import MAX_SEQ_LENGTH
+from data_pipeline.instrumentation import instrumented
+
+#Relative paths
+DATASETS = {
+    "data/openmath_formatted_train": "data/openmath_packed_train",
+    "data/openmath_formatted_validation": "data/openmath_packed_validation",
+    "data/deepwriting_formatted_train": "data/deepwriting_packed_train",
+    "data/deepwriting_formatted_validation": "data/deepwriting_packed_validation",
+}
+
+PACKING_WINDOW = 100_000
+PAD_TOKEN_ID = 0
+
+PACKED_FEATURES = Features({
+    "input_ids": Sequence(Value("int32")),
+    "segment_ids": Sequence(Value("int32")),
+    "positions": Sequence(Value("int32")),
+})
+
+
+def best_fit_decreasing(lengths, capacity):
+    """Bins item indices so each bin's total length fits capacity; largest items placed first.
+
+    Each item goes to the fullest bin it still fits in (best fit), found by bisecting the
+    sorted remaining capacities.
+    """
+    bins = []
+    open_bins = []  # sorted (remaining capacity, bin index)
+    for item in np.argsort(-np.asarray(lengths), kind="stable"):
+        length = min(int(lengths[item]), capacity)
+        position = bisect.bisect_left(open_bins, (length, -1))
+        if position == len(open_bins):
+            bins.append([item])
+            remaining, index = capacity - length, len(bins) - 1
+        else:
+            remaining, index = open_bins.pop(position)
+            bins[index].append(item)
+            remaining -= length
+        if remaining > 0:
+            bisect.insort(open_bins, (remaining, index))
+    return bins
+
+
+def _packed_rows(dataset, seq_length, window, pad_id):
+    """Generator of packed rows, one packing window at a time."""
+    for start in range(0, len(dataset), window):
+        ids_column = dataset.with_format("arrow")[start:start + window].column("input_ids").combine_chunks()
+        offsets = ids_column.offsets.to_numpy()
+        values = ids_column.values.to_numpy()
+        lengths = np.minimum(np.diff(offsets), seq_length)
+
+        for members in best_fit_decreasing(lengths, seq_length):
+            input_ids = np.full(seq_length, pad_id, dtype=np.int32)
+            segment_ids = np.zeros(seq_length, dtype=np.int32)
+            positions = np.zeros(seq_length, dtype=np.int32)
+            cursor = 0
+            for segment, item in enumerate(sorted(members), start=1):
+                length = lengths[item]
+                input_ids[cursor:cursor + length] = values[offsets[item]:offsets[item] + length]
+                segment_ids[cursor:cursor + length] = segment
+                positions[cursor:cursor + length] = np.arange(length)
+                cursor += length
+            yield {"input_ids": input_ids, "segment_ids": segment_ids, "positions": positions}
+
+
+def example_lengths(dataset, window=PACKING_WINDOW):
+    """Token count of every example, read from the input_ids list offsets one window at a time."""
+    lengths = []
+    for start in range(0, len(dataset), window):
+        ids_column = dataset.with_format("arrow")[start:start + window].column("input_ids")
+        lengths.extend(np.diff(chunk.offsets.to_numpy()) for chunk in ids_column.chunks)
+    return np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+
+
+@instrumented
+def pack_dataset(dataset, seq_length=MAX_SEQ_LENGTH, window=PACKING_WINDOW, pad_id=PAD_TOKEN_ID):
+    """Packs a tokenized dataset into seq_length rows and reports the packing efficiency."""
+    if len(dataset) == 0:
+        # from_generator() cannot build a dataset without rows
+        print("No examples to pack.")
+        return Dataset.from_dict({name: [] for name in PACKED_FEATURES}, features=PACKED_FEATURES)
+
+    packed_dataset = Dataset.from_generator(
+        _packed_rows,
+        features=PACKED_FEATURES,
+        gen_kwargs={"dataset": dataset, "seq_length": seq_length, "window": window, "pad_id": pad_id},
+    )
+
+    lengths = example_lengths(dataset, window)
+    tokens = int(np.minimum(lengths, seq_length).sum())
+    truncated = int((lengths > seq_length).sum())
+    rows = len(packed_dataset)
+    print(f"Packed {len(dataset)} examples into {rows} rows of {seq_length} tokens.")
+    print(f"Packing efficiency: {tokens / (rows * seq_length) * 100:.2f}% "
+          f"(unpacked: {tokens / (len(dataset) * seq_length) * 100:.2f}%)")
+    if truncated:
+        print(f"Truncated {truncated} examples longer than {seq_length} tokens.")
+    return packed_dataset
+
+
+if __name__ == "__main__":
+    for formatted_dir, packed_dir in DATASETS.items():
+        if not os.path.exists(formatted_dir):
+            print(f"Skipping {formatted_dir}: not found")
+            continue
+        dataset = load_from_disk(formatted_dir)
+        print(f"\nPacking {formatted_dir} ({len(dataset)} examples)")
+
+        packed_dataset = pack_dataset(dataset)
+        packed_dataset.save_to_disk(packed_dir)
+        print(f"Packed dataset saved to {packed_dir}")
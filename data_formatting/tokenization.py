@@ -0,0 +1,100 @@
+"""
+tokenization.py
+
+Tokenizer helpers shared by the formatting and profiling scripts.
+
+TOKENIZER_NAME can be overridden with the TOKENIZER_NAME environment variable, e.g. to a
+local directory holding tokenizer.json / tokenizer_config.json so everything runs offline.
+
+Functions:
+- load_tokenizer(name_or_path): fast tokenizer from the hub or a local directory.
+- token_lengths(texts, tokenizer): batched token counts, keeping only lengths.
+- encode_segments(examples, tokenizer, max_length): batched token ids with token-level truncation.
+"""
+
+import os
+
+from transformers import AutoTokenizer
+
+TOKENIZER_NAME = os.environ.get("TOKENIZER_NAME", "google/gemma-3-1b-it")
+
+
+def load_tokenizer(name_or_path=TOKENIZER_NAME):
+    """Loads the fast tokenizer; a local directory is loaded without touching the network."""
+    return AutoTokenizer.from_pretrained(
+        name_or_path, use_fast=True, local_files_only=os.path.isdir(name_or_path)
+    )
+
+
+def token_lengths(texts, tokenizer):
+    """Batched: returns {"token_length": [...]} for the texts, with special tokens, untruncated."""
+    encoded = tokenizer(
+        texts,
+        truncation=False,
+        add_special_tokens=True,
+        return_attention_mask=False,
+    )
+    return {"token_length": [len(ids) for ids in encoded["input_ids"]]}
+
+
+def _segment_lengths(example, offsets, excess):
+    """Character length of every segment after dropping `excess` tokens from the truncatable ones, last first.
+
+    Only tokens lying entirely inside a segment are dropped; special tokens (empty offsets) never are.
+    """
+    starts = [0]
+    for segment_text, _ in example[:-1]:
+        starts.append(starts[-1] + len(segment_text))
+    lengths = [len(segment_text) for segment_text, _ in example]
+    for k in reversed(range(len(example))):
+        if excess <= 0:
+            break
+        if not example[k][1]:
+            continue
+        start, end = starts[k], starts[k] + lengths[k]
+        token_ends = [token_end for token_start, token_end in offsets
+                      if token_start >= start and token_end <= end and token_end > token_start]
+        cut = min(excess, len(token_ends))
+        kept = len(token_ends) - cut
+        lengths[k] = token_ends[kept - 1] - start if kept else 0
+        excess -= cut
+    if excess > 0:
+        raise ValueError("Fixed segments alone exceed max_length.")
+    return lengths
+
+
+def encode_segments(examples, tokenizer, max_length):
+    """Batched: tokenizes examples given as lists of (text, truncatable) segments into at most max_length ids.
+
+    The joined text is tokenized once. When it is too long, truncatable segments are cut
+    at the token boundaries of that tokenization, last one first, so fixed segments such
+    as the closing </reasoning>/<answer> tags always survive. The cut text is tokenized
+    again, so input_ids are always tokenizer(text)["input_ids"]; if merges across the cut
+    make it longer than max_length, one more token is cut until it fits.
+    """
+    texts = ["".join(segment_text for segment_text, _ in example) for example in examples]
+    encoded = tokenizer(texts, return_offsets_mapping=True, return_attention_mask=False)
+    input_ids = list(encoded["input_ids"])
+    offsets = encoded["offset_mapping"]
+
+    excess = [len(ids) - max_length for ids in input_ids]
+    pending = [i for i, over in enumerate(excess) if over > 0]
+    while pending:
+        for i in pending:
+            lengths = _segment_lengths(examples[i], offsets[i], excess[i])
+            texts[i] = "".join(segment_text[:length] for (segment_text, _), length in zip(examples[i], lengths))
+        retokenized = tokenizer([texts[i] for i in pending], return_attention_mask=False)["input_ids"]
+        still_pending = []
+        for i, ids in zip(pending, retokenized):
+            input_ids[i] = ids
+            if len(ids) > max_length:
+                excess[i] += len(ids) - max_length
+                still_pending.append(i)
+        pending = still_pending
+
+    return {
+        "text": texts,
+        "input_ids": input_ids,
+        "attention_mask": [[1] * len(ids) for ids in input_ids],
+        "num_tokens": [len(ids) for ids in input_ids],
+    }
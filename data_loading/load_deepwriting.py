@@ -4,23 +4,48 @@ load_openmath.py
 Utility functions to load and merge the OpenMathInstruct-1 dataset from Hugging Face.
 
 Functions:
-- load_deepwriting(): loads and saves the dataset from HF Hub.
+- load_deepwriting(columns, non_empty): loads and saves the dataset from HF Hub, optionally
+  reading only `columns` and rows with non-empty `non_empty` fields (see pushdown.py).
+- stream_deepwriting(): streams the dataset into resumable Arrow shards.
 
 Note: Deep writing dataset doesnt specify an explicit license. It is used for research purposes only and not redistributed"""
 
 from datasets import load_dataset
 
+from data_loading.pushdown import local_files, scan_dataset
+from data_loading.streaming import SHARD_SIZE, open_stream, write_shards
+from data_pipeline.stage_cache import run_stage
+from data_pipeline.instrumentation import instrumented
+
 #Relative path
 DEFAULT_SAVE_DIR = "data/deepwriting_raw"
+STREAM_SAVE_DIR = "data/deepwriting_shards"
+
+DEEPWRITING_REPO = "m-a-p/DeepWriting-20k"
+DEEPWRITING_FILE = "deepwriting20k.parquet"
+# Only prompt and solution are used downstream, and both must be non-empty
+COLUMNS = ["prompt", "solution"]
+LOAD_PARAMS = {"columns": COLUMNS, "non_empty": COLUMNS}
+# Not part of the cache key: a full read is timed too, to report what the scan saved
+LOAD_RUN_KWARGS = {"compare": True}
 
-def load_deepwriting(save= False, save_dir= DEFAULT_SAVE_DIR):
-    """Load DeepWriting-20k dataset from Hugging Face Hub."""
-    dataset_dict = load_dataset(
-        "m-a-p/DeepWriting-20k",
-        data_files = "deepwriting20k.parquet" 
-    )
+@instrumented
+def load_deepwriting(save= False, save_dir= DEFAULT_SAVE_DIR, columns=None, non_empty=(), data_files=None,
+                     compare=False):
+    """Load DeepWriting-20k dataset from Hugging Face Hub.
 
-    dataset = dataset_dict['train']
+    With columns / non_empty, the parquet file (downloaded once, or data_files) is scanned
+    with the projection and predicates pushed down instead of loading every column.
+    """
+    if columns or non_empty:
+        paths = data_files or local_files(DEEPWRITING_REPO, [DEEPWRITING_FILE])
+        dataset = scan_dataset(paths, columns=columns, non_empty=non_empty, compare=compare)
+    else:
+        dataset_dict = load_dataset(
+            DEEPWRITING_REPO,
+            data_files = DEEPWRITING_FILE
+        )
+        dataset = dataset_dict['train']
 
     #inspect the Dataset
     print("Dataset loaded:DeepWriting-20k")
@@ -33,9 +58,29 @@ def load_deepwriting(save= False, save_dir= DEFAULT_SAVE_DIR):
 
     return dataset
 
+@instrumented
+def stream_deepwriting(save_dir=STREAM_SAVE_DIR, data_files=None, shard_size=SHARD_SIZE, resume=True):
+    """Stream DeepWriting-20k into fixed-size Arrow shards, resuming after the last completed one.
+
+    Pass data_files (a local deepwriting20k.parquet or JSONL export) to read local files instead of the hub.
+    The returned dataset memory-maps the shards and can be passed straight to clean_deepwriting.
+    """
+    if data_files:
+        stream = open_stream(None, data_files=data_files)
+    else:
+        stream = open_stream(DEEPWRITING_REPO, data_files=DEEPWRITING_FILE)
+    dataset = write_shards(stream, save_dir, shard_size=shard_size, resume=resume)
+
+    print("Dataset streamed:DeepWriting-20k")
+    print("Dataset length:", len(dataset))
+    return dataset
+
 if __name__ == "__main__":
     
-    dataset = load_deepwriting(save=True)
+    dataset = run_stage(
+        "load_deepwriting", load_deepwriting, params=LOAD_PARAMS, run_kwargs=LOAD_RUN_KWARGS,
+        save_dirs={"output": DEFAULT_SAVE_DIR},
+    )["output"]
     
     #inspection
     print("First example in the dataset:", dataset[0])
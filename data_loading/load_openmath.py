@@ -4,21 +4,53 @@ load_openmath.py
 Utility functions to load and merge the OpenMathInstruct-1 dataset from Hugging Face.
 
 Functions:
-- load_open_math(): loads the dataset from HF Hub.
+- load_open_math(columns, non_empty, flags): loads the dataset from HF Hub, optionally reading
+  only `columns` and rows passing simple predicates (see pushdown.py).
 - merge_open_math_splits(dataset): merges the train and validation splits into a single dataset.
+- stream_openmath(): streams both splits into resumable Arrow shards, without a merged copy.
 
 Author: Amita 
 """
 
 # load datasets
-from datasets import load_dataset, concatenate_datasets
+from datasets import DatasetDict, load_dataset, concatenate_datasets
+
+from data_loading.pushdown import local_files, scan_dataset
+from data_loading.streaming import SHARD_SIZE, open_stream, write_shards
+from data_pipeline.stage_cache import run_stage
+from data_pipeline.instrumentation import instrumented
 
 #Relative path
 DEFAULT_SAVE_DIR = "data/openmath_merged"
-
-def load_open_math():
-    """Load OpenMathInstruct-1 dataset from Hugging Face Hub."""
-    dataset = load_dataset("nvidia/OpenMathInstruct-1")
+STREAM_SAVE_DIR = "data/openmath_shards"
+
+OPENMATH_REPO = "nvidia/OpenMathInstruct-1"
+OPENMATH_FILES = {
+    "train": ["correct_solutions/train.jsonl"],
+    "validation": ["correct_solutions/validation.jsonl"],
+}
+# Only these columns are used downstream, and all of them must be non-empty
+COLUMNS = ["question", "generated_solution", "expected_answer"]
+LOAD_PARAMS = {"columns": COLUMNS, "non_empty": COLUMNS}
+# Not part of the cache key: a full read is timed too, to report what the scan saved
+LOAD_RUN_KWARGS = {"compare": True}
+
+@instrumented
+def load_open_math(columns=None, non_empty=(), flags=None, data_files=None, compare=False):
+    """Load OpenMathInstruct-1 dataset from Hugging Face Hub.
+
+    With columns / non_empty / flags (e.g. {"is_correct": True}), each split's files
+    (downloaded once, or data_files as {split: paths}) are scanned with the projection and
+    predicates pushed down instead of loading every column.
+    """
+    if columns or non_empty or flags:
+        files = data_files or {split: local_files(OPENMATH_REPO, names) for split, names in OPENMATH_FILES.items()}
+        dataset = DatasetDict({
+            split: scan_dataset(paths, columns=columns, non_empty=non_empty, flags=flags, compare=compare)
+            for split, paths in files.items()
+        })
+    else:
+        dataset = load_dataset(OPENMATH_REPO)
 
     #inspect the existing split of the OpenMathsInstruct-1 Dataset
     print("Original dataset splits:", dataset)
@@ -26,6 +58,7 @@ def load_open_math():
 
     return dataset
 
+@instrumented
 def merge_open_math_splits(dataset):
     """Merge pre-split train and validation sets into a single training set"""    
     full_dataset = concatenate_datasets([dataset['train'], dataset['validation']])
@@ -35,9 +68,12 @@ def merge_open_math_splits(dataset):
     return full_dataset
 
 
-def load_and_merge_openmath(save=False, save_dir=DEFAULT_SAVE_DIR):
-    """Load and merge OpenMathInstruct-1 dataset, with optional saving."""
-    dataset = load_open_math()
+@instrumented
+def load_and_merge_openmath(save=False, save_dir=DEFAULT_SAVE_DIR, columns=None, non_empty=(), flags=None,
+                            data_files=None, compare=False):
+    """Load and merge OpenMathInstruct-1 dataset, with optional saving and pushed-down projection / predicates."""
+    dataset = load_open_math(columns=columns, non_empty=non_empty, flags=flags, data_files=data_files,
+                             compare=compare)
     full_dataset = merge_open_math_splits(dataset)
 
     if save:
@@ -46,9 +82,26 @@ def load_and_merge_openmath(save=False, save_dir=DEFAULT_SAVE_DIR):
 
     return full_dataset
 
+@instrumented
+def stream_openmath(save_dir=STREAM_SAVE_DIR, data_files=None, shard_size=SHARD_SIZE, resume=True):
+    """Stream the train and validation splits into fixed-size Arrow shards, resuming after the last completed one.
+
+    Pass data_files (local parquet/JSONL paths, or a {split: paths} dict) to read local files instead of the hub.
+    The returned dataset memory-maps the shards and can be passed straight to clean_openmath.
+    """
+    source = None if data_files else OPENMATH_REPO
+    stream = open_stream(source, splits=("train", "validation"), data_files=data_files)
+    full_dataset = write_shards(stream, save_dir, shard_size=shard_size, resume=resume)
+
+    print("Streamed dataset total length", len(full_dataset))
+    return full_dataset
+
 if __name__ == "__main__":
 
-    full_dataset = load_and_merge_openmath(save=True)
+    full_dataset = run_stage(
+        "load_openmath", load_and_merge_openmath, params=LOAD_PARAMS, run_kwargs=LOAD_RUN_KWARGS,
+        save_dirs={"output": DEFAULT_SAVE_DIR},
+    )["output"]
 
     #Inspection and verification 
     print("Merged dataset length:", len(full_dataset))
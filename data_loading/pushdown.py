@@ -0,0 +1,186 @@
+"""
+pushdown.py
+
+Column projection and row-predicate pushdown for the raw dataset loaders.
+
+Instead of load_dataset() materialising every column of every row, the source files are
+fetched locally (or given as local paths) and scanned with pyarrow.dataset, and simple
+predicates (required fields non-empty, flag columns equal to a value) are evaluated
+inside the scan, so dropped rows and columns are never written. For parquet only the
+requested column chunks are read and decoded, and row groups whose statistics rule out
+the predicate are not read at all. JSON has no columnar layout: pyarrow parses every
+field of every line, and the projection and predicate only decide what is kept.
+
+The scanned batches are streamed into one Arrow file under SCAN_DIR, memory-mapped as a
+Dataset, and keyed by the files, columns and predicate so a repeated scan is reused.
+Each scan prints a report of rows and columns kept, bytes read and decoded against a
+full read (from parquet metadata, or measured with compare=True, which also times a
+full, batch-by-batch read of every column for JSON and parquet), time and peak RSS.
+
+The predicates are a cheap pre-filter: the cleaning scripts still apply their own
+checks, which are at least as strict.
+
+Functions:
+- local_files(repo_id, filenames): local paths of hub dataset files, downloaded once.
+- row_filter(schema, non_empty, flags): pyarrow expression for the row predicates.
+- scan_dataset(paths, columns, non_empty, flags): memory-mapped Dataset of the pushed-down scan.
+"""
+
+import hashlib
+import json
+import os
+import resource
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from datasets import Dataset
+
+SCAN_DIR = "data/scans"
+SCAN_BATCH_SIZE = 65_536
+
+_FORMATS = {".parquet": "parquet", ".jsonl": "json", ".json": "json"}
+
+
+def local_files(repo_id, filenames):
+    """Returns local paths for files of a hub dataset repo, downloading them once into the HF cache."""
+    from huggingface_hub import hf_hub_download
+    return [
+        name if os.path.exists(name) else hf_hub_download(repo_id, name, repo_type="dataset")
+        for name in filenames
+    ]
+
+
+def row_filter(schema, non_empty=(), flags=None):
+    """Expression keeping rows whose non_empty fields are not null or blank and whose flags match.
+
+    String fields must contain a non-whitespace character; other types only need to be non-null.
+    Returns None when there is nothing to filter.
+    """
+    conditions = []
+    for field in non_empty:
+        condition = pc.field(field).is_valid()
+        if pa.types.is_string(schema.field(field).type) or pa.types.is_large_string(schema.field(field).type):
+            condition = condition & (pc.utf8_length(pc.utf8_trim_whitespace(pc.field(field))) > 0)
+        conditions.append(condition)
+    for field, value in (flags or {}).items():
+        conditions.append(pc.field(field) == value)
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _source(paths):
+    formats = {_FORMATS[os.path.splitext(path)[1]] for path in paths}
+    if len(formats) != 1:
+        raise ValueError(f"Expected files of one format, got {sorted(formats)}")
+    return ds.dataset(paths, format=formats.pop())
+
+
+def _scan_key(paths, columns, expression):
+    stats = [(os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)) for path in paths]
+    payload = json.dumps([stats, columns, str(expression)])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _parquet_bytes(paths, columns):
+    """(compressed, uncompressed) bytes of the given columns (all columns if None) from parquet metadata."""
+    import pyarrow.parquet as pq
+    compressed = uncompressed = 0
+    for path in paths:
+        metadata = pq.ParquetFile(path).metadata
+        for group in range(metadata.num_row_groups):
+            row_group = metadata.row_group(group)
+            for index in range(row_group.num_columns):
+                column = row_group.column(index)
+                if columns is None or column.path_in_schema.split(".")[0] in columns:
+                    compressed += column.total_compressed_size
+                    uncompressed += column.total_uncompressed_size
+    return compressed, uncompressed
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _megabytes(num_bytes):
+    return f"{num_bytes / 2**20:.1f} MB"
+
+
+def _report(source, paths, columns, scanned_columns, num_rows, file_size, seconds, full):
+    print(f"Columns kept: {len(columns)} of {len(source.schema.names)} ({', '.join(columns)})")
+    if source.format.default_extname == "parquet":
+        # Parquet metadata gives the totals without reading the data; JSON would need a full parse
+        total_rows = source.count_rows()
+        print(f"Rows kept: {num_rows} of {total_rows} ({total_rows - num_rows} dropped in the scan)")
+        read, decoded = _parquet_bytes(paths, scanned_columns)
+        full_read, full_decoded = _parquet_bytes(paths, None)
+        print(f"Parquet bytes read: {_megabytes(read)} of {_megabytes(full_read)}, "
+              f"decoded: {_megabytes(decoded)} of {_megabytes(full_decoded)}")
+    else:
+        # Every JSON field is parsed; the totals need a full read (compare=True)
+        if full is not None:
+            print(f"Rows kept: {num_rows} of {full[2]} ({full[2] - num_rows} dropped in the scan)")
+        else:
+            print(f"Rows kept: {num_rows}")
+        print(f"JSON bytes parsed: {_megabytes(sum(os.path.getsize(path) for path in paths))}")
+    print(f"Arrow bytes written: {_megabytes(file_size)}")
+    print(f"Scan time: {seconds:.2f}s, peak RSS: {_peak_rss_mb():.0f} MB")
+    if full is not None:
+        full_seconds, full_bytes, full_rows = full
+        print(f"Full read: {full_rows} rows, {full_seconds:.2f}s, {_megabytes(full_bytes)} in memory -> "
+              f"saved {full_seconds - seconds:.2f}s and {_megabytes(full_bytes - file_size)}")
+
+
+def _full_read(source, batch_size=SCAN_BATCH_SIZE):
+    """(seconds, bytes, rows) of reading every column and row, a batch at a time so it is not held in memory."""
+    start = time.perf_counter()
+    num_bytes = num_rows = 0
+    for batch in source.to_batches(batch_size=batch_size):
+        num_bytes += batch.nbytes
+        num_rows += batch.num_rows
+    return time.perf_counter() - start, num_bytes, num_rows
+
+
+def scan_dataset(paths, columns=None, non_empty=(), flags=None, scan_dir=SCAN_DIR,
+                 batch_size=SCAN_BATCH_SIZE, compare=False):
+    """Scans local parquet/JSONL files with column projection and row predicates pushed down.
+
+    Returns a Dataset memory-mapped from the scanned Arrow file. With compare=True an
+    unprojected, unfiltered read is timed as well, to report the time and bytes saved.
+    """
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    source = _source(paths)
+    columns = list(columns or source.schema.names)
+    expression = row_filter(source.schema, non_empty, flags)
+    # Flag columns are read for the predicate but not projected
+    scanned_columns = set(columns) | set(non_empty) | set(flags or {})
+
+    path = os.path.join(scan_dir, f"{_scan_key(paths, columns, expression)}.arrow")
+    if os.path.exists(path):
+        print(f"Reusing scan {path}")
+        return Dataset.from_file(path)
+
+    print(f"Scanning {len(paths)} file(s) with columns={columns}, filter={expression}")
+    os.makedirs(scan_dir, exist_ok=True)
+    start = time.perf_counter()
+    num_rows = 0
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    schema = pa.schema([source.schema.field(column) for column in columns])
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_stream(sink, schema) as writer:
+        # One file at a time, so rows keep the order of the files
+        for file_path in paths:
+            fragment = ds.dataset(file_path, schema=source.schema, format=source.format)
+            for batch in fragment.to_batches(columns=columns, filter=expression, batch_size=batch_size):
+                writer.write_batch(batch)
+                num_rows += batch.num_rows
+    os.replace(tmp_path, path)
+    seconds = time.perf_counter() - start
+
+    full = _full_read(source, batch_size) if compare else None
+    _report(source, paths, columns, scanned_columns, num_rows, os.path.getsize(path), seconds, full)
+    return Dataset.from_file(path)
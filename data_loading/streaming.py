@@ -0,0 +1,157 @@
+"""
+streaming.py
+
+Streaming ingestion shared by load_openmath.py and load_deepwriting.py.
+
+Source splits are iterated incrementally (Hugging Face Hub streaming, or local
+parquet/JSONL files as a stand-in) and written as fixed-size Arrow shards while the
+download is still running. A manifest.json records every completed shard, so an
+interrupted run resumes after the last completed one.
+
+Every shard is written with the same schema: the stream's features or, when the stream
+has none (common for hub streaming), the schema inferred from the first batch. A column
+that is all null so far gets its type from the first batch with values. The schema is
+kept in the manifest, so a resumed run writes the same one, and load_shards() casts
+shards written before a null column got its type.
+
+The shards are memory-mapped straight into a Dataset by load_shards(), which the
+cleaning stage can consume directly: there is no intermediate merged copy.
+
+Functions:
+- open_stream(source, splits, data_files): IterableDataset over all requested splits.
+- iter_shards(stream, save_dir, shard_size): writes shards, yielding each one when done.
+- write_shards(stream, save_dir, shard_size): writes all shards and returns load_shards().
+- load_shards(save_dir): memory-mapped Dataset over the completed shards.
+"""
+
+import json
+import os
+
+import pyarrow as pa
+from datasets import Dataset, Features, concatenate_datasets, load_dataset
+from data_pipeline.instrumentation import instrumented
+
+SHARD_SIZE = 100_000
+MANIFEST_FILE = "manifest.json"
+
+_LOCAL_FORMATS = {".parquet": "parquet", ".jsonl": "json", ".json": "json"}
+
+
+def open_stream(source, splits=("train",), data_files=None):
+    """Returns an IterableDataset over `splits` of a hub dataset, or over local parquet/JSONL files.
+
+    For local files pass source=None and data_files as a path, list of paths, or a
+    {split: paths} dict.
+    """
+    if source is None:
+        files = data_files if isinstance(data_files, dict) else {"train": data_files}
+        first = next(iter(files.values()))
+        first = first if isinstance(first, str) else first[0]
+        builder = _LOCAL_FORMATS[os.path.splitext(first)[1]]
+        streams = [load_dataset(builder, data_files=files, split=split, streaming=True) for split in files]
+    else:
+        streams = [
+            load_dataset(source, data_files=data_files, split=split, streaming=True)
+            for split in splits
+        ]
+    return streams[0] if len(streams) == 1 else concatenate_datasets(streams)
+
+
+def _read_manifest(save_dir, shard_size):
+    path = os.path.join(save_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"shard_size": shard_size, "shards": [], "complete": False}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest["shard_size"] != shard_size:
+        raise ValueError(
+            f"{save_dir} was written with shard_size={manifest['shard_size']}, not {shard_size}."
+        )
+    return manifest
+
+
+def _write_manifest(save_dir, manifest):
+    tmp_path = os.path.join(save_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(save_dir, MANIFEST_FILE))
+
+
+def _batch_schema(batch, schema):
+    """The schema to write a batch with: schema (inferred if None) with null-typed columns typed from this batch."""
+    if schema is None:
+        return pa.Table.from_pydict(batch).schema
+    null_fields = [field.name for field in schema if pa.types.is_null(field.type)]
+    if not null_fields:
+        return schema
+    inferred = pa.Table.from_pydict({name: batch[name] for name in null_fields}).schema
+    for field in inferred:
+        if not pa.types.is_null(field.type):
+            schema = schema.set(schema.get_field_index(field.name), field)
+    return schema
+
+
+def _write_shard(path, batch, schema):
+    """Writes one shard atomically in the Arrow stream format that Dataset.from_file maps."""
+    table = pa.Table.from_pydict(batch, schema=schema)
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+def iter_shards(stream, save_dir, shard_size=SHARD_SIZE, resume=True):
+    """Writes the stream as fixed-size Arrow shards, yielding each shard Dataset once it is complete."""
+    os.makedirs(save_dir, exist_ok=True)
+    manifest = _read_manifest(save_dir, shard_size) if resume else {
+        "shard_size": shard_size, "shards": [], "complete": False,
+    }
+    if manifest["complete"]:
+        print(f"All {len(manifest['shards'])} shards already written to {save_dir}")
+        return
+
+    done_rows = sum(shard["num_rows"] for shard in manifest["shards"])
+    if done_rows:
+        print(f"Resuming after {len(manifest['shards'])} completed shards ({done_rows} rows)")
+        stream = stream.skip(done_rows)
+
+    if stream.features is not None:
+        schema = stream.features.arrow_schema
+    elif "features" in manifest:
+        schema = Features.from_dict(manifest["features"]).arrow_schema
+    else:
+        schema = None
+    for batch in stream.iter(batch_size=shard_size):
+        schema = _batch_schema(batch, schema)
+        file_name = f"shard-{len(manifest['shards']):05d}.arrow"
+        num_rows = _write_shard(os.path.join(save_dir, file_name), batch, schema)
+        manifest["shards"].append({"file": file_name, "num_rows": num_rows})
+        manifest["features"] = Features.from_arrow_schema(schema).to_dict()
+        _write_manifest(save_dir, manifest)
+        print(f"Wrote {file_name} ({num_rows} rows)")
+        yield Dataset.from_file(os.path.join(save_dir, file_name))
+
+    manifest["complete"] = True
+    _write_manifest(save_dir, manifest)
+
+
+@instrumented
+def load_shards(save_dir):
+    """Memory-maps every completed shard in save_dir into a single Dataset (no copy)."""
+    with open(os.path.join(save_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    shards = [Dataset.from_file(os.path.join(save_dir, shard["file"])) for shard in manifest["shards"]]
+    if "features" in manifest:
+        # Shards written while a column was still all null have it as null-typed
+        features = Features.from_dict(manifest["features"])
+        shards = [shard if shard.features == features else shard.cast(features) for shard in shards]
+    return concatenate_datasets(shards)
+
+
+@instrumented
+def write_shards(stream, save_dir, shard_size=SHARD_SIZE, resume=True):
+    """Writes (or resumes writing) the whole stream as shards and returns them as one Dataset."""
+    for _ in iter_shards(stream, save_dir, shard_size=shard_size, resume=resume):
+        pass
+    return load_shards(save_dir)
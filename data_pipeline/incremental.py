@@ -0,0 +1,257 @@
+"""
+incremental.py
+
+Append mode for the clean -> split -> format stages, for new data (a new OpenMathInstruct
+release, an extra DeepWriting shard) arriving after the corpus was prepared.
+
+Only the new rows go through the stages:
+- clean: the usual cleaning steps, with exact dedup against a persistent key store of
+  every question / prompt already seen (data_cleaning/key_store.py), so a new row that
+  duplicates an old one is dropped without re-reading the old data.
+- split: the hash split, which assigns each row from its own key, so appended rows land
+  where a full re-run would put them and old rows never move.
+- format: format_dataset() on the new train / validation rows.
+Each output is appended to the existing save_to_disk directory as new Arrow shards
+(listed in its state.json, which is replaced last), so the cost is proportional to the
+delta. The shards are named after the delta's fingerprint, so a directory that already
+holds the delta is recognised and skipped: a run that failed after appending to some
+directories can simply be retried. The key store is committed after all outputs are
+written, and records the delta's fingerprint so the same delta is not appended twice.
+
+Near-dedup, when enabled, only compares the new rows with each other.
+
+The key store has to describe the existing corpus, so it is built once with rebuild=True
+(--rebuild), which cleans the full raw dataset with an empty store and rewrites the
+outputs, i.e. what the regular pipeline does.
+
+Usage:
+    python -m data_pipeline.incremental openmath --rebuild
+    python -m data_pipeline.incremental openmath new_release/train.jsonl new_release/validation.jsonl
+    python -m data_pipeline.incremental deepwriting extra_shard.parquet
+
+Functions:
+- append_to_disk(dataset, save_dir, tag): adds the dataset as new shards of a saved dataset.
+- append_delta(branch, delta): cleans, splits and formats the delta and appends the outputs.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+
+from datasets import load_from_disk
+
+from data_cleaning import clean_deepwriting, clean_openmath, split_deepwriting, split_openmath
+from data_cleaning.key_store import commit, has_source, num_keys, open_key_store
+from data_formatting import format_deepwriting_sft, format_openmath_sft
+from data_formatting.tokenization import TOKENIZER_NAME, load_tokenizer
+from data_loading import load_deepwriting, load_openmath
+from data_loading.pushdown import scan_dataset
+from data_pipeline.instrumentation import instrumented
+from data_pipeline.stage_cache import STAGE_KEY_FILE
+
+#Relative paths
+KEY_STORE_DIRS = {
+    "openmath": "data/openmath_key_store",
+    "deepwriting": "data/deepwriting_key_store",
+}
+
+# clean: clean_* function; cleaned_dir: its output; raw_dir / load_params: the load stage's output and scan
+Branch = namedtuple("Branch", ["clean", "cleaned_dir", "split", "format", "raw_dir", "load_params"])
+
+BRANCHES = {
+    "openmath": Branch(
+        clean_openmath.clean_openmath, clean_openmath.CLEANED_SAVE_DIR, split_openmath, format_openmath_sft,
+        load_openmath.DEFAULT_SAVE_DIR, load_openmath.LOAD_PARAMS,
+    ),
+    "deepwriting": Branch(
+        clean_deepwriting.clean_deepwriting, clean_deepwriting.CLEANED_SAVE_DIR, split_deepwriting,
+        format_deepwriting_sft, load_deepwriting.DEFAULT_SAVE_DIR, load_deepwriting.LOAD_PARAMS,
+    ),
+}
+
+STATE_FILE = "state.json"
+INFO_FILE = "dataset_info.json"
+
+
+def _combined_fingerprint(*fingerprints):
+    return hashlib.sha256("-".join(fingerprints).encode()).hexdigest()[:16]
+
+
+def _shard_name(index, tag):
+    return f"data-{index:05d}-{tag}.arrow"
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, value):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def has_tag(save_dir, tag):
+    """Whether the dataset saved in save_dir already holds shards appended under this tag."""
+    state_path = os.path.join(save_dir, STATE_FILE)
+    if not os.path.exists(state_path):
+        return False
+    return any(data_file["filename"].endswith(f"-{tag}.arrow") for data_file in _read_json(state_path)["_data_files"])
+
+
+def _update_info(save_dir, state, num_rows):
+    """Sets the row count and sizes in dataset_info.json from the files listed in state (so it is idempotent)."""
+    info_path = os.path.join(save_dir, INFO_FILE)
+    if not os.path.exists(info_path):
+        return
+    info = _read_json(info_path)
+    num_bytes = sum(os.path.getsize(os.path.join(save_dir, data_file["filename"]))
+                    for data_file in state["_data_files"])
+    split = (info.get("splits") or {}).get(state.get("_split") or "")
+    if split is not None:
+        split["num_examples"] = num_rows
+        split["num_bytes"] = num_bytes
+    if info.get("dataset_size") is not None:
+        info["dataset_size"] = num_bytes
+        if info.get("download_size") is not None:
+            info["size_in_bytes"] = info["download_size"] + info["dataset_size"]
+    _write_json(info_path, info)
+
+
+def append_to_disk(dataset, save_dir, tag="appended"):
+    """Appends the dataset to the one saved in save_dir as new shards (saves it if there is none).
+
+    The new Arrow files are named data-NNNNN-<tag>.arrow and moved next to the existing
+    ones; dataset_info.json is updated, and state.json, which lists the files, is replaced
+    last, so readers see either the old or the new dataset. Does nothing if save_dir
+    already holds shards with this tag.
+    """
+    state_path = os.path.join(save_dir, STATE_FILE)
+    if has_tag(save_dir, tag):
+        print(f"{save_dir} already holds {tag}, skipping")
+        return
+    exists = os.path.exists(state_path)
+    if exists and len(dataset) == 0:
+        return
+    existing = load_from_disk(save_dir) if exists else None
+    if existing is not None and dataset.features != existing.features:
+        dataset = dataset.cast(existing.features)
+
+    tmp_dir = f"{save_dir.rstrip(os.sep)}.append-tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    dataset.save_to_disk(tmp_dir)
+    new_state = _read_json(os.path.join(tmp_dir, STATE_FILE))
+    if not exists:
+        # First save: the tagged files and the new state, then the directory as a whole
+        for index, data_file in enumerate(new_state["_data_files"]):
+            os.replace(os.path.join(tmp_dir, data_file["filename"]), os.path.join(tmp_dir, _shard_name(index, tag)))
+            data_file["filename"] = _shard_name(index, tag)
+        _write_json(os.path.join(tmp_dir, STATE_FILE), new_state)
+        shutil.rmtree(save_dir, ignore_errors=True)
+        os.replace(tmp_dir, save_dir)
+        print(f"Saved {len(dataset)} rows to {save_dir}")
+        return
+
+    state = _read_json(state_path)
+    for data_file in new_state["_data_files"]:
+        file_name = _shard_name(len(state["_data_files"]), tag)
+        os.replace(os.path.join(tmp_dir, data_file["filename"]), os.path.join(save_dir, file_name))
+        state["_data_files"].append({"filename": file_name})
+    shutil.rmtree(tmp_dir)
+    # A new fingerprint, so stage-cache keys computed from this dataset change too
+    state["_fingerprint"] = _combined_fingerprint(state["_fingerprint"], dataset._fingerprint)
+
+    _update_info(save_dir, state, len(existing) + len(dataset))
+    _write_json(state_path, state)
+    # The directory no longer holds a stage-cache result; the next full run rewrites it
+    marker = os.path.join(save_dir, STAGE_KEY_FILE)
+    if os.path.exists(marker):
+        os.remove(marker)
+    print(f"Appended {len(dataset)} rows to {save_dir} ({len(existing) + len(dataset)} in total)")
+
+
+def _replace_on_disk(dataset, save_dir):
+    tmp_dir = f"{save_dir}.tmp-{os.getpid()}"
+    dataset.save_to_disk(tmp_dir)
+    shutil.rmtree(save_dir, ignore_errors=True)
+    os.replace(tmp_dir, save_dir)
+
+
+def _outputs(branch, cleaned, num_proc, tokenizer):
+    """{save_dir: dataset} for the cleaned, split and formatted delta; empty splits are left out."""
+    split = branch.split
+    if split.split_mode != "hash":
+        raise ValueError(f"Appending needs the hash split, not split_mode={split.split_mode!r}")
+    train, validation = split.split_dataset(
+        cleaned, mode="hash", train_ratio=split.train_ratio, seed=split.random_seed, num_proc=num_proc,
+    )
+    formatting = branch.format
+    outputs = {branch.cleaned_dir: cleaned}
+    for dataset, split_dir, formatted_dir in [
+        (train, split.train_split_dir, formatting.formatted_train_dir),
+        (validation, split.validation_split_dir, formatting.formatted_validation_dir),
+    ]:
+        if len(dataset):
+            outputs[split_dir] = dataset
+            outputs[formatted_dir] = formatting.format_dataset(
+                dataset, tokenizer=tokenizer, max_length=formatting.MAX_SEQ_LENGTH, num_proc=num_proc,
+            )
+    return outputs
+
+
+@instrumented
+def append_delta(branch, delta, num_proc=None, tokenizer=None, key_store_dir=None, rebuild=False):
+    """Cleans, splits and formats only the delta rows and appends them to the branch's outputs.
+
+    With rebuild=True, delta is the full raw dataset: the key store is recreated and the
+    outputs are rewritten instead of appended to.
+    """
+    config = BRANCHES[branch]
+    key_store_dir = key_store_dir or KEY_STORE_DIRS[branch]
+    if rebuild:
+        shutil.rmtree(key_store_dir, ignore_errors=True)
+    store = open_key_store(key_store_dir)
+    if has_source(store, delta._fingerprint):
+        print(f"{branch}: delta {delta._fingerprint} was already appended, skipping")
+        return None
+    if not rebuild and num_keys(store) == 0 and os.path.exists(config.cleaned_dir):
+        raise ValueError(f"{key_store_dir} is empty but {config.cleaned_dir} exists: "
+                         f"build the key store with rebuild=True (--rebuild) first")
+
+    print(f"{branch}: {'rebuilding from' if rebuild else 'appending'} {len(delta)} rows")
+    cleaned = config.clean(delta, num_proc=num_proc, key_store=store)
+    outputs = _outputs(config, cleaned, num_proc, tokenizer) if len(cleaned) else {}
+    for save_dir, dataset in outputs.items():
+        if rebuild:
+            _replace_on_disk(dataset, save_dir)
+        else:
+            append_to_disk(dataset, save_dir, tag=delta._fingerprint)
+    commit(store, delta._fingerprint)
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Append new raw data to the prepared datasets.")
+    parser.add_argument("branch", choices=list(BRANCHES))
+    parser.add_argument("files", nargs="*", help="New local parquet/JSONL files.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild the key store and outputs from the load stage's full dataset.")
+    parser.add_argument("--num-proc", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    config = BRANCHES[args.branch]
+    if args.rebuild:
+        delta = load_from_disk(config.raw_dir)
+    elif args.files:
+        # Same projection and predicates as the load stage
+        delta = scan_dataset(args.files, **config.load_params)
+    else:
+        parser.error("pass the new files, or --rebuild")
+
+    append_delta(args.branch, delta, num_proc=args.num_proc, tokenizer=load_tokenizer(TOKENIZER_NAME),
+                 rebuild=args.rebuild)
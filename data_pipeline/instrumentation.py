@@ -0,0 +1,291 @@
+"""
+instrumentation.py
+
+Structured spans for the load / clean / split / format stage functions.
+
+Stage functions are wrapped with @instrumented. When instrumentation is enabled, every
+call emits one JSON line with its wall time, rows in / out, row delta, rows/sec, bytes
+read / written by the process, growth of the datasets cache files and the memory
+high-water mark (this process and its largest finished worker). Spans record their
+parent span, so nested steps (e.g. deduplicate inside clean_openmath) can be attributed.
+Optionally, per-stage totals are also written as Prometheus text to a local file that a
+node-exporter textfile collector can scrape.
+
+When disabled (the default), the wrapper only checks one flag before calling the stage.
+
+A chosen stage can be profiled: with cProfile (a .prof file per call, readable with
+pstats / snakeviz) or by attaching py-spy to the process for the duration of the stage.
+
+Enable with configure(...) or with environment variables, which worker processes inherit:
+    PIPELINE_METRICS=data/metrics/spans.jsonl
+    PIPELINE_METRICS_PROM=data/metrics/pipeline.prom
+    PIPELINE_PROFILE=clean_openmath.clean_openmath   (comma-separated span names)
+    PIPELINE_PROFILER=cprofile | py-spy
+
+Functions:
+- instrumented(fn): decorator emitting a span per call.
+- configure(metrics_path, prometheus_path, profile_stages, profiler): enables / disables spans.
+"""
+
+import cProfile
+import fcntl
+import functools
+import json
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+PROFILE_DIR = "data/metrics/profiles"
+
+# Prometheus metric name -> (type, help)
+PROMETHEUS_METRICS = {
+    "pipeline_stage_calls_total": ("counter", "Calls of each pipeline stage."),
+    "pipeline_stage_seconds_total": ("counter", "Wall time spent in each pipeline stage."),
+    "pipeline_stage_rows_total": ("counter", "Input rows processed by each pipeline stage."),
+    "pipeline_stage_peak_rss_megabytes": ("gauge", "Memory high-water mark after each pipeline stage."),
+}
+
+_ENV_METRICS = "PIPELINE_METRICS"
+_ENV_PROMETHEUS = "PIPELINE_METRICS_PROM"
+_ENV_PROFILE = "PIPELINE_PROFILE"
+_ENV_PROFILER = "PIPELINE_PROFILER"
+
+
+class _State:
+    enabled = False
+    metrics_path = None
+    prometheus_path = None
+    profile_stages = frozenset()
+    profiler = "cprofile"
+    totals = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+
+def configure(metrics_path=None, prometheus_path=None, profile_stages=(), profiler="cprofile"):
+    """Enables spans (JSON lines to metrics_path, Prometheus text to prometheus_path) and profiling.
+
+    The settings are mirrored into the environment so worker processes pick them up.
+    Calling configure() with no arguments disables instrumentation.
+    """
+    _State.metrics_path = metrics_path
+    _State.prometheus_path = prometheus_path
+    _State.profile_stages = frozenset(profile_stages)
+    _State.profiler = profiler
+    _State.enabled = bool(metrics_path or prometheus_path or profile_stages)
+
+    for name, value in ((_ENV_METRICS, metrics_path), (_ENV_PROMETHEUS, prometheus_path),
+                        (_ENV_PROFILE, ",".join(profile_stages)), (_ENV_PROFILER, profiler)):
+        if value:
+            os.environ[name] = value
+        else:
+            os.environ.pop(name, None)
+
+
+def _configure_from_env():
+    profile = os.environ.get(_ENV_PROFILE, "")
+    configure(
+        metrics_path=os.environ.get(_ENV_METRICS),
+        prometheus_path=os.environ.get(_ENV_PROMETHEUS),
+        profile_stages=[stage for stage in profile.split(",") if stage],
+        profiler=os.environ.get(_ENV_PROFILER, "cprofile"),
+    )
+
+
+def _io_bytes():
+    """(read_bytes, write_bytes) of this process from /proc, or (None, None) where unavailable."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["read_bytes"]), int(fields["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def _is_dataset(value):
+    return hasattr(value, "column_names") and hasattr(value, "cache_files")
+
+
+def _splits(value):
+    # A DatasetDict is a dict of its splits; counted as one dataset, len() would be the number of splits
+    return list(value.values()) if isinstance(value, dict) else [value]
+
+
+def _datasets(value):
+    """Datasets in a stage argument or result (a Dataset or DatasetDict, or a tuple/list/dict holding some)."""
+    if isinstance(value, (tuple, list)):
+        return [dataset for item in value for dataset in _splits(item) if _is_dataset(dataset)]
+    return [dataset for item in _splits(value) for dataset in _splits(item) if _is_dataset(dataset)]
+
+
+def _rows(datasets):
+    try:
+        return sum(len(dataset) for dataset in datasets) if datasets else None
+    except TypeError:  # IterableDataset
+        return None
+
+
+def _cache_files(datasets):
+    files = set()
+    for dataset in datasets:
+        files.update(cache_file["filename"] for cache_file in getattr(dataset, "cache_files", []) or [])
+    return files
+
+
+def _file_bytes(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def _start_py_spy(stage):
+    if shutil.which("py-spy") is None:
+        print("py-spy not found on PATH, profiling skipped")
+        return None, None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    output = os.path.join(PROFILE_DIR, f"{stage}-{os.getpid()}-{int(time.time())}.svg")
+    process = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--subprocesses", "-o", output])
+    return process, output
+
+
+def _profiled_call(stage, fn, args, kwargs):
+    """Runs fn under cProfile or py-spy, writing the profile under PROFILE_DIR."""
+    if _State.profiler == "py-spy":
+        process, output = _start_py_spy(stage)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if process is not None:
+                process.send_signal(signal.SIGINT)  # py-spy writes its output on interrupt
+                process.wait()
+                print(f"py-spy profile of {stage} written to {output}")
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    output = os.path.join(PROFILE_DIR, f"{stage}-{os.getpid()}-{int(time.time())}.prof")
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(output)
+        print(f"cProfile stats of {stage} written to {output}")
+
+
+def _append_line(path, record):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def _write_prometheus(path):
+    """Rewrites this process's samples in the Prometheus text file, keeping other processes' samples."""
+    pid_label = f'pid="{os.getpid()}"'
+    samples = []
+    for stage, totals in sorted(_State.totals.items()):
+        label = f'{{stage="{stage}",{pid_label}}}'
+        samples.append(f"pipeline_stage_calls_total{label} {totals['calls']}")
+        samples.append(f"pipeline_stage_seconds_total{label} {totals['seconds']:.6f}")
+        samples.append(f"pipeline_stage_rows_total{label} {totals['rows']}")
+        samples.append(f"pipeline_stage_peak_rss_megabytes{label} {totals['peak_rss_mb']:.1f}")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Chains run in separate processes writing the same file, so updates are serialised
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(path):
+            with open(path) as f:
+                samples += [line for line in f.read().splitlines()
+                            if line and not line.startswith("#") and pid_label not in line]
+
+        lines = []
+        for name, (metric_type, description) in PROMETHEUS_METRICS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+            lines += sorted(sample for sample in samples if sample.startswith(name + "{"))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def _emit(record):
+    with _State.lock:
+        if _State.metrics_path:
+            _append_line(_State.metrics_path, record)
+        if _State.prometheus_path:
+            totals = _State.totals.setdefault(
+                record["stage"], {"calls": 0, "seconds": 0.0, "rows": 0, "peak_rss_mb": 0.0}
+            )
+            totals["calls"] += 1
+            totals["seconds"] += record["seconds"]
+            totals["rows"] += record["rows_in"] or 0
+            totals["peak_rss_mb"] = max(totals["peak_rss_mb"], record["peak_rss_mb"])
+            _write_prometheus(_State.prometheus_path)
+
+
+def _traced_call(stage, fn, args, kwargs):
+    inputs = [dataset for value in (*args, *kwargs.values()) for dataset in _datasets(value)]
+    input_files = _cache_files(inputs)
+    read_before, written_before = _io_bytes()
+    rss_before = _peak_rss_mb()
+    stack = _State.local.__dict__.setdefault("stack", [])
+    parent = stack[-1] if stack else None
+
+    stack.append(stage)
+    start_time = time.time()
+    start = time.perf_counter()
+    try:
+        if stage in _State.profile_stages:
+            result = _profiled_call(stage, fn, args, kwargs)
+        else:
+            result = fn(*args, **kwargs)
+    finally:
+        stack.pop()
+    seconds = time.perf_counter() - start
+
+    outputs = _datasets(result)
+    read_after, written_after = _io_bytes()
+    rows_in, rows_out = _rows(inputs), _rows(outputs)
+    peak_rss = _peak_rss_mb()
+    _emit({
+        "stage": stage,
+        "parent": parent,
+        "pid": os.getpid(),
+        "start": start_time,
+        "seconds": seconds,
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+        "row_delta": rows_out - rows_in if rows_in is not None and rows_out is not None else None,
+        "rows_per_sec": rows_in / seconds if rows_in and seconds > 0 else None,
+        "bytes_read": read_after - read_before if read_before is not None else None,
+        "bytes_written": written_after - written_before if written_before is not None else None,
+        "cache_bytes_added": _file_bytes(_cache_files(outputs) - input_files),
+        "peak_rss_mb": peak_rss,
+        "peak_rss_growth_mb": peak_rss - rss_before,
+    })
+    return result
+
+
+def instrumented(fn):
+    """Decorator: emits a span named "<module>.<function>" for every call while instrumentation is enabled."""
+    # File name rather than __module__, so scripts run as __main__ get the same names
+    module = os.path.splitext(os.path.basename(fn.__code__.co_filename))[0]
+    stage = f"{module}.{fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _State.enabled:
+            return fn(*args, **kwargs)
+        return _traced_call(stage, fn, args, kwargs)
+
+    wrapper.stage = stage
+    return wrapper
+
+
+_configure_from_env()
@@ -0,0 +1,253 @@
+"""
+run_pipeline.py
+
+Single entry point for the data preparation pipeline.
+
+The stages and their dependencies form a DAG:
+
+    load_openmath    -> clean_openmath    -> split_openmath    -> format_openmath
+    load_deepwriting -> clean_deepwriting -> split_deepwriting -> format_deepwriting
+
+The selected stages are grouped into independent chains (connected components) and each
+chain runs in its own worker process, so the OpenMath and DeepWriting branches run
+concurrently and wall time is bounded by the slower branch. Within a chain, datasets are
+passed between stages in memory; inputs produced by stages outside the selection are
+loaded from their data/... directories. Every stage goes through the stage cache.
+
+Usage:
+    python -m data_pipeline.run_pipeline                       # everything
+    python -m data_pipeline.run_pipeline --stages format       # re-format only
+    python -m data_pipeline.run_pipeline --branches openmath --stages clean split
+    python -m data_pipeline.run_pipeline --metrics data/metrics/spans.jsonl --profile clean_openmath.clean_openmath
+"""
+
+import argparse
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from datasets import load_from_disk
+
+from data_cleaning import clean_deepwriting, clean_openmath, split_deepwriting, split_openmath
+from data_formatting import format_deepwriting_sft, format_openmath_sft
+from data_formatting.tokenization import TOKENIZER_NAME, load_tokenizer
+from data_loading import load_deepwriting, load_openmath
+from data_pipeline.instrumentation import configure
+from data_pipeline.stage_cache import run_stage
+
+BRANCHES = ["openmath", "deepwriting"]
+KINDS = ["load", "clean", "split", "format"]
+
+# deps: input name -> (stage, output name); outputs: output name -> data/... directory
+Stage = namedtuple("Stage", ["branch", "kind", "deps", "outputs", "run"])
+
+
+def _load(name, fn, save_dir, params, run_kwargs):
+    def run(inputs, num_proc):
+        return run_stage(name, fn, params=params, run_kwargs=run_kwargs, save_dirs={"output": save_dir})
+    return run
+
+
+def _clean(name, fn, save_dir):
+    def run(inputs, num_proc):
+        return run_stage(
+            name, fn, inputs={"dataset": inputs["dataset"]},
+            run_kwargs={"num_proc": num_proc}, save_dirs={"output": save_dir},
+        )
+    return run
+
+
+def _split(name, module):
+    def run(inputs, num_proc):
+        return run_stage(
+            name, module.split_dataset,
+            inputs={"dataset": inputs["dataset"]},
+            params={"mode": module.split_mode, "train_ratio": module.train_ratio, "seed": module.random_seed},
+            run_kwargs={"num_proc": num_proc},
+            output_names=("train", "validation"),
+            save_dirs={"train": module.train_split_dir, "validation": module.validation_split_dir},
+        )
+    return run
+
+
+def _format(name, module):
+    def run(inputs, num_proc):
+        tokenizer = load_tokenizer(TOKENIZER_NAME)
+        save_dirs = {"train": module.formatted_train_dir, "validation": module.formatted_validation_dir}
+        return {
+            split: run_stage(
+                name, module.format_dataset,
+                inputs={"dataset": inputs[split]},
+                params={"max_length": module.MAX_SEQ_LENGTH},
+                run_kwargs={"tokenizer": tokenizer, "num_proc": num_proc},
+                key_extras={"tokenizer": TOKENIZER_NAME},
+                save_dirs={"output": save_dir},
+            )["output"]
+            for split, save_dir in save_dirs.items()
+        }
+    return run
+
+
+STAGES = {
+    "load_openmath": Stage(
+        "openmath", "load", {},
+        {"output": load_openmath.DEFAULT_SAVE_DIR},
+        _load("load_openmath", load_openmath.load_and_merge_openmath, load_openmath.DEFAULT_SAVE_DIR,
+              load_openmath.LOAD_PARAMS, load_openmath.LOAD_RUN_KWARGS),
+    ),
+    "clean_openmath": Stage(
+        "openmath", "clean", {"dataset": ("load_openmath", "output")},
+        {"output": clean_openmath.CLEANED_SAVE_DIR},
+        _clean("clean_openmath", clean_openmath.clean_openmath, clean_openmath.CLEANED_SAVE_DIR),
+    ),
+    "split_openmath": Stage(
+        "openmath", "split", {"dataset": ("clean_openmath", "output")},
+        {"train": split_openmath.train_split_dir, "validation": split_openmath.validation_split_dir},
+        _split("split_openmath", split_openmath),
+    ),
+    "format_openmath": Stage(
+        "openmath", "format",
+        {"train": ("split_openmath", "train"), "validation": ("split_openmath", "validation")},
+        {"train": format_openmath_sft.formatted_train_dir, "validation": format_openmath_sft.formatted_validation_dir},
+        _format("format_openmath", format_openmath_sft),
+    ),
+    "load_deepwriting": Stage(
+        "deepwriting", "load", {},
+        {"output": load_deepwriting.DEFAULT_SAVE_DIR},
+        _load("load_deepwriting", load_deepwriting.load_deepwriting, load_deepwriting.DEFAULT_SAVE_DIR,
+              load_deepwriting.LOAD_PARAMS, load_deepwriting.LOAD_RUN_KWARGS),
+    ),
+    "clean_deepwriting": Stage(
+        "deepwriting", "clean", {"dataset": ("load_deepwriting", "output")},
+        {"output": clean_deepwriting.CLEANED_SAVE_DIR},
+        _clean("clean_deepwriting", clean_deepwriting.clean_deepwriting, clean_deepwriting.CLEANED_SAVE_DIR),
+    ),
+    "split_deepwriting": Stage(
+        "deepwriting", "split", {"dataset": ("clean_deepwriting", "output")},
+        {"train": split_deepwriting.train_split_dir, "validation": split_deepwriting.validation_split_dir},
+        _split("split_deepwriting", split_deepwriting),
+    ),
+    "format_deepwriting": Stage(
+        "deepwriting", "format",
+        {"train": ("split_deepwriting", "train"), "validation": ("split_deepwriting", "validation")},
+        {"train": format_deepwriting_sft.formatted_train_dir, "validation": format_deepwriting_sft.formatted_validation_dir},
+        _format("format_deepwriting", format_deepwriting_sft),
+    ),
+}
+
+
+def select_stages(branches=None, kinds=None, names=None):
+    """Stage names matching the given branches and kinds (or explicit names), in DAG order."""
+    return [
+        name for name, stage in STAGES.items()
+        if (not branches or stage.branch in branches)
+        and (not kinds or stage.kind in kinds)
+        and (not names or name in names)
+    ]
+
+
+def topological_order(selected):
+    """Orders the selected stages so every stage comes after the selected stages it depends on."""
+    ordered, done = [], set()
+    while len(ordered) < len(selected):
+        ready = [
+            name for name in selected if name not in done
+            and all(dep not in selected or dep in done for dep, _ in STAGES[name].deps.values())
+        ]
+        if not ready:
+            raise ValueError(f"Dependency cycle among stages: {selected}")
+        ordered.extend(ready)
+        done.update(ready)
+    return ordered
+
+
+def chains(selected):
+    """Splits the selected stages into independent groups (connected components of the DAG)."""
+    parent = {name: name for name in selected}
+
+    def find(name):
+        while parent[name] != name:
+            name = parent[name]
+        return name
+
+    for name in selected:
+        for dep, _ in STAGES[name].deps.values():
+            if dep in parent:
+                parent[find(name)] = find(dep)
+
+    groups = {}
+    for name in selected:
+        groups.setdefault(find(name), []).append(name)
+    return [topological_order(group) for group in groups.values()]
+
+
+def run_chain(stage_names, num_proc=None):
+    """Runs dependent stages in order in this process, passing datasets in memory."""
+    results, timings = {}, {}
+    for name in stage_names:
+        stage = STAGES[name]
+        inputs = {}
+        for input_name, (dep, output) in stage.deps.items():
+            if (dep, output) not in results:
+                # Produced outside this run: read the upstream stage's saved output
+                results[(dep, output)] = load_from_disk(STAGES[dep].outputs[output])
+            inputs[input_name] = results[(dep, output)]
+
+        start = time.perf_counter()
+        outputs = stage.run(inputs, num_proc)
+        timings[name] = time.perf_counter() - start
+        for output, dataset in outputs.items():
+            results[(name, output)] = dataset
+        print(f"[{stage.branch}] {name} finished in {timings[name]:.1f}s")
+    return timings
+
+
+def run_pipeline(branches=None, kinds=None, names=None, workers=None, num_proc=None):
+    """Runs the selected subgraph, with independent chains in parallel worker processes."""
+    selected = select_stages(branches, kinds, names)
+    if not selected:
+        raise ValueError("No stages selected.")
+    groups = chains(selected)
+    print(f"Running {len(selected)} stages in {len(groups)} independent chains: {groups}")
+
+    start = time.perf_counter()
+    timings = {}
+    if len(groups) == 1 or workers == 1:
+        for group in groups:
+            timings.update(run_chain(group, num_proc))
+    else:
+        with ProcessPoolExecutor(max_workers=workers or len(groups)) as pool:
+            for group_timings in pool.map(run_chain, groups, [num_proc] * len(groups)):
+                timings.update(group_timings)
+
+    print(f"\nPipeline finished in {time.perf_counter() - start:.1f}s")
+    for name, seconds in timings.items():
+        print(f"  {name}: {seconds:.1f}s")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the data preparation pipeline.")
+    parser.add_argument("--branches", nargs="+", choices=BRANCHES, help="Branches to run (default: all).")
+    parser.add_argument("--stages", nargs="+", choices=KINDS, help="Stage kinds to run (default: all).")
+    parser.add_argument("--only", nargs="+", choices=list(STAGES), help="Explicit stage names to run.")
+    parser.add_argument("--workers", type=int, default=None, help="Concurrent chains (default: one per chain).")
+    parser.add_argument("--num-proc", type=int, default=None,
+                        help="Processes per stage (default: CPUs split across the chains).")
+    parser.add_argument("--metrics", help="Append a JSON span per stage call to this file.")
+    parser.add_argument("--prometheus", help="Write per-stage totals as Prometheus text to this file.")
+    parser.add_argument("--profile", nargs="+", default=[],
+                        help="Span names to profile, e.g. clean_openmath.clean_openmath.")
+    parser.add_argument("--profiler", choices=["cprofile", "py-spy"], default="cprofile")
+    args = parser.parse_args()
+
+    if args.metrics or args.prometheus or args.profile:
+        configure(args.metrics, args.prometheus, args.profile, args.profiler)
+
+    num_proc = args.num_proc
+    if num_proc is None:
+        num_chains = len(chains(select_stages(args.branches, args.stages, args.only))) or 1
+        num_proc = max(1, (os.cpu_count() or 1) // num_chains)
+
+    run_pipeline(args.branches, args.stages, args.only, args.workers, num_proc)
@@ -0,0 +1,197 @@
+"""
+stage_cache.py
+
+Content-addressed cache for the load -> clean -> split -> format stages.
+
+A stage result is keyed by the stage name, the fingerprints of its input datasets, its
+parameters (train_ratio, seed, MAX_SEQ_LENGTH, ...) and a code version, which defaults
+to a hash of the source files of the package defining the stage function and of every
+first-party module that module references, directly or through other first-party modules
+(e.g. data_cleaning/arrow_text.py for the format stages). On a hit the
+outputs are memory-mapped from the cache instead of recomputed, so different variants
+live side by side and re-running after a formatter tweak only recomputes formatting.
+The cache is bounded in size and evicts least-recently-used entries.
+
+Each entry is <cache_dir>/<stage>/<key>/ with one save_to_disk directory per output and
+a meta.json. The fixed data/... directories the scripts read from are only rewritten
+when their content changes (tracked by a .stage_key file).
+
+Functions:
+- run_stage(stage, fn, inputs, params): cached fn(**inputs, **params, **run_kwargs).
+- evict(cache_dir, max_bytes): drops least-recently-used entries above max_bytes.
+"""
+
+import glob
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import time
+
+from datasets import load_from_disk
+
+STAGE_CACHE_DIR = "data/.stage_cache"
+MAX_CACHE_BYTES = 200 * 2**30
+STAGE_KEY_FILE = ".stage_key"
+
+
+def _is_first_party(path, root):
+    path = os.path.abspath(path)
+    return path.startswith(root + os.sep) and "site-packages" not in path.split(os.sep)
+
+
+def _module_files(module, root):
+    """Source files of module and of the first-party modules it references, transitively.
+
+    References are the module's globals: imported modules, and the modules defining imported
+    functions, classes and constants that record one (__module__).
+    """
+    files, seen, stack = set(), set(), [module]
+    while stack:
+        module = stack.pop()
+        if module is None or id(module) in seen:
+            continue
+        seen.add(id(module))
+        path = getattr(module, "__file__", None)
+        if not path or not path.endswith(".py") or not _is_first_party(path, root):
+            continue
+        files.add(os.path.abspath(path))
+        for value in vars(module).values():
+            if inspect.ismodule(value):
+                stack.append(value)
+            elif isinstance(getattr(value, "__module__", None), str):
+                stack.append(sys.modules.get(value.__module__))
+    return files
+
+
+def code_version(fn):
+    """Hash of the source files of fn's package and of the first-party modules fn's module depends on."""
+    # Unwrapped, so a decorated stage (e.g. @instrumented) hashes its own package, not the decorator's
+    fn = inspect.unwrap(fn)
+    package_dir = os.path.dirname(os.path.abspath(inspect.getsourcefile(fn)))
+    root = os.path.dirname(package_dir)
+    paths = set(glob.glob(os.path.join(package_dir, "*.py")))
+    paths |= _module_files(sys.modules.get(fn.__module__), root)
+    digest = hashlib.sha256()
+    for path in sorted(os.path.relpath(path, root) for path in paths):
+        digest.update(path.encode())
+        with open(os.path.join(root, path), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def stage_key(stage, inputs, params, version):
+    """Content address of a stage result."""
+    description = {
+        "stage": stage,
+        "inputs": {name: dataset._fingerprint for name, dataset in sorted(inputs.items())},
+        "params": params,
+        "version": version,
+    }
+    payload = json.dumps(description, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()[:24]
+
+
+def _dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path) for name in files
+    )
+
+
+def _read_meta(entry_dir):
+    with open(os.path.join(entry_dir, "meta.json")) as f:
+        return json.load(f)
+
+
+def _write_meta(entry_dir, meta):
+    tmp_path = os.path.join(entry_dir, "meta.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2, default=str)
+    os.replace(tmp_path, os.path.join(entry_dir, "meta.json"))
+
+
+def _entries(cache_dir):
+    return [
+        os.path.dirname(path)
+        for path in glob.glob(os.path.join(cache_dir, "*", "*", "meta.json"))
+    ]
+
+
+def evict(cache_dir=STAGE_CACHE_DIR, max_bytes=MAX_CACHE_BYTES, keep=()):
+    """Removes least-recently-used entries until the cache fits in max_bytes."""
+    entries = sorted(
+        ((_read_meta(entry), entry) for entry in _entries(cache_dir)),
+        key=lambda item: item[0]["last_used"],
+    )
+    total = sum(meta["size_bytes"] for meta, _ in entries)
+    for meta, entry in entries:
+        if total <= max_bytes:
+            break
+        if entry in keep:
+            continue
+        shutil.rmtree(entry)
+        total -= meta["size_bytes"]
+        print(f"Evicted cached {meta['stage']} result {meta['key']} ({meta['size_bytes']} bytes)")
+
+
+def _export(outputs, save_dirs, key):
+    """Writes outputs to the fixed data/... directories unless they already hold this result."""
+    for name, save_dir in (save_dirs or {}).items():
+        marker = os.path.join(save_dir, STAGE_KEY_FILE)
+        if os.path.exists(marker):
+            with open(marker) as f:
+                if f.read().strip() == f"{key}/{name}":
+                    continue
+        outputs[name].save_to_disk(save_dir)
+        with open(marker, "w") as f:
+            f.write(f"{key}/{name}")
+        print(f"Saved {name} to {save_dir}")
+
+
+def run_stage(stage, fn, inputs=None, params=None, run_kwargs=None, key_extras=None,
+              output_names=("output",), version=None, save_dirs=None,
+              cache_dir=STAGE_CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """Returns {output name: Dataset} for fn(**inputs, **params, **run_kwargs), from the cache when possible.
+
+    params are part of the key and passed to fn; run_kwargs (num_proc, tokenizer objects, ...)
+    are passed but not keyed; key_extras are keyed but not passed (e.g. the tokenizer name).
+    fn returns one dataset, or a tuple matching output_names.
+    """
+    inputs, params, run_kwargs = inputs or {}, params or {}, run_kwargs or {}
+    version = version or code_version(fn)
+    key = stage_key(stage, inputs, {**params, **(key_extras or {})}, version)
+    entry_dir = os.path.join(cache_dir, stage, key)
+
+    if os.path.exists(os.path.join(entry_dir, "meta.json")):
+        print(f"Stage {stage}: cache hit ({key})")
+        meta = _read_meta(entry_dir)
+        meta["last_used"] = time.time()
+        _write_meta(entry_dir, meta)
+    else:
+        print(f"Stage {stage}: cache miss ({key}), running {fn.__name__}")
+        result = fn(**inputs, **params, **run_kwargs)
+        results = result if isinstance(result, tuple) else (result,)
+
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        for name, dataset in zip(output_names, results):
+            dataset.save_to_disk(os.path.join(tmp_dir, name))
+        _write_meta(tmp_dir, {
+            "stage": stage,
+            "key": key,
+            "params": {**params, **(key_extras or {})},
+            "inputs": {name: dataset._fingerprint for name, dataset in inputs.items()},
+            "version": version,
+            "created": time.time(),
+            "last_used": time.time(),
+            "size_bytes": _dir_size(tmp_dir),
+        })
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        evict(cache_dir, max_bytes, keep=(entry_dir,))
+
+    outputs = {name: load_from_disk(os.path.join(entry_dir, name)) for name in output_names}
+    _export(outputs, save_dirs, key)
+    return outputs
@@ -0,0 +1,125 @@
+"""
+bucketing.py
+
+Length-bucketed batching for the GRPO prompt dataset.
+
+Instead of shuffling prompts uniformly and batching them with `.batch(...)`, prompts are
+shuffled under a seed, sorted by token length within windows of `window_batches` batches,
+cut into batches, and the batch order is shuffled again. Every batch then holds prompts of
+similar length, so rollouts pad to a much shorter length than MAX_PROMPT_LENGTH, while the
+windowing keeps the order random enough for training. Everything is deterministic under
+the seed.
+
+Functions:
+- prompt_lengths(dataset, encode): token length of every prompt in a grain.MapDataset
+  (read from cached prompt_ids when no encode is given).
+- plan_batches(lengths, batch_size, seed): index arrays of the length-bucketed batches.
+- padded_lengths(batches, lengths): per-batch padded prompt length.
+- collate(elements, pad_id, length): one batch dict, with prompt_ids left-padded.
+- length_bucketed_batches(dataset, lengths, batch_size, seed): batched grain.MapDataset
+  plus its per-batch padded lengths.
+- batched(dataset, batch_size, pad_id): plain .batch() for tokenized exports.
+
+Prompts differ in length, so "prompt_ids" cannot be stacked by grain's default .batch().
+collate() left-pads them with pad_id (keeping the last tokens when a prompt is longer than
+the batch length) and adds a boolean "prompt_mask" of the real tokens.
+"""
+
+import functools
+
+import grain
+import numpy as np
+
+WINDOW_BATCHES = 64
+PAD_MULTIPLE = 64
+PAD_ID = 0  # Gemma's <pad>
+PROMPT_IDS_FIELD = "prompt_ids"
+PROMPT_MASK_FIELD = "prompt_mask"
+
+
+def prompt_lengths(dataset, encode=None, key="prompts"):
+    """Returns the token length of dataset[i][key] for every element, using encode(str) -> ids.
+
+    Without encode, the lengths of the "prompt_ids" exported by grpo.prompt_encoder are used.
+    """
+    if encode is None:
+        return np.array([len(dataset[i][PROMPT_IDS_FIELD]) for i in range(len(dataset))], dtype=np.int32)
+    return np.array([len(encode(dataset[i][key])) for i in range(len(dataset))], dtype=np.int32)
+
+
+def plan_batches(lengths, batch_size, seed=42, window_batches=WINDOW_BATCHES, drop_remainder=False):
+    """Returns a list of index arrays, one per batch, grouping prompts of similar length."""
+    lengths = np.asarray(lengths)
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(lengths))
+    window = window_batches * batch_size
+
+    batches = []
+    for start in range(0, len(order), window):
+        chunk = order[start:start + window]
+        chunk = chunk[np.argsort(lengths[chunk], kind="stable")]
+        batches.extend(chunk[i:i + batch_size] for i in range(0, len(chunk), batch_size))
+    if drop_remainder:
+        batches = [batch for batch in batches if len(batch) == batch_size]
+
+    return [batches[i] for i in rng.permutation(len(batches))]
+
+
+def padded_lengths(batches, lengths, pad_multiple=PAD_MULTIPLE, max_length=None):
+    """Per-batch prompt length after padding the longest prompt up to a multiple of pad_multiple."""
+    lengths = np.asarray(lengths)
+    longest = np.array([lengths[batch].max() for batch in batches])
+    padded = -(-longest // pad_multiple) * pad_multiple
+    return padded if max_length is None else np.minimum(padded, max_length)
+
+
+def collate(elements, pad_id=PAD_ID, length=None, pad_multiple=PAD_MULTIPLE):
+    """Stacks a list of element dicts into one batch dict, like grain's .batch().
+
+    prompt_ids are left-padded to `length` (by default the longest prompt rounded up to
+    pad_multiple), with a "prompt_mask" of the real tokens.
+    """
+    batch = {key: np.stack([np.asarray(element[key]) for element in elements])
+             for key in elements[0] if key != PROMPT_IDS_FIELD}
+    if PROMPT_IDS_FIELD in elements[0]:
+        prompts = [element[PROMPT_IDS_FIELD] for element in elements]
+        if length is None:
+            length = -(-max(len(ids) for ids in prompts) // pad_multiple) * pad_multiple
+        prompt_ids = np.full((len(prompts), length), pad_id, dtype=np.int32)
+        prompt_mask = np.zeros((len(prompts), length), dtype=bool)
+        for row, ids in enumerate(prompts):
+            ids = ids[len(ids) - length:] if len(ids) > length else ids
+            prompt_ids[row, length - len(ids):] = ids
+            prompt_mask[row, length - len(ids):] = True
+        batch[PROMPT_IDS_FIELD] = prompt_ids
+        batch[PROMPT_MASK_FIELD] = prompt_mask
+    return batch
+
+
+def _gather(planned, dataset, pad_id):
+    indices, length = planned
+    return collate([dataset[int(i)] for i in indices], pad_id=pad_id, length=int(length))
+
+
+def length_bucketed_batches(dataset, lengths, batch_size, seed=42, window_batches=WINDOW_BATCHES,
+                            pad_multiple=PAD_MULTIPLE, max_length=None, drop_remainder=False, pad_id=PAD_ID):
+    """Returns a grain.MapDataset of length-bucketed batches and the padded length of each batch.
+
+    `dataset` is an (unbatched) grain.MapDataset and `lengths` its precomputed prompt token
+    lengths, e.g. from prompt_lengths(). Use the result in place of
+    get_dataset(...).batch(TRAIN_MICRO_BATCH_SIZE). prompt_ids are padded to the batch's
+    padded length.
+    """
+    batches = plan_batches(lengths, batch_size, seed=seed, window_batches=window_batches,
+                           drop_remainder=drop_remainder)
+    padded = padded_lengths(batches, lengths, pad_multiple=pad_multiple, max_length=max_length)
+    batched_dataset = grain.MapDataset.source(list(zip(batches, padded))).map(
+        functools.partial(_gather, dataset=dataset, pad_id=pad_id)
+    )
+    return batched_dataset, padded
+
+
+def batched(dataset, batch_size, pad_id=PAD_ID, pad_multiple=PAD_MULTIPLE, drop_remainder=False):
+    """dataset.batch(batch_size) for elements with prompt_ids, which grain's default batching cannot stack."""
+    return dataset.batch(batch_size, drop_remainder=drop_remainder,
+                         batch_fn=functools.partial(collate, pad_id=pad_id, pad_multiple=pad_multiple))
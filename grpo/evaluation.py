@@ -0,0 +1,191 @@
+"""
+evaluation.py
+
+Batched, resumable version of the notebook's evaluate().
+
+Every pass is seeded with its index, as in the notebook, and the remaining questions of a
+pass are batched into sampler calls of up to `batch_size` prompts. Passes are run in
+rounds of `passes_per_round`: a question that is already correct, partially correct and
+well formatted is dropped from later rounds, which cannot change its metrics, so the
+default of one pass per round skips the most sampling. Each response is parsed once
+(grpo.rewards).
+
+Every scored response is appended to a JSONL store keyed by (checkpoint step, generation
+config, question hash, pass), so an interrupted evaluation resumes where it stopped, and
+the metrics evaluate() returns are computed from the stored results. With a rollout_writer (grpo.rollout_store) the
+responses are also recorded for reward replay, with token counts from count_tokens.
+
+Any callable with the tunix Sampler signature returning an object with .text works as
+the sampler, e.g. grpo.reward_executor.FakeSampler.
+
+Functions:
+- score_response(response, answer): correct / partially correct / format flags of one response.
+- evaluate(dataset, sampler, step, ...): (corr, total, accuracy, partial accuracy, format accuracy).
+"""
+
+import hashlib
+import json
+import os
+
+from grpo.prompts import format_prompt
+from grpo.rewards import combined_reward, parse_completion
+from grpo.rollout_store import token_counts, warn_without_token_counts
+
+EVAL_STORE_PATH = "data/eval_results.jsonl"
+MAX_GENERATION_STEPS = 768
+EOS_TOKENS = [1, 106]
+PASSES_PER_ROUND = 1
+EVAL_BATCH_SIZE = 64
+MISSING_NUMBER = "-1000000"
+
+
+def question_key(question, answer):
+    return hashlib.sha256(f"{question}\x00{answer}".encode()).hexdigest()[:16]
+
+
+def config_key(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def score_response(response, answer):
+    """Returns {"correct", "partial", "format"} for one response, as evaluate() counts them."""
+    _, guess, number = parse_completion(response)
+    extracted = number if number is not None else MISSING_NUMBER
+    correct = partial = False
+    try:
+        correct = float(extracted.strip()) == float(answer.strip())
+        ratio = float(extracted.strip()) / float(answer.strip())
+        partial = 0.9 <= ratio <= 1.1
+    except (AttributeError, ValueError, ZeroDivisionError):
+        pass
+    return {"correct": correct, "partial": partial, "format": guess is not None}
+
+
+def is_solved(records):
+    """True once correct, partial and format are all satisfied; more passes cannot change the result."""
+    return all(any(record[flag] for record in records) for flag in ("correct", "partial", "format"))
+
+
+def load_results(path, step, config):
+    """Returns {question key: {pass: record}} stored for this step and generation config."""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["step"] == step and record["config"] == config:
+                results.setdefault(record["question"], {})[record["pass"]] = record
+    return results
+
+
+def _append_results(path, records):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def _as_text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def flatten(dataset):
+    """Questions and answers of a (batched) dataset of {"question", "answer"} elements."""
+    questions, answers = [], []
+    for batch in dataset:
+        batch_questions = batch["question"]
+        batch_answers = batch["answer"]
+        if isinstance(batch_questions, (str, bytes)):
+            batch_questions, batch_answers = [batch_questions], [batch_answers]
+        questions.extend(_as_text(question) for question in batch_questions)
+        answers.extend(_as_text(answer) for answer in batch_answers)
+    return questions, answers
+
+
+def summarise(keys, results, num_passes):
+    """The metrics of evaluate() from stored per-pass results."""
+    corr = partially_corr = corr_format = 0
+    for key in keys:
+        records = [record for p, record in results.get(key, {}).items() if p < num_passes]
+        corr += any(record["correct"] for record in records)
+        partially_corr += any(record["partial"] for record in records)
+        corr_format += any(record["format"] for record in records)
+    total = len(keys)
+    return (
+        corr,
+        total,
+        corr / total * 100,
+        partially_corr / total * 100,
+        corr_format / total * 100,
+    )
+
+
+def evaluate(dataset, sampler, step=0, temperature=0.7, top_k=50, top_p=0.95, num_passes=1,
+             corr_lst=False, make_lst=False, passes_per_round=PASSES_PER_ROUND,
+             batch_size=EVAL_BATCH_SIZE, store_path=EVAL_STORE_PATH,
+             max_generation_steps=MAX_GENERATION_STEPS, rollout_writer=None, count_tokens=None):
+    """Computes accuracy and percentage of outputs matching the format, resuming from store_path."""
+    if rollout_writer is not None:
+        warn_without_token_counts(rollout_writer, count_tokens)
+    generation_config = {
+        "temperature": temperature, "top_k": top_k, "top_p": top_p,
+        "max_generation_steps": max_generation_steps,
+    }
+    # Keeps results of earlier versions, which seeded passes by round, out of this store key
+    config = config_key({**generation_config, "seeds": "per_pass"})
+    questions, answers = flatten(dataset)
+    keys = [question_key(question, answer) for question, answer in zip(questions, answers)]
+    results = load_results(store_path, step, config)
+    if results:
+        print(f"Resuming: {sum(len(r) for r in results.values())} stored responses for step {step}")
+
+    for first_pass in range(0, num_passes, passes_per_round):
+        round_passes = range(first_pass, min(first_pass + passes_per_round, num_passes))
+        remaining = [i for i, key in enumerate(keys) if not is_solved(list(results.get(key, {}).values()))]
+        # Chunks do not cross passes, so every sampler call has the seed of its pass
+        pass_rows = [[(i, p) for i in remaining if p not in results.get(keys[i], {})] for p in round_passes]
+        chunks = [rows[start:start + batch_size] for rows in pass_rows for start in range(0, len(rows), batch_size)]
+        for chunk in chunks:
+            seed = chunk[0][1]
+            prompts = [format_prompt(questions[i]) for i, _ in chunk]
+            output = sampler(
+                input_strings=prompts,
+                max_generation_steps=max_generation_steps,
+                temperature=temperature,
+                top_k=top_k,
+                top_p=top_p,
+                echo=False,
+                seed=seed,
+                eos_tokens=EOS_TOKENS,
+            )
+            records = [
+                {"step": step, "config": config, "question": keys[i], "pass": p,
+                 "response": response, **score_response(response, answers[i])}
+                for (i, p), response in zip(chunk, output.text)
+            ]
+            _append_results(store_path, records)
+            if rollout_writer is not None:
+                chunk_answers = [answers[i] for i, _ in chunk]
+                chunk_questions = [questions[i] for i, _ in chunk]
+                rewards = combined_reward(prompts, output.text, chunk_answers, log_every=0, question=chunk_questions)
+                rollout_writer.append(step, "eval", prompts, output.text, rewards, answers=chunk_answers,
+                                      questions=chunk_questions, prompt_tokens=token_counts(count_tokens, prompts),
+                                      completion_tokens=token_counts(count_tokens, output.text),
+                                      config=generation_config)
+            for record in records:
+                results.setdefault(record["question"], {})[record["pass"]] = record
+
+        metrics = summarise(keys, results, num_passes)
+        print(f"===> passes {first_pass}-{round_passes[-1]}: corr={metrics[0]}, total={metrics[1]}, "
+              f"accuracy={metrics[2]:.2f}%, partial={metrics[3]:.2f}%, format={metrics[4]:.2f}%")
+
+    to_return = summarise(keys, results, num_passes)
+    if make_lst:
+        response_lst = []
+        for question, answer, key in zip(questions, answers, keys):
+            records = [record for p, record in sorted(results.get(key, {}).items()) if p < num_passes]
+            if any(record["correct"] for record in records) == corr_lst:
+                response_lst.append((question, answer, [record["response"] for record in records]))
+        return to_return, response_lst
+    return to_return
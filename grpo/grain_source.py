@@ -0,0 +1,91 @@
+"""
+grain_source.py
+
+Loads the Arrow shards written by data_formatting/export_grain.py as a grain.MapDataset,
+as a drop-in replacement for the notebook's get_dataset(). Elements already hold
+"prompts", "question" and "answer" (and "prompt_ids" when the export was tokenized), so
+there is no per-element formatting or tokenization. prompt_ids differ in length, so a
+tokenized export is batched with grpo.bucketing (batched() or length_bucketed_batches(),
+with pad_id=source.pad_id) rather than with grain's default .batch().
+
+Shards are memory-mapped lazily, per process, on first access, so the source pickles
+cheaply into grain worker processes.
+
+Functions:
+- ArrowShardSource(export_dir): random-access data source over the shards.
+- load_grpo_dataset(export_dir, seed): shuffled grain.MapDataset of the export.
+- prefetched(dataset, num_workers): IterDataset with threaded reads and multi-process prefetch.
+"""
+
+import json
+import os
+
+import grain
+import numpy as np
+import pyarrow as pa
+
+from grpo.bucketing import PAD_ID
+
+MANIFEST_FILE = "manifest.json"
+
+
+class ArrowShardSource:
+    """Random-access source (len / getitem) over memory-mapped Arrow IPC shards."""
+
+    def __init__(self, export_dir):
+        with open(os.path.join(export_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        self.export_dir = export_dir
+        self.fields = manifest["fields"]
+        # Ids shared by every prompt (None when the export has no prompt_ids)
+        self.prefix_length = manifest.get("prefix_length")
+        self.pad_id = manifest.get("pad_id")
+        if self.pad_id is None:
+            self.pad_id = PAD_ID
+        self.files = [os.path.join(export_dir, shard["file"]) for shard in manifest["shards"]]
+        self.offsets = np.cumsum([0] + [shard["num_rows"] for shard in manifest["shards"]])
+        self._batches = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _batch(self, shard):
+        if shard not in self._batches:
+            reader = pa.ipc.open_file(pa.memory_map(self.files[shard], "r"))
+            self._batches[shard] = reader.get_batch(0)
+        return self._batches[shard]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} rows")
+        shard = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        batch = self._batch(shard)
+        row = index - int(self.offsets[shard])
+        return {field: batch.column(field)[row].as_py() for field in self.fields}
+
+    def __getstate__(self):
+        # Memory maps are reopened in each worker process
+        state = self.__dict__.copy()
+        state["_batches"] = {}
+        return state
+
+    def __repr__(self):
+        return f"ArrowShardSource({self.export_dir!r}, rows={len(self)})"
+
+
+def load_grpo_dataset(export_dir, seed=42, shuffle=True):
+    """Returns a grain.MapDataset of {"prompts", "question", "answer"[, "prompt_ids"]}, shuffled like get_dataset()."""
+    dataset = grain.MapDataset.source(ArrowShardSource(export_dir))
+    return dataset.shuffle(seed=seed) if shuffle else dataset
+
+
+def prefetched(dataset, num_workers=0, num_threads=16, prefetch_buffer_size=500):
+    """Converts a (batched) MapDataset to an IterDataset with read threads and optional worker processes."""
+    iter_dataset = dataset.to_iter_dataset(
+        grain.ReadOptions(num_threads=num_threads, prefetch_buffer_size=prefetch_buffer_size)
+    )
+    if num_workers > 0:
+        iter_dataset = iter_dataset.mp_prefetch(grain.MultiprocessingOptions(num_workers=num_workers))
+    return iter_dataset
@@ -0,0 +1,119 @@
+"""
+prompt_encoder.py
+
+Shared-prefix tokenization of GRPO prompts.
+
+Every prompt is TEMPLATE filled with the same SYSTEM_PROMPT and a different question, so
+the text before the question (turn marker and system prompt) and after it (end of turn
+and model turn marker) is identical for all prompts. PromptEncoder tokenizes that prefix
+and suffix once and, per prompt, tokenizes only the question, concatenating the ids
+without re-encoding.
+
+The concatenation equals full-string tokenization as long as no token spans the
+question's boundaries. The suffix starts with the <end_of_turn> special token, which
+tokenizers always split out, so only the start of the question matters. The last
+PREFIX_HOLDBACK prefix tokens (typically the "\n\n" before the question and the token before it)
+are therefore tokenized together with each question, so a merge across that boundary
+is reproduced; questions starting with whitespace are tokenized in full; and
+add_prompt_ids() checks a random sample of rows, spread over the whole dataset, against
+full-string tokenization before mapping it.
+
+Functions:
+- PromptEncoder(tokenizer): prefix / suffix ids, prefix_length, encode(questions), verify(questions).
+- add_prompt_ids(dataset, tokenizer, question_field): dataset with a cached "prompt_ids" column.
+"""
+
+import numpy as np
+
+from grpo.prompts import SYSTEM_PROMPT, TEMPLATE
+
+PROMPT_IDS_FIELD = "prompt_ids"
+VERIFY_ROWS = 256
+VERIFY_SEED = 0
+PREFIX_HOLDBACK = 2
+_QUESTION_MARKER = "\x00question\x00"
+
+
+class PromptEncoder:
+    """Tokenizes TEMPLATE's fixed prefix and suffix once; encode() only tokenizes the questions."""
+
+    def __init__(self, tokenizer, template=TEMPLATE, system_prompt=SYSTEM_PROMPT, holdback=PREFIX_HOLDBACK):
+        self.tokenizer = tokenizer
+        self.template = template
+        self.system_prompt = system_prompt
+        prefix, suffix = template.format(system_prompt=system_prompt, question=_QUESTION_MARKER).split(
+            _QUESTION_MARKER
+        )
+        # Special tokens (<bos>) belong to the start of the prompt, i.e. the prefix
+        encoded = tokenizer(prefix, add_special_tokens=True, return_offsets_mapping=True)
+        holdback = min(holdback, len(encoded["input_ids"]))
+        cut = len(encoded["input_ids"]) - holdback
+        tail_start = encoded["offset_mapping"][cut][0] if holdback else len(prefix)
+        self.prefix_ids = encoded["input_ids"][:cut]
+        self.tail = prefix[tail_start:]
+        self.suffix_ids = tokenizer(suffix, add_special_tokens=False)["input_ids"]
+
+    @property
+    def prefix_length(self):
+        """Number of leading ids shared by every prompt, reusable by samplers with prefix caching."""
+        return len(self.prefix_ids)
+
+    def format(self, question):
+        return self.template.format(system_prompt=self.system_prompt, question=question)
+
+    def full_encode(self, questions):
+        """Reference: tokenizes every complete prompt string."""
+        prompts = [self.format(question) for question in questions]
+        return self.tokenizer(prompts, add_special_tokens=True)["input_ids"]
+
+    def encode(self, questions):
+        """Returns prompt ids for a list of questions, tokenizing only the questions."""
+        questions = [str(question) for question in questions]
+        question_ids = self.tokenizer([self.tail + question for question in questions],
+                                      add_special_tokens=False)["input_ids"]
+        encoded = [self.prefix_ids + ids + self.suffix_ids for ids in question_ids]
+
+        unsafe = [i for i, question in enumerate(questions) if not question or question[0].isspace()]
+        if unsafe:
+            for i, ids in zip(unsafe, self.full_encode([questions[i] for i in unsafe])):
+                encoded[i] = ids
+        return encoded
+
+    def verify(self, questions):
+        """Returns the indices of questions whose encode() ids differ from full-string tokenization."""
+        return [
+            i for i, (ids, expected) in enumerate(zip(self.encode(questions), self.full_encode(questions)))
+            if ids != expected
+        ]
+
+
+def _prompt_ids(batch, encoder, question_field):
+    return {PROMPT_IDS_FIELD: encoder.encode(batch[question_field])}
+
+
+def add_prompt_ids(dataset, tokenizer, question_field="question", num_proc=None, verify_rows=VERIFY_ROWS,
+                   seed=VERIFY_SEED):
+    """Returns (dataset with a "prompt_ids" column, shared prefix length).
+
+    verify_rows questions drawn at random from the whole dataset are checked against
+    full-string tokenization first; a mismatch raises ValueError rather than caching wrong ids.
+    """
+    encoder = PromptEncoder(tokenizer)
+    rng = np.random.default_rng(seed)
+    indices = np.sort(rng.choice(len(dataset), min(verify_rows, len(dataset)), replace=False))
+    sample = dataset.select(indices)[question_field]
+    mismatches = encoder.verify(sample)
+    if mismatches:
+        raise ValueError(
+            f"Shared-prefix tokenization differs from full tokenization for {len(mismatches)} of "
+            f"{len(sample)} sampled questions, e.g. {sample[mismatches[0]]!r}"
+        )
+
+    dataset = dataset.map(
+        _prompt_ids,
+        batched=True,
+        num_proc=num_proc,
+        fn_kwargs={"encoder": encoder, "question_field": question_field},
+        desc="Encoding prompts",
+    )
+    return dataset, encoder.prefix_length
@@ -0,0 +1,39 @@
+"""
+prompts.py
+
+Prompt template and answer helpers of the GRPO notebook, shared with the data scripts so
+prompts can be built once at export time instead of per element during training.
+
+Functions:
+- format_prompt(question): TEMPLATE filled with SYSTEM_PROMPT and the question.
+- extract_hash_answer(text): the answer after "####" in a GSM8K-style solution.
+"""
+
+reasoning_start = "<reasoning>"
+reasoning_end = "</reasoning>"
+solution_start = "<answer>"
+solution_end = "</answer>"
+
+
+SYSTEM_PROMPT = f"""You are given a problem. Think about the problem and \
+provide your reasoning. Place it between {reasoning_start} and \
+{reasoning_end}. Then, provide the final answer (i.e., just one numerical \
+value) between {solution_start} and {solution_end}."""
+
+TEMPLATE = """<start_of_turn>user
+{system_prompt}
+
+{question}<end_of_turn>
+<start_of_turn>model"""
+
+
+def format_prompt(question):
+    """Returns the model prompt for a question."""
+    return TEMPLATE.format(system_prompt=SYSTEM_PROMPT, question=question)
+
+
+def extract_hash_answer(text):
+    """Returns the answer after "####", or None if there is none."""
+    if "####" not in text:
+        return None
+    return text.split("####")[1].strip()
@@ -0,0 +1,332 @@
+"""
+reward_executor.py
+
+Asynchronous reward scoring for GRPO rollouts.
+
+RewardExecutor scores completions in a worker pool and returns a Future per submitted
+batch, so host-side scoring overlaps with the next generation call instead of running
+between generation and the policy update. Every completion is scored as its own task,
+and at most num_workers tasks are handed to the pool at a time, so a task starts when it
+is dispatched. A completion that is not scored within `timeout` seconds of starting
+(e.g. a pathological regex backtrack, or a crashed worker) gets `default_score`, and
+with the process pool the stuck workers are killed, the pool restarted and the other
+running tasks requeued. A thread cannot be killed, so with the thread pool a timed-out
+task keeps its worker until it returns, and no other task is dispatched to it; once
+every thread is stuck, they are abandoned to a new pool.
+
+ScoringSampler wraps a sampler so each group's completions are submitted as soon as it
+finishes decoding. The executor's reward_fn() is passed to GRPOLearner(reward_fns=[...])
+and awaits the pre-submitted futures just before the advantages are computed (or scores
+on the spot if nothing was pre-submitted). Pre-submitted futures are matched by their
+prompts and completions; equal ones score the same, so which of them is taken does not
+matter. At most MAX_SUBMITTED unclaimed futures are kept, the oldest are dropped.
+
+FakeSampler emits canned completions, so all of this runs on CPU; see __main__.
+
+Classes:
+- RewardExecutor(reward_fn, num_workers, timeout, default_score): submit() -> Future, reward_fn().
+- ScoringSampler(sampler, executor, examples): sampler wrapper that pre-submits scoring.
+- FakeSampler(completions, delay): canned completions with a simulated decode time.
+"""
+
+import collections
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import numpy as np
+
+from grpo.rewards import combined_reward
+
+NUM_WORKERS = 4
+TIMEOUT_SECONDS = 10.0
+DEFAULT_SCORE = 0.0
+MAX_SUBMITTED = 256
+WATCHDOG_INTERVAL = 0.05
+
+
+def _score(reward_fn, prompts, completions, kwargs):
+    """Worker entry point: scores one chunk of completions."""
+    return list(reward_fn(prompts, completions, **kwargs))
+
+
+def _is_sequence(value):
+    """True for per-completion reward kwargs: lists, tuples, arrays, ...; not strings, mappings or scalars."""
+    if isinstance(value, (str, bytes, dict)):
+        return False
+    if isinstance(value, np.ndarray):
+        return value.ndim > 0
+    return hasattr(value, "__len__") and hasattr(value, "__getitem__")
+
+
+def _slice_kwargs(kwargs, index):
+    """Per-completion slice of the sequence-valued reward kwargs (answer, question, ...)."""
+    return {
+        key: value[index:index + 1] if _is_sequence(value) else value
+        for key, value in kwargs.items()
+    }
+
+
+class _Batch:
+    """Collects per-completion scores and resolves one Future when all are in."""
+
+    def __init__(self, size):
+        self.scores = [None] * size
+        self.remaining = size
+        self.future = Future()
+        self.lock = threading.Lock()
+        if size == 0:
+            self.future.set_result([])
+
+    def fill(self, index, score):
+        with self.lock:
+            if self.scores[index] is not None:
+                return
+            self.scores[index] = score
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self.future.set_result(list(self.scores))
+
+
+class RewardExecutor:
+    """Scores completions with reward_fn in a process (or thread) pool, returning Futures.
+
+    A thread pool cannot kill a stuck worker: its task still gets the default score, but
+    the thread counts as busy until it returns, or until every thread is stuck and the
+    pool is replaced.
+    """
+
+    def __init__(self, reward_fn=combined_reward, num_workers=NUM_WORKERS, timeout=TIMEOUT_SECONDS,
+                 default_score=DEFAULT_SCORE, processes=True, max_submitted=MAX_SUBMITTED):
+        self.scoring_fn = reward_fn
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.default_score = default_score
+        self.processes = processes
+        self.max_submitted = max_submitted
+        self.timeouts = 0
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._pending = {}  # task id -> (args, batch, index), until scored
+        self._queue = collections.deque()  # task ids waiting for a worker
+        self._running = {}  # task id -> deadline of the dispatched tasks
+        self._stuck = set()  # timed-out task ids whose threads are still busy (thread pool only)
+        self._submitted = collections.OrderedDict()  # (prompts, completions) -> Futures, oldest first
+        self._num_submitted = 0
+        self._generation = 0  # bumped when the pool is replaced; stale callbacks are ignored
+        self._pool = self._new_pool()
+        self._closed = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+
+    def _new_pool(self):
+        if self.processes:
+            return multiprocessing.get_context("spawn").Pool(self.num_workers)
+        return multiprocessing.pool.ThreadPool(self.num_workers)
+
+    def _dispatch_ready(self):
+        """Hands queued tasks to free workers, starting their timeouts; called with the lock held."""
+        while self._queue and len(self._running) + len(self._stuck) < self.num_workers:
+            task_id = self._queue.popleft()
+            if task_id not in self._pending:
+                continue
+            self._running[task_id] = time.monotonic() + self.timeout
+            self._pool.apply_async(
+                _score, self._pending[task_id][0],
+                callback=functools.partial(self._resolve, self._generation, task_id),
+                error_callback=functools.partial(self._fail, self._generation, task_id),
+            )
+
+    def _resolve(self, generation, task_id, scores):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._stuck.discard(task_id)
+            entry = self._pending.pop(task_id, None)
+            self._running.pop(task_id, None)
+            self._dispatch_ready()
+        if entry is not None:
+            entry[1].fill(entry[2], float(scores[0]))
+
+    def _fail(self, generation, task_id, error):
+        print(f"Reward scoring failed, using default score: {error!r}")
+        self._resolve(generation, task_id, [self.default_score])
+
+    def _expire(self):
+        """Gives running tasks past their deadline the default score and restarts a stuck process pool."""
+        now = time.monotonic()
+        old_pool = None
+        with self._lock:
+            expired_ids = [task_id for task_id, deadline in self._running.items() if deadline <= now]
+            expired = [self._pending.pop(task_id) for task_id in expired_ids]
+            for task_id in expired_ids:
+                del self._running[task_id]
+            if not self.processes:
+                self._stuck.update(expired_ids)
+            if (expired and self.processes) or len(self._stuck) >= self.num_workers:
+                # The stuck workers cannot be interrupted: replace the pool and requeue the other running tasks
+                old_pool, self._pool = self._pool, self._new_pool()
+                self._generation += 1
+                self._queue.extendleft(reversed(list(self._running)))
+                self._running.clear()
+                self._stuck.clear()
+            self._dispatch_ready()
+        # Outside the lock: terminate() joins the result handler, which may be waiting for it in _resolve
+        if old_pool is not None:
+            self._shutdown(old_pool)
+        for _, batch, index in expired:
+            batch.fill(index, self.default_score)
+        if expired:
+            self.timeouts += len(expired)
+            print(f"{len(expired)} completions timed out after {self.timeout}s, scored {self.default_score}")
+
+    def _watch(self):
+        while not self._closed.wait(WATCHDOG_INTERVAL):
+            self._expire()
+
+    def _start(self, prompts, completions, kwargs):
+        batch = _Batch(len(completions))
+        with self._lock:
+            for index in range(len(completions)):
+                task_id = next(self._task_ids)
+                args = (self.scoring_fn, prompts[index:index + 1], completions[index:index + 1],
+                        _slice_kwargs(kwargs, index))
+                self._pending[task_id] = (args, batch, index)
+                self._queue.append(task_id)
+            self._dispatch_ready()
+        return batch.future
+
+    def submit(self, prompts, completions, **kwargs):
+        """Starts scoring a batch; returns a Future of the list of scores, in completion order.
+
+        The Future is also kept for reward_fn() to claim with the same prompts and completions.
+        """
+        future = self._start(prompts, completions, kwargs)
+        with self._lock:
+            self._submitted.setdefault((tuple(prompts), tuple(completions)), []).append(future)
+            self._num_submitted += 1
+            while self._num_submitted > self.max_submitted:
+                key, futures = next(iter(self._submitted.items()))
+                futures.pop(0)
+                if not futures:
+                    del self._submitted[key]
+                self._num_submitted -= 1
+        return future
+
+    def _take_submitted(self, prompts, completions):
+        key = (tuple(prompts), tuple(completions))
+        with self._lock:
+            futures = self._submitted.get(key)
+            if not futures:
+                return None
+            future = futures.pop(0)
+            if not futures:
+                del self._submitted[key]
+            self._num_submitted -= 1
+            return future
+
+    def reward_fn(self):
+        """Reward function for GRPOLearner: awaits pre-submitted scores, or scores the batch and waits."""
+        def reward(prompts, completions, **kwargs):
+            future = self._take_submitted(prompts, completions)
+            if future is None:
+                future = self._start(prompts, completions, kwargs)
+            return future.result()
+
+        return functools.wraps(self.scoring_fn)(reward)
+
+    def _shutdown(self, pool):
+        if self.processes:
+            pool.terminate()
+        else:
+            # terminate() would join the stuck threads; they exit when their task returns
+            pool.close()
+
+    def close(self):
+        self._closed.set()
+        self._watchdog.join()
+        self._shutdown(self._pool)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ScoringSampler:
+    """Wraps a sampler so the completions of every call are submitted for scoring right away.
+
+    `examples` maps each prompt string to its reward kwargs (e.g. {"answer": ..., "question": ...}),
+    e.g. built from the exported prompts/question/answer dataset.
+    """
+
+    def __init__(self, sampler, executor, examples):
+        self.sampler = sampler
+        self.executor = executor
+        self.examples = examples
+
+    def __call__(self, input_strings, **kwargs):
+        output = self.sampler(input_strings=input_strings, **kwargs)
+        if all(prompt in self.examples for prompt in input_strings):
+            fields = self.examples[input_strings[0]].keys()
+            reward_kwargs = {
+                field: [self.examples[prompt][field] for prompt in input_strings] for field in fields
+            }
+            self.executor.submit(list(input_strings), list(output.text), **reward_kwargs)
+        return output
+
+    def __getattr__(self, name):
+        return getattr(self.sampler, name)
+
+
+class FakeSampler:
+    """Sampler stand-in returning canned completions in turn, after `delay` seconds per call."""
+
+    def __init__(self, completions, delay=0.0):
+        self.completions = itertools.cycle(completions)
+        self.delay = delay
+
+    def __call__(self, input_strings, **kwargs):
+        time.sleep(self.delay)
+        return SimpleNamespace(text=[next(self.completions) for _ in input_strings])
+
+
+def _slow_reward(prompts, completions, **kwargs):
+    """combined_reward that hangs on completions containing "HANG", to exercise the timeout."""
+    if any("HANG" in completion for completion in completions):
+        time.sleep(3600)
+    return combined_reward(prompts, completions, log_every=0, **kwargs)
+
+
+if __name__ == "__main__":
+    from grpo.prompts import format_prompt
+
+    canned = [
+        "<reasoning>2 + 2 is 4</reasoning><answer>4</answer>",
+        "<reasoning>Guessing</reasoning><answer>5</answer>",
+        "The answer is 4",
+        "HANG <reasoning>stuck</reasoning><answer>4</answer>",
+    ]
+    questions = [f"What is 2 + 2? ({i})" for i in range(8)]
+    examples = {format_prompt(q): {"answer": "4", "question": q} for q in questions}
+    prompts = list(examples)
+
+    with RewardExecutor(_slow_reward, num_workers=4, timeout=2.0) as executor:
+        sampler = ScoringSampler(FakeSampler(canned, delay=0.5), executor, examples)
+        reward = executor.reward_fn()
+
+        start = time.perf_counter()
+        groups = [prompts[i:i + 4] for i in range(0, len(prompts), 4)]
+        outputs = [sampler(input_strings=group) for group in groups]  # scoring overlaps decoding
+        for group, output in zip(groups, outputs):
+            scores = reward(group, output.text, answer=["4"] * len(group), question=["?"] * len(group))
+            print(scores)
+        print(f"{len(prompts)} completions in {time.perf_counter() - start:.2f}s, "
+              f"{executor.timeouts} timed out")
@@ -0,0 +1,155 @@
+"""
+rewards.py
+
+GRPO reward functions of the notebook, computed from a single parse per completion.
+
+Each completion is parsed once: one scan for the four tags (counts and the first
+<answer> position), the format regex (skipped when a tag is missing, since it cannot
+match), and the first number after <answer>. Answers and guesses are converted to floats
+once. All scores, the format gating and the ratio checks are then NumPy array operations
+over the batch. The scores are identical to the notebook's match_format_exactly,
+match_format_approximately, check_answer, check_numbers and combined_reward.
+
+Debug output (question / answer / response / extracted number) is printed every
+`log_every` calls instead of on every call.
+
+Functions:
+- parse_completions(completions): tag counts, format answer span and number of each completion.
+- reward_components(completions, answer): the four component scores as arrays.
+- combined_reward(prompts, completions, answer, **kwargs): drop-in replacement for the notebook's.
+"""
+
+import itertools
+import re
+
+import numpy as np
+
+from grpo.prompts import reasoning_end, reasoning_start, solution_end, solution_start
+
+LOG_EVERY = 100
+
+TAGS = [reasoning_start, reasoning_end, solution_start, solution_end]
+TAG_PATTERN = re.compile("|".join(re.escape(tag) for tag in TAGS))
+_TAG_INDEX = {tag: k for k, tag in enumerate(TAGS)}
+
+match_format = re.compile(
+    rf"^[\s]{{0,}}"
+    rf"{reasoning_start}.+?{reasoning_end}.*?"
+    rf"{solution_start}(.+?){solution_end}"
+    rf"[\s]{{0,}}$",
+    flags=re.MULTILINE | re.DOTALL,
+)
+NUMBER_PATTERN = re.compile(r"[\d\.]{1,}")
+
+_calls = itertools.count()
+
+
+def parse_completion(completion):
+    """Returns (tag counts, answer span of the format match or None, first number after <answer> or None)."""
+    counts = [0, 0, 0, 0]
+    answer_end = -1
+    for match in TAG_PATTERN.finditer(completion):
+        k = _TAG_INDEX[match.group()]
+        counts[k] += 1
+        if k == 2 and answer_end < 0:
+            answer_end = match.end()
+
+    guess = None
+    if all(counts):
+        match = match_format.search(completion)
+        guess = match.group(1) if match is not None else None
+
+    # Same as searching "<answer>.*?([\d\.]{1,})": the first number after the first <answer>
+    number = None
+    if answer_end >= 0:
+        match = NUMBER_PATTERN.search(completion, answer_end)
+        number = match.group() if match is not None else None
+    return counts, guess, number
+
+
+def parse_completions(completions):
+    """Parses a batch: returns (tag counts array [n, 4], guesses list, numbers list)."""
+    parsed = [parse_completion(completion) for completion in completions]
+    counts = np.array([p[0] for p in parsed], dtype=np.int64).reshape(len(parsed), len(TAGS))
+    return counts, [p[1] for p in parsed], [p[2] for p in parsed]
+
+
+def _to_float(text):
+    """float(text) or NaN, plus whether the conversion succeeded."""
+    try:
+        return float(text), True
+    except (TypeError, ValueError):
+        return np.nan, False
+
+
+def _floats(texts):
+    cache = {}
+    values = [cache.setdefault(text, _to_float(text)) for text in texts]
+    return (np.array([v for v, _ in values], dtype=np.float64),
+            np.array([ok for _, ok in values], dtype=bool))
+
+
+def reward_components(completions, answer, parsed=None):
+    """Returns {"format_exact", "format_approx", "answer", "numbers"} score arrays for the batch."""
+    assert len(completions) == len(answer), f"{len(completions)} completions and {len(answer)} answers"
+    counts, guesses, numbers = parsed if parsed is not None else parse_completions(completions)
+
+    has_guess = np.array([guess is not None for guess in guesses], dtype=bool)
+    exact = np.array([guess is not None and guess == true for guess, true in zip(guesses, answer)], dtype=bool)
+    stripped = np.array([
+        guess is not None and true is not None and guess.strip() == true.strip()
+        for guess, true in zip(guesses, answer)
+    ], dtype=bool)
+
+    answer_values, answer_ok = _floats(answer)
+    guess_values, guess_ok = _floats(guesses)
+    number_values, number_ok = _floats(numbers)
+
+    # float(guess) / float(answer) raises for a zero answer, which scores as a parse failure
+    divisible = guess_ok & answer_ok & (answer_values != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(divisible, guess_values / np.where(divisible, answer_values, 1.0), np.nan)
+
+    answer_scores = np.select(
+        [~has_guess, exact, stripped, ~divisible,
+         (ratio >= 0.9) & (ratio <= 1.1), (ratio >= 0.8) & (ratio <= 1.2)],
+        [0.0, 4.0, 1.5, -0.5, 0.5, 0.25],
+        default=-1.0,
+    )
+    number_scores = np.where(number_ok & answer_ok & (number_values == answer_values), 1.5, 0.0)
+
+    return {
+        "format_exact": np.where(has_guess, 3.0, 0.0),
+        "format_approx": np.where(counts == 1, 0.5, -0.5).sum(axis=1),
+        "answer": answer_scores,
+        "numbers": number_scores,
+    }
+
+
+def gated_reward(components):
+    """format score + correctness, with correctness scaled by 0.2 / 0.5 when the format is poor."""
+    format_score = components["format_exact"] + components["format_approx"]
+    correctness = components["answer"] + components["numbers"]
+    scale = np.select([format_score <= 0, format_score < 2], [0.2, 0.5], default=1.0)
+    return format_score + correctness * scale
+
+
+def log_sample(question, answer, response, extracted):
+    """Prints one question / answer / response / extracted number for debugging."""
+    print("START ============================")
+    print(f"Question: {question}")
+    print(f"Answer: {answer}")
+    print(f"Response: {response}")
+    print(f"Extracted: {extracted}")
+    print("END ==============================")
+
+
+def combined_reward(prompts, completions, answer, log_every=LOG_EVERY, **kwargs):
+    """Drop-in replacement for the notebook's combined_reward; returns a list of floats."""
+    parsed = parse_completions(completions)
+    rewards = gated_reward(reward_components(completions, answer, parsed=parsed))
+
+    if log_every and next(_calls) % log_every == 0 and len(completions):
+        question = kwargs.get("question")
+        log_sample(question[0] if question is not None else None, answer[0], completions[0], parsed[2][0])
+    return rewards.tolist()
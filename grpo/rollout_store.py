@@ -0,0 +1,280 @@
+"""
+rollout_store.py
+
+Rollout store and offline reward replay.
+
+RolloutWriter appends rollouts (step, source, group, prompt, completion, answer,
+question, token counts, sampling config, reward) from training and evaluation to
+zstd-compressed Arrow IPC shards listed in a manifest.json. Completions of the same
+prompt within one append call share a group id, i.e. a GRPO group.
+
+replay() re-scores every stored completion with another reward function, one shard per
+worker process, reading the shards memory-mapped in batches. Reward distributions and
+per-group advantage statistics are then computed with NumPy, so a change to
+combined_reward can be judged without a new GRPO run or fresh generation. Reward
+functions taking log_every are replayed with log_every=0.
+
+Usage:
+    python -m grpo.rollout_store --reward grpo.rewards:combined_reward
+
+Functions:
+- RolloutWriter(directory): append() rollouts, flush() shards.
+- recording_reward(reward_fn, writer, step, count_tokens): reward function that also records its rollouts.
+- read_rollouts(directory, columns): the stored columns as one Arrow table.
+- replay(directory, reward_fn, num_proc): new reward of every stored completion.
+- reward_summary(rewards) / advantage_summary(rewards, groups): distribution statistics.
+"""
+
+import argparse
+import functools
+import importlib
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+
+from grpo.rewards import combined_reward
+
+ROLLOUT_DIR = "data/rollouts"
+ROLLOUT_SHARD_ROWS = 100_000
+REPLAY_BATCH_SIZE = 10_000
+MANIFEST_FILE = "manifest.json"
+ADVANTAGE_EPS = 1e-6
+
+ROLLOUT_SCHEMA = pa.schema([
+    ("step", pa.int64()),
+    ("source", pa.string()),
+    ("group", pa.int64()),
+    ("prompt", pa.string()),
+    ("completion", pa.string()),
+    ("answer", pa.string()),
+    ("question", pa.string()),
+    ("prompt_tokens", pa.int32()),
+    ("completion_tokens", pa.int32()),
+    ("config", pa.string()),
+    ("reward", pa.float64()),
+])
+
+
+def _read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"shards": [], "next_group": 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(directory, manifest):
+    tmp_path = os.path.join(directory, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+
+
+class RolloutWriter:
+    """Buffers rollouts and writes them as compressed Arrow shards of shard_rows rows."""
+
+    def __init__(self, directory=ROLLOUT_DIR, shard_rows=ROLLOUT_SHARD_ROWS, count_tokens=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_rows = shard_rows
+        self.count_tokens = count_tokens
+        self.manifest = _read_manifest(directory)
+        self.buffer = {field: [] for field in ROLLOUT_SCHEMA.names}
+
+    def _token_counts(self, texts, counts):
+        if counts is not None:
+            return list(counts)
+        if self.count_tokens is not None:
+            return [self.count_tokens(text) for text in texts]
+        return [-1] * len(texts)
+
+    def append(self, step, source, prompts, completions, rewards, answers=None, questions=None,
+               prompt_tokens=None, completion_tokens=None, config=None):
+        """Adds one batch of rollouts; completions of the same prompt form one group."""
+        groups = {}
+        for prompt in prompts:
+            groups.setdefault(prompt, self.manifest["next_group"] + len(groups))
+        self.manifest["next_group"] += len(groups)
+
+        size = len(completions)
+        rows = {
+            "step": [step] * size,
+            "source": [source] * size,
+            "group": [groups[prompt] for prompt in prompts],
+            "prompt": list(prompts),
+            "completion": list(completions),
+            "answer": list(answers) if answers is not None else [None] * size,
+            "question": list(questions) if questions is not None else [None] * size,
+            "prompt_tokens": self._token_counts(prompts, prompt_tokens),
+            "completion_tokens": self._token_counts(completions, completion_tokens),
+            "config": [json.dumps(config, sort_keys=True) if config is not None else None] * size,
+            "reward": [float(reward) for reward in rewards],
+        }
+        for field, values in rows.items():
+            self.buffer[field].extend(values)
+        if len(self.buffer["reward"]) >= self.shard_rows:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered rollouts as one shard."""
+        if not self.buffer["reward"]:
+            return
+        table = pa.Table.from_pydict(self.buffer, schema=ROLLOUT_SCHEMA)
+        file_name = f"rollouts-{len(self.manifest['shards']):05d}.arrow"
+        path = os.path.join(self.directory, file_name)
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, ROLLOUT_SCHEMA, options=options) as writer:
+            writer.write_table(table, max_chunksize=REPLAY_BATCH_SIZE)
+        os.replace(path + ".tmp", path)
+        self.manifest["shards"].append({"file": file_name, "num_rows": table.num_rows})
+        _write_manifest(self.directory, self.manifest)
+        self.buffer = {field: [] for field in ROLLOUT_SCHEMA.names}
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def token_counts(count_tokens, texts):
+    """[count_tokens(text) for text in texts], or None without a counter."""
+    return [count_tokens(text) for text in texts] if count_tokens is not None else None
+
+
+def warn_without_token_counts(writer, count_tokens):
+    if count_tokens is None and writer.count_tokens is None:
+        print("Rollouts are stored without token counts; pass count_tokens, "
+              "e.g. lambda text: len(tokenizer.encode(text))")
+
+
+def recording_reward(reward_fn, writer, step=None, source="train", config=None, count_tokens=None):
+    """Wraps a GRPO reward function so every scored batch is also appended to the store.
+
+    step is called for the training step of each batch, e.g. lambda: rl_cluster.global_steps;
+    the reward function is called once per micro-batch, so its calls are not steps. Without
+    it the step is stored as -1. count_tokens(text) gives the prompt and completion token
+    counts (by default the writer's count_tokens; -1 without either).
+    """
+    warn_without_token_counts(writer, count_tokens)
+
+    @functools.wraps(reward_fn)
+    def reward(prompts, completions, **kwargs):
+        rewards = reward_fn(prompts, completions, **kwargs)
+        writer.append(step() if step is not None else -1, source, prompts, completions, rewards,
+                      answers=kwargs.get("answer"), questions=kwargs.get("question"),
+                      prompt_tokens=token_counts(count_tokens, prompts),
+                      completion_tokens=token_counts(count_tokens, completions), config=config)
+        return rewards
+
+    return reward
+
+
+def shard_paths(directory=ROLLOUT_DIR):
+    return [os.path.join(directory, shard["file"]) for shard in _read_manifest(directory)["shards"]]
+
+
+def read_rollouts(directory=ROLLOUT_DIR, columns=None):
+    """All stored rollouts as one Arrow table, optionally only some columns."""
+    tables = []
+    for path in shard_paths(directory):
+        # Not closed here: uncompressed buffers of the table point into the map
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        tables.append(table.select(columns) if columns else table)
+    return pa.concat_tables(tables) if tables else ROLLOUT_SCHEMA.empty_table()
+
+
+def _replay_shard(path, reward_fn):
+    """Worker entry point: new rewards for one shard, in row order."""
+    rewards = []
+    with pa.memory_map(path, "r") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i).select(["prompt", "completion", "answer", "question"])
+            columns = batch.to_pydict()
+            rewards.append(np.asarray(
+                reward_fn(columns["prompt"], columns["completion"],
+                          answer=columns["answer"], question=columns["question"]),
+                dtype=np.float64,
+            ))
+    return np.concatenate(rewards) if rewards else np.empty(0)
+
+
+def replay(directory=ROLLOUT_DIR, reward_fn=combined_reward, num_proc=None):
+    """Re-scores every stored completion with reward_fn, one shard per worker process."""
+    paths = shard_paths(directory)
+    if not paths:
+        return np.empty(0)
+    if "log_every" in inspect.signature(reward_fn).parameters:
+        reward_fn = functools.partial(reward_fn, log_every=0)
+    if num_proc == 1 or len(paths) == 1:
+        return np.concatenate([_replay_shard(path, reward_fn) for path in paths])
+    with ProcessPoolExecutor(max_workers=num_proc) as pool:
+        return np.concatenate(list(pool.map(_replay_shard, paths, [reward_fn] * len(paths))))
+
+
+def reward_summary(rewards, percentiles=(5, 25, 50, 75, 95)):
+    """Mean, std, percentiles and value counts of a reward array."""
+    values, counts = np.unique(rewards, return_counts=True)
+    return {
+        "count": int(len(rewards)),
+        "mean": float(np.mean(rewards)),
+        "std": float(np.std(rewards)),
+        "percentiles": dict(zip(percentiles, np.percentile(rewards, percentiles).tolist())),
+        "values": dict(zip(values.tolist(), counts.tolist())),
+    }
+
+
+def group_advantages(rewards, groups, eps=ADVANTAGE_EPS):
+    """GRPO advantages: (reward - group mean) / (group std + eps), per group."""
+    _, inverse, sizes = np.unique(groups, return_inverse=True, return_counts=True)
+    means = np.bincount(inverse, weights=rewards) / sizes
+    variances = np.bincount(inverse, weights=(rewards - means[inverse]) ** 2) / sizes
+    stds = np.sqrt(variances)
+    return (rewards - means[inverse]) / (stds[inverse] + eps), stds
+
+
+def advantage_summary(rewards, groups, eps=ADVANTAGE_EPS):
+    """Statistics of the per-group advantages, including groups with no learning signal (zero std)."""
+    advantages, stds = group_advantages(rewards, groups, eps=eps)
+    return {
+        "groups": int(len(stds)),
+        "zero_std_groups": float(np.mean(stds == 0)),
+        "mean_abs_advantage": float(np.mean(np.abs(advantages))),
+        "mean_group_std": float(np.mean(stds)),
+    }
+
+
+def load_function(spec):
+    """Imports "module:function"."""
+    module_name, function_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score stored rollouts with a reward function.")
+    parser.add_argument("--dir", default=ROLLOUT_DIR)
+    parser.add_argument("--reward", default="grpo.rewards:combined_reward", help="module:function")
+    parser.add_argument("--num-proc", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    stored = read_rollouts(args.dir, columns=["group", "reward"])
+    groups = stored.column("group").to_numpy()
+    old_rewards = stored.column("reward").to_numpy()
+    new_rewards = replay(args.dir, load_function(args.reward), num_proc=args.num_proc)
+
+    for label, rewards in (("Stored rewards", old_rewards), ("Replayed rewards", new_rewards)):
+        print(f"\n--- {label} ---")
+        print(json.dumps(reward_summary(rewards), indent=2))
+        print(json.dumps(advantage_summary(rewards, groups), indent=2))
+
+    changed = new_rewards != old_rewards
+    print(f"\nChanged rewards: {changed.sum()} of {len(changed)} ({changed.mean() * 100:.2f}%)")
+    print(f"Mean change: {np.mean(new_rewards - old_rewards):+.4f}")
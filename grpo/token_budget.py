@@ -0,0 +1,336 @@
+"""
+token_budget.py
+
+Token budget planner for the GRPO rollout and KV-cache settings of the notebook.
+
+The notebook sets MAX_PROMPT_LENGTH, TOTAL_GENERATION_STEPS, the KV-cache size (their sum
+plus KV_CACHE_HEADROOM) and TRAIN_MICRO_BATCH_SIZE by hand. This module derives them from
+measured token lengths instead: the prompt and generation limits are the smallest
+multiples of PAD_MULTIPLE that truncate at most a given fraction of prompts / completions,
+and the micro-batch size is the one with the highest estimated rollouts per second whose
+estimated peak memory fits the devices.
+
+Everything is closed-form arithmetic on the model dimensions (ModelDims, the numbers of
+tunix's ModelConfig.gemma3_1b()), so plans can be made and checked offline without JAX:
+- Memory: the policy and reference weights, the LoRA parameters with their gradients and
+  AdamW state, plus the larger of the rollout peak (KV cache and prefill logits) and the
+  training peak (full-vocabulary logits, which dominate with Gemma's 262k vocabulary,
+  attention scores and per-layer activations). Arrays are assumed to be spread evenly
+  over the devices, and only MEMORY_UTILIZATION of their memory is counted as usable.
+- Time: prefill and training are compute bound (2 FLOPs per parameter and token per
+  forward pass, x4 for the actor's forward and backward plus the reference forward);
+  every decode step reads the weights and the KV cache, and decoding runs until the
+  longest completion of the batch ends, whose expected length is computed from the
+  completion length distribution.
+The constants are rough; the estimates are meant to rank configurations, not to replace
+a profile.
+
+Token lengths come from inspect_token_lengths-style profiling: arrays of lengths, e.g.
+grpo.bucketing.prompt_lengths() and the completion_tokens of stored rollouts.
+
+Usage:
+    python -m grpo.token_budget --rollouts data/rollouts
+    python -m grpo.token_budget --prompt-lengths prompts.npz --completion-lengths completions.npy
+
+Functions:
+- num_params(dims) / lora_params(dims, rank): parameter counts.
+- kv_cache_bytes(dims, cache_size, num_sequences): size of the sampler's KV cache.
+- truncation_fraction(lengths, limit): share of lengths over the limit.
+- length_limit(lengths, max_truncation): smallest padded limit truncating at most max_truncation.
+- expected_decode_steps(completion_lengths, limit, num_sequences): expected decode steps per rollout batch.
+- estimate(...): Estimate of the memory and speed of one configuration.
+- plan(prompt_lengths, completion_lengths, ...): recommended Plan.
+"""
+
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+ModelDims = namedtuple("ModelDims", [
+    "num_layers", "num_heads", "num_kv_heads", "head_dim", "embed_dim", "hidden_dim", "vocab_size",
+])
+GEMMA3_1B = ModelDims(
+    num_layers=26, num_heads=4, num_kv_heads=1, head_dim=256, embed_dim=1152, hidden_dim=6 * 1152,
+    vocab_size=262_144,
+)
+
+# Per device: memory in bytes, peak bf16 FLOP/s and memory bandwidth in bytes/s (TPU v5e)
+DeviceSpec = namedtuple("DeviceSpec", ["memory_bytes", "peak_flops", "memory_bandwidth"])
+TPU_V5E = DeviceSpec(memory_bytes=16e9, peak_flops=197e12, memory_bandwidth=819e9)
+NUM_DEVICES = 4  # MESH = [(1, 4), ("fsdp", "tp")]
+
+# Notebook settings
+NUM_GENERATIONS = 4
+LORA_RANK = 64
+KV_CACHE_HEADROOM = 256
+NOTEBOOK_CONFIG = {"max_prompt_length": 512, "total_generation_steps": 1024, "micro_batch_size": 2}
+
+PAD_MULTIPLE = 64  # same as grpo.bucketing, which is not imported to keep this module free of grain
+MAX_PROMPT_TRUNCATION = 0.01
+MAX_GENERATION_TRUNCATION = 0.05
+MAX_MICRO_BATCH_SIZE = 64
+
+PARAM_BYTES = 2  # bf16 weights, KV cache and activations
+LOGITS_BYTES = 4  # logits are upcast to float32 for the log-softmax
+LOGITS_COPIES = 2  # logits and their log-softmax / gradient
+NUM_MODEL_COPIES = 2  # policy and reference model
+TRAINABLE_BYTES_PER_PARAM = 16  # float32 LoRA parameter, gradient and two AdamW moments
+TRAIN_FORWARD_PASSES = 4  # actor forward + backward (~3 forward passes) and the reference forward
+MEMORY_UTILIZATION = 0.85  # share of device memory left after fragmentation, uneven sharding, buffers
+MODEL_FLOPS_UTILIZATION = 0.4
+BANDWIDTH_UTILIZATION = 0.7
+
+Estimate = namedtuple("Estimate", [
+    "weight_bytes", "trainable_bytes", "kv_cache_bytes", "rollout_bytes", "train_bytes", "peak_bytes",
+    "rollout_seconds", "train_seconds", "samples_per_second",
+])
+
+Plan = namedtuple("Plan", [
+    "max_prompt_length", "total_generation_steps", "kv_cache_size", "micro_batch_size",
+    "prompt_truncation", "generation_truncation", "estimate",
+])
+
+
+def num_params(dims):
+    """Parameter count; the input embedding is tied with the output projection."""
+    q_dim = dims.num_heads * dims.head_dim
+    kv_dim = dims.num_kv_heads * dims.head_dim
+    attention = dims.embed_dim * (2 * q_dim + 2 * kv_dim)
+    mlp = 3 * dims.embed_dim * dims.hidden_dim
+    return dims.vocab_size * dims.embed_dim + dims.num_layers * (attention + mlp)
+
+
+def lora_params(dims, rank=LORA_RANK):
+    """LoRA parameter count for the notebook's targets: q/kv/attn_vec einsums and gate/up/down projections."""
+    q_dim = dims.num_heads * dims.head_dim
+    kv_dim = dims.num_kv_heads * dims.head_dim
+    # (input, output) dimensions of every adapted matrix
+    shapes = [
+        (dims.embed_dim, q_dim), (dims.embed_dim, 2 * kv_dim), (q_dim, dims.embed_dim),
+        (dims.embed_dim, dims.hidden_dim), (dims.embed_dim, dims.hidden_dim), (dims.hidden_dim, dims.embed_dim),
+    ]
+    return dims.num_layers * rank * sum(d_in + d_out for d_in, d_out in shapes)
+
+
+def kv_cache_bytes(dims, cache_size, num_sequences, dtype_bytes=PARAM_BYTES):
+    """Keys and values of every layer for num_sequences sequences of cache_size tokens."""
+    return 2 * dims.num_layers * dims.num_kv_heads * dims.head_dim * cache_size * num_sequences * dtype_bytes
+
+
+def _forward_flops(dims, num_sequences, seq_length):
+    """Matmul FLOPs of one forward pass, including attention scores over the whole sequence."""
+    attention = 4 * dims.num_layers * dims.num_heads * dims.head_dim * seq_length
+    return 2 * num_sequences * seq_length * num_params(dims) + num_sequences * seq_length * attention
+
+
+def _train_activation_bytes(dims, num_sequences, seq_length):
+    """Activations kept for the backward pass, the attention scores and the full-vocabulary logits."""
+    q_dim = dims.num_heads * dims.head_dim
+    kv_dim = dims.num_kv_heads * dims.head_dim
+    # Norm inputs and residuals, q/k/v and the attention output, MLP gate, up and their product
+    per_token_layer = 4 * dims.embed_dim + 2 * q_dim + 2 * kv_dim + 3 * dims.hidden_dim
+    tokens = num_sequences * seq_length
+    layers = dims.num_layers * tokens * per_token_layer * PARAM_BYTES
+    scores = dims.num_layers * num_sequences * dims.num_heads * seq_length ** 2 * PARAM_BYTES
+    logits = tokens * dims.vocab_size * LOGITS_BYTES * LOGITS_COPIES
+    return layers + scores + logits
+
+
+def truncation_fraction(lengths, limit):
+    lengths = np.asarray(lengths)
+    return float(np.mean(lengths > limit)) if len(lengths) else 0.0
+
+
+def length_limit(lengths, max_truncation, pad_multiple=PAD_MULTIPLE):
+    """Smallest multiple of pad_multiple that at most max_truncation of the lengths exceed."""
+    lengths = np.sort(np.asarray(lengths))
+    if not len(lengths):
+        return pad_multiple
+    # At most floor(max_truncation * n) lengths may be longer than the limit
+    allowed = int(np.floor(max_truncation * len(lengths)))
+    longest_kept = lengths[len(lengths) - 1 - min(allowed, len(lengths) - 1)]
+    return max(pad_multiple, int(-(-longest_kept // pad_multiple) * pad_multiple))
+
+
+def expected_decode_steps(completion_lengths, limit, num_sequences):
+    """Expected decode steps of a rollout batch: E[min(longest of num_sequences completions, limit)].
+
+    Sampling stops when every sequence has ended, so a batch decodes for as long as its
+    longest completion. Completions are assumed to be drawn independently from the lengths.
+    """
+    lengths = np.minimum(np.sort(np.asarray(completion_lengths)), limit)
+    if not len(lengths):
+        return float(limit)
+    # P(longest <= lengths[k]) = ((k + 1) / n) ** num_sequences
+    cdf = (np.arange(1, len(lengths) + 1) / len(lengths)) ** num_sequences
+    return float(np.sum(np.diff(cdf, prepend=0.0) * lengths))
+
+
+def estimate(max_prompt_length, total_generation_steps, micro_batch_size, completion_lengths=None,
+             kv_cache_size=None, dims=GEMMA3_1B, device=TPU_V5E, num_devices=NUM_DEVICES,
+             num_generations=NUM_GENERATIONS, lora_rank=LORA_RANK):
+    """Estimated peak memory and throughput of one GRPO step with these settings.
+
+    Without completion_lengths, every rollout decodes for total_generation_steps steps.
+    kv_cache_size defaults to the notebook's max_prompt_length + total_generation_steps + KV_CACHE_HEADROOM.
+    """
+    if kv_cache_size is None:
+        kv_cache_size = max_prompt_length + total_generation_steps + KV_CACHE_HEADROOM
+    num_sequences = micro_batch_size * num_generations
+    seq_length = max_prompt_length + total_generation_steps
+
+    weight_bytes = NUM_MODEL_COPIES * num_params(dims) * PARAM_BYTES
+    trainable_bytes = lora_params(dims, lora_rank) * TRAINABLE_BYTES_PER_PARAM
+    kv_bytes = kv_cache_bytes(dims, kv_cache_size, num_sequences)
+    prefill_logits = num_sequences * max_prompt_length * dims.vocab_size * LOGITS_BYTES
+    rollout_bytes = kv_bytes + prefill_logits
+    train_bytes = _train_activation_bytes(dims, num_sequences, seq_length)
+    peak_bytes = weight_bytes + trainable_bytes + max(rollout_bytes, train_bytes)
+
+    flops_per_second = num_devices * device.peak_flops * MODEL_FLOPS_UTILIZATION
+    bytes_per_second = num_devices * device.memory_bandwidth * BANDWIDTH_UTILIZATION
+    if completion_lengths is None:
+        decode_steps = total_generation_steps
+    else:
+        decode_steps = expected_decode_steps(completion_lengths, total_generation_steps, num_sequences)
+    # A decode step reads one model's weights and the whole (statically sized) cache
+    decode_step_seconds = max(
+        (num_params(dims) * PARAM_BYTES + kv_bytes) / bytes_per_second,
+        2 * num_sequences * num_params(dims) / flops_per_second,
+    )
+    rollout_seconds = (_forward_flops(dims, num_sequences, max_prompt_length) / flops_per_second
+                       + decode_steps * decode_step_seconds)
+    train_seconds = TRAIN_FORWARD_PASSES * _forward_flops(dims, num_sequences, seq_length) / flops_per_second
+
+    return Estimate(
+        weight_bytes, trainable_bytes, kv_bytes, rollout_bytes, train_bytes, peak_bytes,
+        rollout_seconds, train_seconds, num_sequences / (rollout_seconds + train_seconds),
+    )
+
+
+def fits(estimate_, device=TPU_V5E, num_devices=NUM_DEVICES):
+    return estimate_.peak_bytes <= num_devices * device.memory_bytes * MEMORY_UTILIZATION
+
+
+def plan(prompt_lengths, completion_lengths, dims=GEMMA3_1B, device=TPU_V5E, num_devices=NUM_DEVICES,
+         num_generations=NUM_GENERATIONS, max_prompt_truncation=MAX_PROMPT_TRUNCATION,
+         max_generation_truncation=MAX_GENERATION_TRUNCATION, max_micro_batch_size=MAX_MICRO_BATCH_SIZE,
+         lora_rank=LORA_RANK):
+    """Recommends prompt / generation limits, KV-cache size and micro-batch size.
+
+    The limits are the smallest padded lengths within the truncation bounds (longer
+    limits only cost memory and time). Among the micro-batch sizes whose estimate fits the
+    devices, the one with the most rollouts per second is chosen. Returns None if not even
+    a micro-batch of one fits.
+    """
+    max_prompt_length = length_limit(prompt_lengths, max_prompt_truncation)
+    total_generation_steps = length_limit(completion_lengths, max_generation_truncation)
+    kv_cache_size = max_prompt_length + total_generation_steps + KV_CACHE_HEADROOM
+
+    best = None
+    for micro_batch_size in range(1, max_micro_batch_size + 1):
+        candidate = estimate(
+            max_prompt_length, total_generation_steps, micro_batch_size, completion_lengths,
+            kv_cache_size=kv_cache_size, dims=dims, device=device, num_devices=num_devices,
+            num_generations=num_generations, lora_rank=lora_rank,
+        )
+        # Peak memory grows with the batch, so no larger batch fits either
+        if not fits(candidate, device, num_devices):
+            break
+        if best is None or candidate.samples_per_second > best[1].samples_per_second:
+            best = (micro_batch_size, candidate)
+    if best is None:
+        return None
+
+    return Plan(
+        max_prompt_length, total_generation_steps, kv_cache_size, best[0],
+        truncation_fraction(prompt_lengths, max_prompt_length),
+        truncation_fraction(completion_lengths, total_generation_steps),
+        best[1],
+    )
+
+
+def print_estimate(label, estimate_, device=TPU_V5E, num_devices=NUM_DEVICES):
+    gb = 1e9
+    print(f"\n--- {label} ---")
+    print(f"Weights (policy + reference): {estimate_.weight_bytes / gb:.2f} GB")
+    print(f"LoRA parameters and optimizer state: {estimate_.trainable_bytes / gb:.2f} GB")
+    print(f"KV cache: {estimate_.kv_cache_bytes / gb:.2f} GB")
+    print(f"Rollout peak (KV cache + prefill logits): {estimate_.rollout_bytes / gb:.2f} GB")
+    print(f"Training peak (activations + logits): {estimate_.train_bytes / gb:.2f} GB")
+    print(f"Estimated peak memory: {estimate_.peak_bytes / gb:.2f} GB of "
+          f"{num_devices * device.memory_bytes * MEMORY_UTILIZATION / gb:.2f} GB usable")
+    print(f"Step time: {estimate_.rollout_seconds:.2f}s rollout + {estimate_.train_seconds:.2f}s training")
+    print(f"Rollouts per second: {estimate_.samples_per_second:.2f}")
+
+
+def _load_lengths(path):
+    """Lengths from a .npy array or a .npz with a "lengths" array (the inspect_token_lengths cache)."""
+    loaded = np.load(path)
+    return loaded["lengths"] if isinstance(loaded, np.lib.npyio.NpzFile) else loaded
+
+
+def _load_rollout_lengths(directory):
+    """Prompt and completion token counts of stored rollouts, skipping rows stored without counts (-1)."""
+    from grpo.rollout_store import read_rollouts
+
+    rollouts = read_rollouts(directory, columns=["prompt_tokens", "completion_tokens"])
+    prompt_lengths = rollouts.column("prompt_tokens").to_numpy()
+    completion_lengths = rollouts.column("completion_tokens").to_numpy()
+    prompt_lengths = prompt_lengths[prompt_lengths >= 0]
+    completion_lengths = completion_lengths[completion_lengths >= 0]
+    if not len(prompt_lengths) or not len(completion_lengths):
+        raise ValueError(f"No token counts in the {rollouts.num_rows} rollouts of {directory}; "
+                         f"record them with a tokenizer (grpo.rollout_store) or pass length arrays.")
+    return prompt_lengths, completion_lengths
+
+
+if __name__ == "__main__":
+    from grpo.rollout_store import ROLLOUT_DIR
+
+    parser = argparse.ArgumentParser(description="Recommend GRPO token limits, KV-cache and micro-batch sizes.")
+    parser.add_argument("--rollouts", default=None, help=f"Rollout store to read token counts from, e.g. {ROLLOUT_DIR}.")
+    parser.add_argument("--prompt-lengths", default=None, help="Prompt token lengths (.npy, or .npz with 'lengths').")
+    parser.add_argument("--completion-lengths", default=None, help="Completion token lengths (.npy / .npz).")
+    parser.add_argument("--memory-gb", type=float, default=TPU_V5E.memory_bytes / 1e9, help="Memory per device.")
+    parser.add_argument("--num-devices", type=int, default=NUM_DEVICES)
+    parser.add_argument("--num-generations", type=int, default=NUM_GENERATIONS)
+    parser.add_argument("--max-prompt-truncation", type=float, default=MAX_PROMPT_TRUNCATION)
+    parser.add_argument("--max-generation-truncation", type=float, default=MAX_GENERATION_TRUNCATION)
+    args = parser.parse_args()
+
+    if args.rollouts:
+        prompt_lengths, completion_lengths = _load_rollout_lengths(args.rollouts)
+    elif args.prompt_lengths and args.completion_lengths:
+        prompt_lengths = _load_lengths(args.prompt_lengths)
+        completion_lengths = _load_lengths(args.completion_lengths)
+    else:
+        parser.error("pass --rollouts, or --prompt-lengths and --completion-lengths")
+
+    device = TPU_V5E._replace(memory_bytes=args.memory_gb * 1e9)
+    print(f"Prompts: {len(prompt_lengths)}, median {np.median(prompt_lengths)} tokens, max {np.max(prompt_lengths)}")
+    print(f"Completions: {len(completion_lengths)}, median {np.median(completion_lengths)} tokens, "
+          f"max {np.max(completion_lengths)}")
+
+    notebook = estimate(**NOTEBOOK_CONFIG, completion_lengths=completion_lengths, device=device,
+                        num_devices=args.num_devices, num_generations=args.num_generations)
+    print_estimate("Notebook settings", notebook, device, args.num_devices)
+    print(f"Prompt truncation: {truncation_fraction(prompt_lengths, NOTEBOOK_CONFIG['max_prompt_length']):.2%}")
+    print(f"Generation truncation: "
+          f"{truncation_fraction(completion_lengths, NOTEBOOK_CONFIG['total_generation_steps']):.2%}")
+
+    recommended = plan(
+        prompt_lengths, completion_lengths, device=device, num_devices=args.num_devices,
+        num_generations=args.num_generations, max_prompt_truncation=args.max_prompt_truncation,
+        max_generation_truncation=args.max_generation_truncation,
+    )
+    if recommended is None:
+        raise SystemExit("Even a micro-batch of one does not fit; lower the limits or add devices.")
+    print_estimate("Recommended settings", recommended.estimate, device, args.num_devices)
+    print(f"Prompt truncation: {recommended.prompt_truncation:.2%}")
+    print(f"Generation truncation: {recommended.generation_truncation:.2%}")
+    print(f"\nMAX_PROMPT_LENGTH = {recommended.max_prompt_length}")
+    print(f"TOTAL_GENERATION_STEPS = {recommended.total_generation_steps}")
+    print(f"kv_cache_size = {recommended.kv_cache_size}")
+    print(f"TRAIN_MICRO_BATCH_SIZE = {recommended.micro_batch_size}")
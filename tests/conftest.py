@@ -0,0 +1,33 @@
+import pytest
+from tokenizers import Tokenizer, decoders, models, normalizers, processors, trainers
+from transformers import PreTrainedTokenizerFast
+
+from grpo.prompts import SYSTEM_PROMPT, TEMPLATE
+
+PROMPT_CORPUS = [
+    "What is 2 + 2?",
+    "Solve x^2 = 9 for x > 0, then  explain\n\n the steps.  ",
+    "  Leading whitespace?",
+    "\nLeading newline",
+    "",
+    "Long question " * 40,
+    "A train leaves at 3pm at 60 km/h. When has it covered 150 km?",
+]
+
+
+@pytest.fixture(scope="session")
+def prompt_tokenizer():
+    """A small BPE tokenizer without pre-tokenization, so merges cross the template boundaries like Gemma's."""
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.normalizer = normalizers.Replace(" ", "▁")
+    tokenizer.decoder = decoders.Replace("▁", " ")
+    prompts = [TEMPLATE.format(system_prompt=SYSTEM_PROMPT, question=question) for question in PROMPT_CORPUS]
+    tokenizer.train_from_iterator(prompts * 20, trainers.BpeTrainer(
+        vocab_size=400, max_token_length=4, special_tokens=["<pad>", "<unk>", "<bos>", "<end_of_turn>"],
+        show_progress=False,
+    ))
+    tokenizer.post_processor = processors.TemplateProcessing(single="<bos> $A", special_tokens=[
+        ("<bos>", tokenizer.token_to_id("<bos>")),
+    ])
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<bos>", unk_token="<unk>",
+                                   pad_token="<pad>", additional_special_tokens=["<end_of_turn>"])
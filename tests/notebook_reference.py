@@ -0,0 +1,190 @@
+"""Reward functions and evaluate() copied from GRPO_Gemma3/tunix-gemma3-1b-grpo.ipynb, as reference
+implementations for the equivalence tests (prints and tqdm removed)."""
+
+import re
+
+from grpo.prompts import SYSTEM_PROMPT, TEMPLATE, reasoning_end, reasoning_start, solution_end, solution_start
+
+match_format = re.compile(
+    rf"^[\s]{{0,}}"
+    rf"{reasoning_start}.+?{reasoning_end}.*?"
+    rf"{solution_start}(.+?){solution_end}"
+    rf"[\s]{{0,}}$",
+    flags=re.MULTILINE | re.DOTALL,
+)
+
+match_numbers = re.compile(
+    rf"{solution_start}.*?([\d\.]{{1,}})", flags=re.MULTILINE | re.DOTALL
+)
+
+
+def match_format_exactly(prompts, completions, **kwargs):
+    return [
+        0 if match_format.search(response) is None else 3.0
+        for response in completions
+    ]
+
+
+def match_format_approximately(prompts, completions, **kwargs):
+    scores = []
+    for completion in completions:
+        score = 0
+        response = completion
+        score += 0.5 if response.count(reasoning_start) == 1 else -0.5
+        score += 0.5 if response.count(reasoning_end) == 1 else -0.5
+        score += 0.5 if response.count(solution_start) == 1 else -0.5
+        score += 0.5 if response.count(solution_end) == 1 else -0.5
+        scores.append(score)
+    return scores
+
+
+def check_answer(prompts, completions, answer, **kwargs):
+    responses = completions
+    extracted_responses = [
+        guess.group(1) if (guess := match_format.search(r)) is not None else None
+        for r in responses
+    ]
+    scores = []
+    assert len(extracted_responses) == len(answer)
+    for guess, true_answer in zip(extracted_responses, answer):
+        score = 0
+        if guess is None:
+            scores.append(0)
+            continue
+        if guess == true_answer:
+            score += 4.0
+        elif guess.strip() == true_answer.strip():
+            score += 1.5
+        else:
+            try:
+                ratio = float(guess) / float(true_answer)
+                if ratio >= 0.9 and ratio <= 1.1:
+                    score += 0.5
+                elif ratio >= 0.8 and ratio <= 1.2:
+                    score += 0.25
+                else:
+                    score -= 1.0
+            except:  # noqa: E722
+                score -= 0.5
+        scores.append(score)
+    return scores
+
+
+def check_numbers(prompts, completions, answer, **kwargs):
+    responses = completions
+    extracted_responses = [
+        guess.group(1) if (guess := match_numbers.search(r)) is not None else None
+        for r in responses
+    ]
+    scores = []
+    for guess, true_answer in zip(extracted_responses, answer):
+        if guess is None:
+            scores.append(0)
+            continue
+        try:
+            true_answer = float(true_answer.strip())
+            guess = float(guess.strip())
+            scores.append(1.5 if guess == true_answer else 0.0)
+        except:  # noqa: E722
+            scores.append(0)
+            continue
+    return scores
+
+
+def combined_reward(prompts, completions, answer, **kwargs):
+    r_format_exact = match_format_exactly(prompts, completions, **kwargs)
+    r_format_approx = match_format_approximately(prompts, completions, **kwargs)
+    r_answer = check_answer(prompts, completions, answer, **kwargs)
+    r_numbers = check_numbers(prompts, completions, answer, **kwargs)
+
+    rewards = []
+    for fe, fa, ans, num in zip(r_format_exact, r_format_approx, r_answer, r_numbers):
+        format_score = fe + fa
+        correctness = ans + num
+        if format_score <= 0:
+            correctness *= 0.2
+        elif format_score < 2:
+            correctness *= 0.5
+        total = format_score + correctness
+        rewards.append(float(total))
+    return rewards
+
+
+def generate(question, sampler, temperature=0.7, top_k=50, top_p=0.95, seed=None):
+    if isinstance(question, str):
+        input_batch = [TEMPLATE.format(system_prompt=SYSTEM_PROMPT, question=question)]
+    else:
+        input_batch = [TEMPLATE.format(system_prompt=SYSTEM_PROMPT, question=q) for q in question]
+
+    out_data = sampler(
+        input_strings=input_batch,
+        max_generation_steps=768,
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        echo=False,
+        seed=seed if seed is not None else None,
+        eos_tokens=[1, 106],
+    )
+    output = out_data.text
+    if isinstance(question, str):
+        return output[0]
+    return output
+
+
+def evaluate(dataset, sampler, temperature=0.7, top_k=50, top_p=0.95, num_passes=1):
+    corr = 0
+    partially_corr = 0
+    corr_format = 0
+    total = 0
+
+    for batch in dataset:
+        answers = batch["answer"]
+        questions = batch["question"]
+
+        multiple_call_responses = [[] for _ in range(len(questions))]
+        for p in range(num_passes):
+            responses = generate(questions, sampler, temperature, top_k, top_p, seed=p)
+            for idx, response in enumerate(responses):
+                multiple_call_responses[idx].append(response)
+
+        for question, multiple_call_response, answer in zip(questions, multiple_call_responses, answers):
+            corr_ctr_per_question = 0
+            partially_corr_per_question = 0
+            corr_format_per_question = 0
+            for response in multiple_call_response:
+                extracted_response = (
+                    guess.group(1)
+                    if (guess := match_numbers.search(response)) is not None
+                    else "-1000000"
+                )
+                try:
+                    if float(extracted_response.strip()) == float(answer.strip()):
+                        corr_ctr_per_question += 1
+                    ratio = float(extracted_response.strip()) / float(answer.strip())
+                    if ratio >= 0.9 and ratio <= 1.1:
+                        partially_corr_per_question += 1
+                except:  # noqa: E722
+                    pass
+
+                if match_format.search(response) is not None:
+                    corr_format_per_question += 1
+
+                if corr_ctr_per_question > 0 and partially_corr_per_question > 0 and corr_format_per_question > 0:
+                    break
+
+            if corr_ctr_per_question > 0:
+                corr += 1
+            if partially_corr_per_question > 0:
+                partially_corr += 1
+            if corr_format_per_question > 0:
+                corr_format += 1
+            total += 1
+
+    return (
+        corr,
+        total,
+        corr / total * 100,
+        partially_corr / total * 100,
+        corr_format / total * 100,
+    )
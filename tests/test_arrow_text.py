@@ -0,0 +1,87 @@
+import pyarrow as pa
+import pytest
+
+from data_cleaning import arrow_text
+
+VALUES = [
+    "plain text here",
+    "  leading and trailing  ",
+    "",
+    None,
+    "   ",
+    "tabs\tand\nnewlines\r\nmixed",
+    "non\x85ascii　white space\xa0here",
+    "　\x85 wrapped in non-ASCII whitespace \x85　",
+    "control \x1c\x1d\x1e\x1f separators \x0b\x0c",
+    "multi-byte é 中文 words ü",
+    "one",
+    "\x85",
+    "a b c d e f g h i j k l",
+]
+
+
+def reference_truncate(value, max_words):
+    if value is None:
+        return None, None
+    words = value.split()
+    if len(words) <= max_words:
+        return value, len(words)
+    return " ".join(words[:max_words]), max_words
+
+
+def arrays():
+    """The values as a plain, large_string, sliced and chunked array, with the expected Python values."""
+    padded = ["x y", None] + VALUES + ["z"]
+    return [
+        (pa.array(VALUES), VALUES),
+        (pa.array(VALUES, pa.large_string()), VALUES),
+        (pa.array(padded).slice(2, len(VALUES)), VALUES),
+        (pa.chunked_array([VALUES[:5], VALUES[5:9], [], VALUES[9:]]), VALUES),
+        (pa.array(VALUES[4:9]), VALUES[4:9]),
+        (pa.array([], pa.string()), []),
+        (pa.array([None, None], pa.string()), [None, None]),
+    ]
+
+
+@pytest.mark.parametrize("array,values", arrays())
+def test_strip_and_non_empty_match_python(array, values):
+    assert arrow_text.strip(array).to_pylist() == [v.strip() if v is not None else None for v in values]
+    assert arrow_text.non_empty(array).to_pylist() == [v is not None and v.strip() != "" for v in values]
+
+
+@pytest.mark.parametrize("array,values", arrays())
+def test_word_counts_match_split(array, values):
+    assert arrow_text.word_counts(array).to_pylist() == [len(v.split()) if v is not None else None for v in values]
+
+
+@pytest.mark.parametrize("max_words", [0, 1, 2, 3, 5, 100])
+@pytest.mark.parametrize("array,values", arrays())
+def test_truncate_words_matches_split_join(array, values, max_words):
+    text, num_tokens = arrow_text.truncate_words(array, max_words)
+    expected = [reference_truncate(v, max_words) for v in values]
+    assert text.to_pylist() == [t for t, _ in expected]
+    assert num_tokens.to_pylist() == [n for _, n in expected]
+
+
+def test_non_string_columns_are_converted_with_str():
+    assert arrow_text.strip(pa.array([1, None, 23])).to_pylist() == ["1", None, "23"]
+    assert arrow_text.word_counts(pa.array([1.5, None])).to_pylist() == [1, None]
+
+
+def test_normalise_table_keeps_the_string_type():
+    table = pa.table({
+        "question": pa.array([" a ", "　b"], pa.large_string()),
+        "answer": pa.array([1, 2]),
+        "other": ["  kept  ", "x"],
+    })
+    normalised = arrow_text.normalise_table(table, ["question", "answer", "missing"])
+    assert normalised.column("question").to_pylist() == ["a", "b"]
+    assert normalised.schema.field("question").type == pa.large_string()
+    assert normalised.column("answer").to_pylist() == ["1", "2"]
+    assert normalised.column("other").to_pylist() == ["  kept  ", "x"]
+
+
+def test_join_template_concatenates_columns_and_literals():
+    question, answer = pa.array(["q1", "q2"]), pa.chunked_array([[1], [2]])
+    joined = arrow_text.join_template([question, "\n<answer>\n", answer, "\n</answer>"])
+    assert joined.to_pylist() == ["q1\n<answer>\n1\n</answer>", "q2\n<answer>\n2\n</answer>"]
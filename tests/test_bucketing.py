@@ -0,0 +1,90 @@
+import grain
+import numpy as np
+import pytest
+
+from grpo.bucketing import (PROMPT_IDS_FIELD, PROMPT_MASK_FIELD, batched, collate, length_bucketed_batches,
+                            padded_lengths, plan_batches, prompt_lengths)
+
+
+def ragged_source(num_rows=203, seed=0):
+    lengths = np.random.default_rng(seed).integers(1, 300, num_rows)
+    return [{"prompts": f"p{i}", "answer": str(i), PROMPT_IDS_FIELD: list(range(1, length + 1))}
+            for i, length in enumerate(lengths)], lengths
+
+
+@pytest.mark.parametrize("batch_size,window_batches", [(8, 4), (8, 64), (1, 1), (7, 3)])
+def test_every_index_appears_exactly_once(batch_size, window_batches):
+    lengths = np.random.default_rng(0).integers(1, 500, 203)
+    batches = plan_batches(lengths, batch_size, seed=1, window_batches=window_batches)
+    assert sorted(np.concatenate(batches).tolist()) == list(range(len(lengths)))
+    # Only the last batch of each window can be short
+    num_windows = -(-len(lengths) // (batch_size * window_batches))
+    assert sum(len(batch) < batch_size for batch in batches) <= num_windows
+    assert all(0 < len(batch) <= batch_size for batch in batches)
+
+
+def test_plan_is_deterministic_for_a_seed():
+    lengths = np.random.default_rng(0).integers(1, 500, 1000)
+    first, again = plan_batches(lengths, 8, seed=3), plan_batches(lengths, 8, seed=3)
+    assert [batch.tolist() for batch in first] == [batch.tolist() for batch in again]
+    other = plan_batches(lengths, 8, seed=4)
+    assert [batch.tolist() for batch in first] != [batch.tolist() for batch in other]
+
+
+def test_batches_group_similar_lengths():
+    lengths = np.random.default_rng(0).integers(1, 1000, 4096)
+    spreads = [np.ptp(lengths[batch]) for batch in plan_batches(lengths, 16, seed=0)]
+    random_spreads = [np.ptp(lengths[batch]) for batch in np.arange(4096).reshape(-1, 16)]
+    assert np.mean(spreads) < np.mean(random_spreads) / 10
+
+
+def test_drop_remainder():
+    lengths = np.arange(100)
+    kept = plan_batches(lengths, 8, seed=0, window_batches=4, drop_remainder=True)
+    assert all(len(batch) == 8 for batch in kept)
+    # 100 rows in windows of 32: three full windows and 4 rows that form no full batch
+    assert len(kept) == 12
+    assert len(plan_batches([], 8)) == 0
+
+
+def test_padded_lengths():
+    lengths = np.array([1, 64, 65, 200, 10])
+    batches = [np.array([0]), np.array([1, 0]), np.array([2, 4]), np.array([3])]
+    assert padded_lengths(batches, lengths).tolist() == [64, 64, 128, 256]
+    assert padded_lengths(batches, lengths, pad_multiple=8).tolist() == [8, 64, 72, 200]
+    assert padded_lengths(batches, lengths, max_length=128).tolist() == [64, 64, 128, 128]
+
+
+def test_collate_left_pads_and_truncates():
+    elements = [{"answer": "a", PROMPT_IDS_FIELD: [1, 2, 3]}, {"answer": "b", PROMPT_IDS_FIELD: [4]}]
+    batch = collate(elements, pad_id=-1, pad_multiple=4)
+    assert batch["answer"].tolist() == ["a", "b"]
+    assert batch[PROMPT_IDS_FIELD].tolist() == [[-1, 1, 2, 3], [-1, -1, -1, 4]]
+    assert batch[PROMPT_MASK_FIELD].tolist() == [[False, True, True, True], [False, False, False, True]]
+    # A prompt longer than the batch length keeps its last tokens
+    assert collate(elements, pad_id=0, length=2)[PROMPT_IDS_FIELD].tolist() == [[2, 3], [0, 4]]
+
+
+def test_length_bucketed_batches_of_a_ragged_source():
+    source, lengths = ragged_source()
+    dataset = grain.MapDataset.source(source)
+    assert prompt_lengths(dataset).tolist() == lengths.tolist()
+    batches, padded = length_bucketed_batches(dataset, lengths, 8, seed=0, window_batches=4, max_length=256)
+    seen = []
+    for batch, length in zip(batches, padded):
+        assert batch[PROMPT_IDS_FIELD].shape == (len(batch["prompts"]), length)
+        for prompt, ids, mask in zip(batch["prompts"], batch[PROMPT_IDS_FIELD], batch[PROMPT_MASK_FIELD]):
+            expected = source[int(str(prompt)[1:])][PROMPT_IDS_FIELD][-length:]
+            assert ids[mask].tolist() == expected
+            seen.append(str(prompt))
+    assert sorted(seen) == sorted(element["prompts"] for element in source)
+
+
+def test_plain_batches_of_a_ragged_source():
+    source, lengths = ragged_source()
+    batches = list(batched(grain.MapDataset.source(source), 16, drop_remainder=True))
+    assert len(batches) == len(source) // 16
+    for i, batch in enumerate(batches):
+        longest = lengths[i * 16:(i + 1) * 16].max()
+        assert batch[PROMPT_IDS_FIELD].shape == (16, -(-longest // 64) * 64)
+        assert batch[PROMPT_MASK_FIELD].sum(axis=1).tolist() == lengths[i * 16:(i + 1) * 16].tolist()
@@ -0,0 +1,97 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+import notebook_reference
+from grpo.evaluation import evaluate
+from grpo.rollout_store import RolloutWriter, read_rollouts
+
+QUESTION = re.compile(r"Question (\d+)\?")
+
+
+class StubSampler:
+    """Deterministic sampler: the response depends only on the question and the seed."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def response(self, number, seed):
+        variant = (number * 7 + seed * 3) % 6
+        return [
+            f"<reasoning>sure</reasoning><answer>{number}</answer>",
+            f"<reasoning>close</reasoning><answer>{number * 1.05:.2f}</answer>",
+            f"The answer is <answer>{number}",
+            f"<reasoning>off</reasoning><answer>{number + 100}</answer>",
+            "I don't know",
+            "<reasoning>hm</reasoning><answer>abc</answer>",
+        ][variant]
+
+    def __call__(self, input_strings, seed=None, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(text=[
+            self.response(int(QUESTION.search(prompt).group(1)), seed) for prompt in input_strings
+        ])
+
+
+def batched_dataset(num_questions=14, batch_size=4):
+    questions = [f"Question {i}?" for i in range(num_questions)]
+    answers = [str(i) for i in range(num_questions)]  # "0" exercises the division by zero
+    return [
+        {"question": questions[i:i + batch_size], "answer": answers[i:i + batch_size]}
+        for i in range(0, num_questions, batch_size)
+    ]
+
+
+@pytest.mark.parametrize("passes_per_round", [1, 2, 3])
+@pytest.mark.parametrize("num_passes", [1, 3, 5])
+def test_metrics_match_the_notebook(tmp_path, num_passes, passes_per_round):
+    dataset = batched_dataset()
+    expected = notebook_reference.evaluate(dataset, StubSampler(), num_passes=num_passes)
+    metrics = evaluate(dataset, StubSampler(), num_passes=num_passes, passes_per_round=passes_per_round,
+                       batch_size=5, store_path=str(tmp_path / "results.jsonl"))
+    assert metrics == pytest.approx(expected)
+
+
+def test_rerun_resumes_from_the_store(tmp_path):
+    dataset = batched_dataset()
+    store_path = str(tmp_path / "results.jsonl")
+    first = evaluate(dataset, StubSampler(), num_passes=3, store_path=store_path)
+
+    sampler = StubSampler()
+    assert evaluate(dataset, sampler, num_passes=3, store_path=store_path) == first
+    assert sampler.calls == 0
+
+
+def test_every_pass_has_its_own_seed(tmp_path):
+    dataset = batched_dataset()
+    store_path = str(tmp_path / "results.jsonl")
+    sampler = StubSampler()
+    seeds = []
+    original = sampler.__call__
+
+    def recording_sampler(input_strings, seed=None, **kwargs):
+        seeds.append(seed)
+        return original(input_strings, seed=seed, **kwargs)
+
+    _, responses = evaluate(dataset, recording_sampler, num_passes=4, passes_per_round=2, batch_size=64,
+                            store_path=store_path, make_lst=True)
+    assert seeds == [0, 1, 2, 3]
+    # A sampler that is deterministic per prompt and seed still gives different passes
+    assert any(len(set(passes)) > 1 for _, _, passes in responses)
+
+    # Seeds do not depend on passes_per_round, so the stored results are reused
+    sampler = StubSampler()
+    evaluate(dataset, sampler, num_passes=4, passes_per_round=1, store_path=store_path)
+    assert sampler.calls == 0
+
+def test_rollouts_are_recorded_with_token_counts(tmp_path):
+    dataset = batched_dataset()
+    with RolloutWriter(str(tmp_path / "rollouts")) as writer:
+        evaluate(dataset, StubSampler(), num_passes=2, store_path=str(tmp_path / "results.jsonl"),
+                 rollout_writer=writer, count_tokens=lambda text: len(text.split()))
+    rollouts = read_rollouts(str(tmp_path / "rollouts")).to_pydict()
+    assert set(rollouts["source"]) == {"eval"}
+    assert rollouts["prompt_tokens"] == [len(prompt.split()) for prompt in rollouts["prompt"]]
+    assert rollouts["completion_tokens"] == [len(completion.split()) for completion in rollouts["completion"]]
+    assert min(rollouts["prompt_tokens"]) > 0 and min(rollouts["completion_tokens"]) > 0
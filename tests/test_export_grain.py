@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from datasets import Dataset
+
+from conftest import PROMPT_CORPUS
+from data_formatting.export_grain import export_grain
+from grpo.bucketing import PROMPT_MASK_FIELD, batched, length_bucketed_batches, prompt_lengths
+from grpo.grain_source import ArrowShardSource, load_grpo_dataset
+from grpo.prompt_encoder import PROMPT_IDS_FIELD
+
+
+@pytest.fixture(scope="module")
+def tokenized_export(tmp_path_factory, prompt_tokenizer):
+    questions = [f"{question} ({i})" for i in range(10) for question in PROMPT_CORPUS]
+    dataset = Dataset.from_dict({"question": questions, "expected_answer": [str(i) for i in range(len(questions))]})
+    export_dir = str(tmp_path_factory.mktemp("export") / "grpo_train")
+    return export_grain(dataset, export_dir, shard_size=16, tokenizer=prompt_tokenizer)
+
+
+def exported_ids(source):
+    return {source[i]["prompts"]: source[i][PROMPT_IDS_FIELD] for i in range(len(source))}
+
+
+def check_batch(batch, source):
+    """Every row holds one element's prompt_ids, left-padded with the export's pad id."""
+    prompt_ids, mask = batch[PROMPT_IDS_FIELD], batch[PROMPT_MASK_FIELD]
+    assert prompt_ids.shape == mask.shape and prompt_ids.dtype == np.int32
+    assert len(batch["prompts"]) == len(batch["question"]) == len(batch["answer"]) == len(prompt_ids)
+    elements = exported_ids(source)
+    for prompt, ids, row_mask in zip(batch["prompts"], prompt_ids, mask):
+        assert ids[row_mask].tolist() == elements[str(prompt)]
+        assert (ids[~row_mask] == source.pad_id).all()
+        assert not row_mask[:-row_mask.sum()].any()
+
+
+def test_plain_batches_of_a_tokenized_export(tokenized_export, prompt_tokenizer):
+    source = ArrowShardSource(tokenized_export)
+    assert source.pad_id == prompt_tokenizer.pad_token_id
+    batches = list(batched(load_grpo_dataset(tokenized_export), 8, pad_id=source.pad_id, pad_multiple=16))
+    assert [len(batch["prompts"]) for batch in batches] == [8] * 8 + [6]
+    assert len({len(ids) for ids in exported_ids(source).values()}) > 1
+    for batch in batches:
+        assert batch[PROMPT_IDS_FIELD].shape[1] % 16 == 0
+        check_batch(batch, source)
+
+
+def test_length_bucketed_batches_of_a_tokenized_export(tokenized_export):
+    source = ArrowShardSource(tokenized_export)
+    dataset = load_grpo_dataset(tokenized_export)
+    lengths = prompt_lengths(dataset)
+    batches, padded = length_bucketed_batches(dataset, lengths, 8, pad_multiple=16, pad_id=source.pad_id)
+    assert len(batches) == len(padded) == 9
+    for batch, length in zip(batches, padded):
+        assert batch[PROMPT_IDS_FIELD].shape[1] == length
+        check_batch(batch, source)
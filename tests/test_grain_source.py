@@ -0,0 +1,50 @@
+import pickle
+
+import pytest
+from datasets import Dataset
+
+from data_formatting.export_grain import export_grain
+from grpo.bucketing import PAD_ID
+from grpo.grain_source import ArrowShardSource, load_grpo_dataset, prefetched
+from grpo.prompts import format_prompt
+
+
+@pytest.fixture(scope="module")
+def export_dir(tmp_path_factory):
+    dataset = Dataset.from_dict({
+        "question": [f"What is {i} + {i}?" for i in range(50)],
+        "expected_answer": [f" {2 * i} " for i in range(50)],
+    })
+    return export_grain(dataset, str(tmp_path_factory.mktemp("export") / "grpo"), shard_size=16)
+
+
+def test_rows_across_shards(export_dir):
+    source = ArrowShardSource(export_dir)
+    assert len(source) == 50 and len(source.files) == 4
+    assert source.prefix_length is None and source.pad_id == PAD_ID
+    for index in (0, 15, 16, 49, -1):
+        i = index % 50
+        assert source[index] == {"prompts": format_prompt(f"What is {i} + {i}?"),
+                                 "question": f"What is {i} + {i}?", "answer": str(2 * i)}
+    with pytest.raises(IndexError):
+        source[50]
+
+
+def test_source_pickles_without_its_memory_maps(export_dir):
+    source = ArrowShardSource(export_dir)
+    source[20]
+    copy = pickle.loads(pickle.dumps(source))
+    assert copy._batches == {} and copy[20] == source[20]
+
+
+def test_shuffle_is_seeded(export_dir):
+    answers = [element["answer"] for element in load_grpo_dataset(export_dir, seed=1)]
+    assert answers == [element["answer"] for element in load_grpo_dataset(export_dir, seed=1)]
+    assert answers != [element["answer"] for element in load_grpo_dataset(export_dir, seed=2)]
+    assert sorted(answers) == sorted(str(2 * i) for i in range(50))
+
+
+def test_prefetched_batches(export_dir):
+    batches = list(prefetched(load_grpo_dataset(export_dir, shuffle=False).batch(8), num_threads=4))
+    assert [len(batch["answer"]) for batch in batches] == [8] * 6 + [2]
+    assert batches[0]["answer"].tolist() == [str(2 * i) for i in range(8)]
@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+
+import pytest
+from datasets import Dataset, load_from_disk
+
+from data_pipeline import incremental
+from data_pipeline.incremental import INFO_FILE, append_to_disk, has_tag
+
+
+def test_append_is_skipped_when_the_directory_holds_the_tag(tmp_path):
+    save_dir = str(tmp_path / "formatted")
+    append_to_disk(Dataset.from_dict({"text": ["a", "b"]}), save_dir, tag="base")
+    append_to_disk(Dataset.from_dict({"text": ["c"]}), save_dir, tag="delta1")
+    assert has_tag(save_dir, "base") and has_tag(save_dir, "delta1")
+
+    # A retry after a failure elsewhere appends nothing twice
+    append_to_disk(Dataset.from_dict({"text": ["c"]}), save_dir, tag="delta1")
+    append_to_disk(Dataset.from_dict({"text": ["d", "e"]}), save_dir, tag="delta2")
+    assert load_from_disk(save_dir)["text"] == ["a", "b", "c", "d", "e"]
+    assert not has_tag(save_dir, "delta3")
+
+
+def test_append_updates_dataset_info(tmp_path):
+    save_dir = str(tmp_path / "cleaned")
+    Dataset.from_dict({"text": ["a", "b"]}).save_to_disk(save_dir)
+    info_path = os.path.join(save_dir, INFO_FILE)
+    with open(info_path) as f:
+        info = json.load(f)
+    info.update({"splits": {"train": {"name": "train", "num_examples": 2, "num_bytes": 1}},
+                 "dataset_size": 1, "download_size": 10, "size_in_bytes": 11})
+    with open(info_path, "w") as f:
+        json.dump(info, f)
+    with open(os.path.join(save_dir, "state.json")) as f:
+        state = json.load(f)
+    state["_split"] = "train"
+    with open(os.path.join(save_dir, "state.json"), "w") as f:
+        json.dump(state, f)
+
+    append_to_disk(Dataset.from_dict({"text": ["c"]}), save_dir, tag="delta")
+    with open(info_path) as f:
+        info = json.load(f)
+    num_bytes = sum(os.path.getsize(os.path.join(save_dir, name))
+                    for name in os.listdir(save_dir) if name.endswith(".arrow"))
+    assert info["splits"]["train"]["num_examples"] == 3
+    assert info["splits"]["train"]["num_bytes"] == info["dataset_size"] == num_bytes
+    assert info["size_in_bytes"] == 10 + num_bytes
+    assert len(load_from_disk(save_dir)) == 3
+
+
+def openmath_rows(start, stop):
+    return Dataset.from_dict({
+        "question": [f"What is {i} + {i}?" for i in range(start, stop)],
+        "generated_solution": [f"Adding gives {2 * i}." for i in range(start, stop)],
+        "expected_answer": [str(2 * i) for i in range(start, stop)],
+    })
+
+
+def saved_outputs(branch):
+    config = incremental.BRANCHES[branch]
+    formatting, split = config.format, config.split
+    return {save_dir: load_from_disk(save_dir).to_list() for save_dir in [
+        config.cleaned_dir, split.train_split_dir, split.validation_split_dir,
+        formatting.formatted_train_dir, formatting.formatted_validation_dir,
+    ] if os.path.exists(save_dir)}
+
+
+def test_retry_after_a_partial_append_does_not_duplicate_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    incremental.append_delta("openmath", openmath_rows(0, 40), rebuild=True)
+    delta = openmath_rows(30, 80)
+
+    calls = []
+    original = incremental.append_to_disk
+
+    def failing_append(dataset, save_dir, tag="appended"):
+        calls.append(save_dir)
+        if len(calls) == 3:
+            raise OSError("disk full")
+        original(dataset, save_dir, tag=tag)
+
+    monkeypatch.setattr(incremental, "append_to_disk", failing_append)
+    with pytest.raises(OSError):
+        incremental.append_delta("openmath", delta)
+    monkeypatch.setattr(incremental, "append_to_disk", original)
+    incremental.append_delta("openmath", delta)
+    appended = saved_outputs("openmath")
+
+    shutil.rmtree("data")
+    incremental.append_delta("openmath", openmath_rows(0, 80), rebuild=True)
+    full = saved_outputs("openmath")
+    assert {save_dir: sorted(map(str, rows)) for save_dir, rows in appended.items()} == \
+        {save_dir: sorted(map(str, rows)) for save_dir, rows in full.items()}
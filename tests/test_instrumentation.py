@@ -0,0 +1,43 @@
+import json
+
+import pytest
+from datasets import Dataset, DatasetDict, concatenate_datasets
+
+from data_pipeline import instrumentation
+from data_pipeline.instrumentation import configure, instrumented
+
+
+@pytest.fixture
+def spans(tmp_path):
+    metrics_path = tmp_path / "spans.jsonl"
+    configure(metrics_path=str(metrics_path))
+    yield lambda: [json.loads(line) for line in metrics_path.read_text().splitlines()]
+    configure()
+
+
+@instrumented
+def split_rows(dataset):
+    split = dataset.train_test_split(test_size=0.25, seed=0)
+    return DatasetDict({"train": split["train"], "validation": split["test"].select(range(2))})
+
+
+@instrumented
+def merge_splits(splits, extra):
+    return concatenate_datasets([splits["train"], splits["validation"], extra])
+
+
+def test_dataset_dicts_count_the_rows_of_their_splits(spans):
+    splits = split_rows(Dataset.from_dict({"x": list(range(100))}))
+    merge_splits(splits, extra=Dataset.from_dict({"x": [0, 1, 2]}))
+    first, second = spans()
+    assert (first["rows_in"], first["rows_out"], first["row_delta"]) == (100, 77, -23)
+    assert (second["rows_in"], second["rows_out"], second["row_delta"]) == (80, 80, 0)
+
+
+def test_datasets_in_containers():
+    train, validation = Dataset.from_dict({"x": [1, 2]}), Dataset.from_dict({"x": [3]})
+    splits = DatasetDict({"train": train, "validation": validation})
+    assert instrumentation._rows(instrumentation._datasets(splits)) == 3
+    assert instrumentation._rows(instrumentation._datasets((splits, train, "text"))) == 5
+    assert instrumentation._rows(instrumentation._datasets({"openmath": splits, "deepwriting": train})) == 5
+    assert instrumentation._datasets(["a", 1]) == []
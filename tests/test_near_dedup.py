@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datasets import Dataset
+
+from data_cleaning import near_dedup
+from data_cleaning.near_dedup import _minhash_batch, _permutations, _shingles, remove_near_duplicates
+
+TEXTS = [
+    "What is 2 + 2?",
+    "",
+    "What is 2+2 ?",
+    "Write a story about a lighthouse keeper who finds a message in a bottle. " * 30,
+    "one",
+    "A train leaves at 3pm at 60 km/h. When has it covered 150 km? " * 5,
+]
+
+
+def unchunked_signatures(texts, perm_a, perm_b, ngram_size):
+    """All shingles x permutations at once, as before chunking."""
+    shingles, offsets = [], []
+    for text in texts:
+        offsets.append(len(shingles))
+        shingles.extend(_shingles(text, ngram_size))
+    hashes = pd.util.hash_array(np.array(shingles, dtype=object)) & near_dedup._MAX_HASH
+    permuted = (hashes[:, None] * perm_a + perm_b) % near_dedup._MERSENNE_PRIME & near_dedup._MAX_HASH
+    return np.minimum.reduceat(permuted, np.array(offsets), axis=0).astype(np.uint32)
+
+
+@pytest.mark.parametrize("shingle_chunk", [1, 3, 64, 100_000])
+def test_chunked_signatures_match_the_unchunked_ones(shingle_chunk):
+    perm_a, perm_b = _permutations(near_dedup.NUM_PERM, near_dedup.MINHASH_SEED)
+    signatures = _minhash_batch(TEXTS, perm_a, perm_b, 3, shingle_chunk=shingle_chunk)[near_dedup._SIGNATURE_COLUMN]
+    assert np.array_equal(signatures, unchunked_signatures(TEXTS, perm_a, perm_b, 3))
+
+
+def test_near_duplicates_are_removed():
+    dataset = Dataset.from_dict({"question": TEXTS + [TEXTS[3].upper(), TEXTS[5] + "!"]})
+    deduplicated = remove_near_duplicates(dataset, "question")
+    assert deduplicated["question"] == [TEXTS[0], TEXTS[1], TEXTS[3], TEXTS[4], TEXTS[5]]
@@ -0,0 +1,42 @@
+import numpy as np
+from datasets import Dataset, Features, Sequence, Value, concatenate_datasets
+
+from data_formatting.pack_sft import PACKED_FEATURES, example_lengths, pack_dataset
+
+TOKENIZED_FEATURES = Features({"input_ids": Sequence(Value("int32"))})
+
+
+def tokenized(lengths):
+    return Dataset.from_dict({"input_ids": [[i + 1] * length for i, length in enumerate(lengths)]},
+                             features=TOKENIZED_FEATURES)
+
+
+def test_packed_rows_hold_every_example_once():
+    lengths = np.random.default_rng(0).integers(1, 40, 200).tolist()
+    packed = pack_dataset(tokenized(lengths), seq_length=64, window=50)
+    assert packed.features == PACKED_FEATURES
+    examples = []
+    for row in packed:
+        assert len(row["input_ids"]) == len(row["segment_ids"]) == len(row["positions"]) == 64
+        for segment in set(row["segment_ids"]) - {0}:
+            ids = [i for i, s in zip(row["input_ids"], row["segment_ids"]) if s == segment]
+            positions = [p for p, s in zip(row["positions"], row["segment_ids"]) if s == segment]
+            assert positions == list(range(len(ids)))
+            examples.append(ids)
+    assert sorted(examples) == sorted([i + 1] * length for i, length in enumerate(lengths))
+
+
+def test_empty_dataset(capsys):
+    packed = pack_dataset(tokenized([]))
+    assert len(packed) == 0 and packed.features == PACKED_FEATURES
+    assert "No examples to pack." in capsys.readouterr().out
+
+
+def test_example_lengths_by_window():
+    lengths = np.random.default_rng(0).integers(0, 40, 300).tolist()
+    # Several Arrow chunks, and an indices mapping after shuffle
+    dataset = concatenate_datasets([tokenized(lengths[:120]), tokenized(lengths[120:])])
+    assert example_lengths(dataset, window=64).tolist() == lengths
+    shuffled = dataset.shuffle(seed=0)
+    assert example_lengths(shuffled, window=7).tolist() == [len(ids) for ids in shuffled["input_ids"]]
+    assert example_lengths(tokenized([])).tolist() == []
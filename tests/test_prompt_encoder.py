@@ -0,0 +1,37 @@
+import pytest
+from datasets import Dataset
+
+from grpo.prompt_encoder import PROMPT_IDS_FIELD, PromptEncoder, add_prompt_ids
+
+QUESTIONS = [
+    "What is 2 + 2?",
+    "Solve x^2 = 9 for x > 0, then  explain\n\n the steps.  ",
+    "  Leading whitespace?",
+    "\nLeading newline",
+    "",
+    "Long question " * 40,
+    "A train leaves at 3pm at 60 km/h. When has it covered 150 km?",
+]
+
+
+def test_prompt_ids_match_full_tokenization(prompt_tokenizer):
+    dataset = Dataset.from_dict({"question": QUESTIONS * 3})
+    encoded, prefix_length = add_prompt_ids(dataset, prompt_tokenizer)
+    encoder = PromptEncoder(prompt_tokenizer)
+    assert encoded[PROMPT_IDS_FIELD] == encoder.full_encode(dataset["question"])
+    assert prefix_length == encoder.prefix_length > 0
+    assert all(ids[:prefix_length] == encoder.prefix_ids for ids in encoded[PROMPT_IDS_FIELD])
+
+
+def test_verification_samples_the_whole_dataset(prompt_tokenizer, monkeypatch):
+    encode = PromptEncoder.encode
+
+    def encode_with_broken_rows(self, questions):
+        return [ids[:-1] if question.startswith("broken") else ids
+                for question, ids in zip(questions, encode(self, questions))]
+
+    monkeypatch.setattr(PromptEncoder, "encode", encode_with_broken_rows)
+    # Only the last fifth of the rows is affected, far beyond the first verify_rows
+    questions = [f"What is {i} + {i}?" for i in range(4000)] + [f"broken {i}" for i in range(1000)]
+    with pytest.raises(ValueError, match="broken"):
+        add_prompt_ids(Dataset.from_dict({"question": questions}), prompt_tokenizer, verify_rows=64)
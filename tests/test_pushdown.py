@@ -0,0 +1,84 @@
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from data_loading.load_openmath import load_and_merge_openmath
+from data_loading.pushdown import scan_dataset
+
+ROWS = [
+    {"question": "What is 1 + 1?", "generated_solution": "2", "expected_answer": "2", "is_correct": True,
+     "extra": "x" * 50},
+    {"question": "   ", "generated_solution": "blank question", "expected_answer": "1", "is_correct": True,
+     "extra": "x" * 50},
+    {"question": "What is 2 + 2?", "generated_solution": None, "expected_answer": "4", "is_correct": True,
+     "extra": "x" * 50},
+    {"question": "What is 3 + 3?", "generated_solution": "6", "expected_answer": "6", "is_correct": False,
+     "extra": "x" * 50},
+    {"question": "What is 4 + 4?", "generated_solution": "8", "expected_answer": "8", "is_correct": True,
+     "extra": "x" * 50},
+]
+COLUMNS = ["question", "generated_solution", "expected_answer"]
+
+
+def write_jsonl(path, rows):
+    with open(path, "w") as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows)
+    return str(path)
+
+
+def write_parquet(path, rows):
+    pq.write_table(pa.Table.from_pylist(rows), path, row_group_size=2)
+    return str(path)
+
+
+@pytest.fixture(params=["jsonl", "parquet"])
+def source_file(request, tmp_path):
+    writer = write_jsonl if request.param == "jsonl" else write_parquet
+    return writer(tmp_path / f"rows.{request.param}", ROWS)
+
+
+def test_projection_and_predicates(source_file, tmp_path):
+    dataset = scan_dataset(source_file, columns=COLUMNS, non_empty=COLUMNS, flags={"is_correct": True},
+                           scan_dir=str(tmp_path / "scans"))
+    assert dataset.column_names == COLUMNS
+    assert dataset["expected_answer"] == ["2", "8"]
+
+    unflagged = scan_dataset(source_file, columns=COLUMNS, non_empty=COLUMNS, scan_dir=str(tmp_path / "scans"))
+    assert unflagged["expected_answer"] == ["2", "6", "8"]
+
+
+def test_repeated_scan_is_reused(source_file, tmp_path, capsys):
+    scan_dir = str(tmp_path / "scans")
+    first = scan_dataset(source_file, columns=COLUMNS, non_empty=COLUMNS, scan_dir=scan_dir)
+    files = os.listdir(scan_dir)
+    mtimes = [os.path.getmtime(os.path.join(scan_dir, name)) for name in files]
+    capsys.readouterr()
+
+    second = scan_dataset(source_file, columns=COLUMNS, non_empty=COLUMNS, scan_dir=scan_dir)
+    assert "Reusing scan" in capsys.readouterr().out
+    assert second.to_list() == first.to_list()
+    assert os.listdir(scan_dir) == files
+    assert [os.path.getmtime(os.path.join(scan_dir, name)) for name in files] == mtimes
+
+    scan_dataset(source_file, columns=COLUMNS[:2], non_empty=COLUMNS, scan_dir=scan_dir)
+    assert len(os.listdir(scan_dir)) == 2
+
+
+def test_compare_reports_the_savings(source_file, tmp_path, capsys):
+    scan_dataset(source_file, columns=COLUMNS, non_empty=COLUMNS, scan_dir=str(tmp_path / "scans"), compare=True)
+    report = capsys.readouterr().out
+    assert "Rows kept: 3 of 5" in report
+    assert "Full read: 5 rows" in report and "saved" in report
+
+
+def test_openmath_loader_passes_compare(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    data_files = {"train": [write_jsonl(tmp_path / "train.jsonl", ROWS)],
+                  "validation": [write_jsonl(tmp_path / "validation.jsonl", ROWS[:2])]}
+    dataset = load_and_merge_openmath(columns=COLUMNS, non_empty=COLUMNS, data_files=data_files, compare=True)
+    assert dataset["expected_answer"] == ["2", "6", "8", "2"]
+    report = capsys.readouterr().out
+    assert report.count("Full read:") == 2 and "JSON bytes parsed" in report
@@ -0,0 +1,116 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from grpo.reward_executor import FakeSampler, RewardExecutor, ScoringSampler, _slice_kwargs
+
+
+def length_reward(prompts, completions, answer, **kwargs):
+    """Stub reward: len(completion), +100 if it equals the answer; sleeps on "SLOW", hangs on "HANG"."""
+    assert len(completions) == len(answer) == 1, (completions, answer)
+    if "HANG" in completions[0]:
+        time.sleep(3600)
+    if "SLOW" in completions[0]:
+        time.sleep(0.2)
+    if "CRASH" in completions[0]:
+        os._exit(1)
+    if "RAISE" in completions[0]:
+        raise RuntimeError("reward failed")
+    return [len(completions[0]) + (100.0 if completions[0] == answer[0] else 0.0)]
+
+
+def expected(completions, answers):
+    return [len(c) + (100.0 if c == a else 0.0) for c, a in zip(completions, answers)]
+
+
+def test_slice_kwargs_slices_sequences_and_arrays():
+    kwargs = {"answer": np.array(["1", "2"]), "question": ("a", "b"), "tag": "x", "scale": np.float64(2.0)}
+    sliced = _slice_kwargs(kwargs, 1)
+    assert list(sliced["answer"]) == ["2"]
+    assert sliced["question"] == ("b",)
+    assert sliced["tag"] == "x"
+    assert sliced["scale"] == 2.0
+
+
+def test_scores_keep_completion_order():
+    completions = ["SLOW first", "b", "SLOW third", "dd", "e"]
+    answers = ["x", "b", "x", "x", "e"]
+    with RewardExecutor(length_reward, num_workers=3, timeout=5.0, processes=False) as executor:
+        scores = executor.submit(["p"] * 5, completions, answer=answers).result(timeout=10)
+    assert scores == expected(completions, answers)
+
+
+def test_ndarray_kwargs_are_sliced_per_completion():
+    completions = ["4", "5", "4"]
+    answers = np.array(["4", "4", "4"])
+    with RewardExecutor(length_reward, num_workers=2, timeout=5.0, processes=False) as executor:
+        scores = executor.reward_fn()(["p"] * 3, completions, answer=answers, question=np.array(["q"] * 3))
+    assert scores == [101.0, 1.0, 101.0]
+
+
+def test_queued_tasks_are_not_timed_out():
+    # 6 x 0.2s on one worker takes longer than the timeout, but each task finishes within it
+    completions = [f"SLOW {i}" for i in range(6)]
+    with RewardExecutor(length_reward, num_workers=1, timeout=1.0, processes=False) as executor:
+        scores = executor.submit(["p"] * 6, completions, answer=["x"] * 6).result(timeout=10)
+        assert executor.timeouts == 0
+    assert scores == expected(completions, ["x"] * 6)
+
+
+def test_timeout_gets_default_score_and_pool_recovers():
+    completions = ["a", "HANG", "ccc", "SLOW dd"]
+    with RewardExecutor(length_reward, num_workers=2, timeout=2.0, default_score=-7.0) as executor:
+        scores = executor.submit(["p"] * 4, completions, answer=["x"] * 4).result(timeout=30)
+        assert executor.timeouts == 1
+        assert scores == [1.0, -7.0, 3.0, 7.0]
+        assert executor.submit(["p"], ["ok"], answer=["ok"]).result(timeout=30) == [102.0]
+
+
+@pytest.mark.parametrize("failure", ["CRASH", "RAISE"])
+def test_worker_failure_gets_default_score(failure):
+    completions = ["a", failure, "bb"]
+    with RewardExecutor(length_reward, num_workers=2, timeout=2.0, default_score=-1.0) as executor:
+        scores = executor.submit(["p"] * 3, completions, answer=["x"] * 3).result(timeout=30)
+        assert scores == [1.0, -1.0, 2.0]
+        assert executor.submit(["p"], ["ok"], answer=["ok"]).result(timeout=30) == [102.0]
+
+
+def test_scoring_sampler_pre_submits_for_reward_fn():
+    prompts = ["p1", "p2", "p1", "p2"]  # repeated prompts, as with num_generations > 1
+    examples = {"p1": {"answer": "aa"}, "p2": {"answer": "b"}}
+    with RewardExecutor(length_reward, num_workers=2, timeout=5.0, processes=False) as executor:
+        sampler = ScoringSampler(FakeSampler(["aa", "b", "c", "b"]), executor, examples)
+        output = sampler(input_strings=prompts)
+        assert executor._num_submitted == 1
+        scores = executor.reward_fn()(prompts, output.text, answer=["aa", "b", "aa", "b"])
+        assert executor._num_submitted == 0
+    assert scores == [102.0, 101.0, 1.0, 101.0]
+
+
+def test_unclaimed_submissions_are_bounded():
+    with RewardExecutor(length_reward, num_workers=2, timeout=5.0, processes=False, max_submitted=3) as executor:
+        futures = [executor.submit([f"p{i}"], ["a"], answer=["x"]) for i in range(5)]
+        for future in futures:
+            future.result(timeout=10)
+        assert executor._num_submitted == 3
+        assert [key[0] for key in executor._submitted] == [("p2",), ("p3",), ("p4",)]
+
+
+def test_thread_pool_does_not_dispatch_to_a_stuck_thread():
+    # One of two threads hangs. A 0.2s task dispatched behind another one on the free thread
+    # would wait 0.4s, past the timeout, so only one may be dispatched at a time
+    completions = ["HANG"] + [f"SLOW {i}" for i in range(6)]
+    with RewardExecutor(length_reward, num_workers=2, timeout=0.35, default_score=-1.0, processes=False) as executor:
+        scores = executor.submit(["p"] * 7, completions, answer=["x"] * 7).result(timeout=30)
+        assert scores == [-1.0] + expected(completions[1:], ["x"] * 6)
+        assert executor.timeouts == 1
+
+
+def test_thread_pool_is_replaced_when_every_thread_is_stuck():
+    completions = ["HANG 1", "HANG 2", "b", "cc"]
+    with RewardExecutor(length_reward, num_workers=2, timeout=0.5, default_score=-1.0, processes=False) as executor:
+        scores = executor.submit(["p"] * 4, completions, answer=["x", "x", "b", "x"]).result(timeout=30)
+        assert scores == [-1.0, -1.0, 101.0, 2.0]
+        assert executor.timeouts == 2
@@ -0,0 +1,95 @@
+import itertools
+import random
+
+import pytest
+
+import notebook_reference
+from grpo.rewards import combined_reward, reward_components
+
+FORMATTED = "<reasoning>Add them.</reasoning><answer>{}</answer>"
+
+CASES = [
+    # (completion, answer)
+    (FORMATTED.format("4"), "4"),  # exact
+    (FORMATTED.format(" 4 "), "4"),  # equal after strip
+    (FORMATTED.format("4.2"), "4"),  # ratio within 10%
+    (FORMATTED.format("4.6"), "4"),  # ratio within 20%
+    (FORMATTED.format("9"), "4"),  # wrong
+    (FORMATTED.format("four"), "4"),  # not a number
+    (FORMATTED.format("3"), "0"),  # division by zero
+    (FORMATTED.format("0"), "0"),
+    (FORMATTED.format("0.0"), "0"),
+    (FORMATTED.format("1.2.3"), "1.2"),
+    ("<answer>the result is 12, not 34</answer>", "12"),  # first number after <answer>, unformatted
+    ("<reasoning>r</reasoning><answer>x = 34 or 12</answer>", "12"),
+    ("Number 12 before <answer> then 7</answer>", "7"),
+    ("<answer>1</answer><reasoning>r</reasoning><answer>2</answer>", "2"),  # answer before reasoning
+    ("  \n<reasoning>\nstep\n</reasoning>\n<answer>\n42\n</answer>\n  ", "42"),
+    ("<reasoning>r</reasoning>trailing <answer>5</answer> text", "5"),  # format regex fails at the end
+    ("<reasoning></reasoning><answer>5</answer>", "5"),  # empty reasoning does not match .+?
+    ("<reasoning>r</reasoning><reasoning>r</reasoning><answer>5</answer>", "5"),  # duplicate tag
+    ("<reasoning>r</reasoning><answer>5", "5"),  # unclosed answer
+    ("<answer>..</answer>", "2"),
+    ("The answer is 4.", "4"),  # no tags at all
+    ("", "4"),
+    (FORMATTED.format("1e3"), "1000"),
+    (FORMATTED.format("-4"), "-4"),
+    (FORMATTED.format("4"), " 4"),  # answer with whitespace
+    (FORMATTED.format("inf"), "inf"),
+    ("<reasoning>r</reasoning>\n<answer>3.14159</answer>", "3.1416"),
+]
+
+
+def reference_components(completions, answers):
+    return {
+        "format_exact": notebook_reference.match_format_exactly(None, completions),
+        "format_approx": notebook_reference.match_format_approximately(None, completions),
+        "answer": notebook_reference.check_answer(None, completions, answers),
+        "numbers": notebook_reference.check_numbers(None, completions, answers),
+    }
+
+
+def fuzz_cases(num_cases=2000, seed=0):
+    """Completions assembled from tags, numbers and whitespace, with numeric answers."""
+    fragments = ["<reasoning>", "</reasoning>", "<answer>", "</answer>", "4", "4.0", "3.9", "0", "12.5", "x",
+                 " ", "\n", "...", "abc", "1.1.1", "-2"]
+    rng = random.Random(seed)
+    answers = ["4", "0", "12.5", "3", "-2", "abc"]
+    return [("".join(rng.choice(fragments) for _ in range(rng.randint(0, 10))), rng.choice(answers))
+            for _ in range(num_cases)]
+
+
+@pytest.mark.parametrize("cases", [CASES, fuzz_cases()], ids=["fixed", "fuzz"])
+def test_components_match_the_notebook(cases):
+    completions, answers = [c for c, _ in cases], [a for _, a in cases]
+    components = reward_components(completions, answers)
+    expected = reference_components(completions, answers)
+    for name, scores in expected.items():
+        assert components[name].tolist() == pytest.approx(scores), name
+
+
+@pytest.mark.parametrize("cases", [CASES, fuzz_cases()], ids=["fixed", "fuzz"])
+def test_combined_reward_matches_the_notebook(cases):
+    completions, answers = [c for c, _ in cases], [a for _, a in cases]
+    prompts = ["prompt"] * len(cases)
+    rewards = combined_reward(prompts, completions, answers, log_every=0, question=["q"] * len(cases))
+    assert rewards == notebook_reference.combined_reward(prompts, completions, answers)
+
+
+def test_gating_covers_every_format_level():
+    completions, answers = [c for c, _ in CASES], [a for _, a in CASES]
+    components = reward_components(completions, answers)
+    format_scores = set((components["format_exact"] + components["format_approx"]).tolist())
+    # format <= 0 (x0.2), 0 < format < 2 (x0.5) and format >= 2 (x1)
+    assert any(score <= 0 for score in format_scores)
+    assert any(0 < score < 2 for score in format_scores)
+    assert any(score >= 2 for score in format_scores)
+
+
+def test_batches_of_one_match_the_whole_batch():
+    completions, answers = [c for c, _ in CASES], [a for _, a in CASES]
+    whole = combined_reward(None, completions, answers, log_every=0)
+    single = list(itertools.chain.from_iterable(
+        combined_reward(None, [completion], [answer], log_every=0) for completion, answer in CASES
+    ))
+    assert single == whole
@@ -0,0 +1,48 @@
+from grpo.rewards import combined_reward
+from grpo.rollout_store import RolloutWriter, read_rollouts, recording_reward, replay
+
+FORMATTED = "<reasoning>Add them.</reasoning><answer>{}</answer>"
+
+
+def score_batches(reward, num_batches):
+    for i in range(num_batches):
+        prompts = [f"p{i}"] * 4
+        completions = [FORMATTED.format(n) for n in range(4)]
+        reward(prompts, completions, answer=["2"] * 4, question=[f"q{i}"] * 4)
+
+
+def test_recording_reward_stores_the_training_step(tmp_path):
+    trainer_step = {"value": 7}
+    with RolloutWriter(str(tmp_path)) as writer:
+        reward = recording_reward(combined_reward, writer, step=lambda: trainer_step["value"])
+        score_batches(reward, 2)  # two micro-batches of the same step
+        trainer_step["value"] = 8
+        score_batches(reward, 1)
+        score_batches(recording_reward(combined_reward, writer), 1)
+    assert read_rollouts(str(tmp_path), columns=["step"]).column("step").to_pylist() == \
+        [7] * 8 + [8] * 4 + [-1] * 4
+
+
+def test_replay_matches_stored_rewards_without_logging(tmp_path, capsys):
+    with RolloutWriter(str(tmp_path), shard_rows=4) as writer:
+        score_batches(recording_reward(combined_reward, writer), 120)  # more replay calls than LOG_EVERY
+    capsys.readouterr()
+    stored = read_rollouts(str(tmp_path), columns=["reward"]).column("reward").to_numpy()
+    assert replay(str(tmp_path), num_proc=1).tolist() == stored.tolist()
+    assert capsys.readouterr().out == ""
+
+
+def test_recorded_token_counts(tmp_path, capsys):
+    with RolloutWriter(str(tmp_path)) as writer:
+        score_batches(recording_reward(combined_reward, writer, count_tokens=lambda text: len(text.split())), 2)
+    assert "without token counts" not in capsys.readouterr().out
+    rollouts = read_rollouts(str(tmp_path)).to_pydict()
+    assert rollouts["prompt_tokens"] == [1] * 8
+    assert rollouts["completion_tokens"] == [len(FORMATTED.format(n).split()) for n in range(4)] * 2
+    assert min(rollouts["completion_tokens"]) > 0
+
+
+def test_missing_token_counter_is_reported(tmp_path, capsys):
+    with RolloutWriter(str(tmp_path)) as writer:
+        recording_reward(combined_reward, writer)
+    assert "without token counts" in capsys.readouterr().out
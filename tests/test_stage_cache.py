@@ -0,0 +1,135 @@
+import importlib
+import os
+import sys
+
+import pytest
+from datasets import Dataset
+
+from data_pipeline import stage_cache
+from data_pipeline.stage_cache import code_version, run_stage
+
+STAGE_MODULE = '''
+from data_pipeline.instrumentation import instrumented
+from stub_helpers.text import normalise
+
+
+@instrumented
+def clean(dataset):
+    return dataset  # {marker}
+'''
+
+HELPER_MODULE = '''
+def normalise(text):
+    return text.strip()  # {marker}
+'''
+
+
+def _import_stage(tmp_path, monkeypatch, marker, helper_marker="h1"):
+    for package, module, source in (("stub_stages", "clean_stub", STAGE_MODULE.format(marker=marker)),
+                                    ("stub_helpers", "text", HELPER_MODULE.format(marker=helper_marker))):
+        package_dir = tmp_path / package
+        package_dir.mkdir(exist_ok=True)
+        (package_dir / "__init__.py").write_text("")
+        (package_dir / f"{module}.py").write_text(source)
+        for name in (package, f"{package}.{module}"):
+            sys.modules.pop(name, None)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    importlib.invalidate_caches()
+    return importlib.import_module("stub_stages.clean_stub").clean
+
+
+def test_code_version_hashes_the_package_of_an_instrumented_stage(tmp_path, monkeypatch):
+    clean = _import_stage(tmp_path, monkeypatch, "v1")
+    assert clean.__wrapped__ is not None
+    assert code_version(clean) != code_version(stage_cache.stage_key)
+
+
+def test_editing_a_stage_module_changes_its_cache_key(tmp_path, monkeypatch):
+    before = code_version(_import_stage(tmp_path, monkeypatch, "v1"))
+    after = code_version(_import_stage(tmp_path, monkeypatch, "v2"))
+    assert before != after
+
+
+def test_editing_an_imported_module_changes_its_cache_key(tmp_path, monkeypatch):
+    before = code_version(_import_stage(tmp_path, monkeypatch, "v1", helper_marker="h1"))
+    assert code_version(_import_stage(tmp_path, monkeypatch, "v1", helper_marker="h1")) == before
+    assert code_version(_import_stage(tmp_path, monkeypatch, "v1", helper_marker="h2")) != before
+
+
+def test_format_stage_depends_on_arrow_text():
+    from data_formatting import format_openmath_sft
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(stage_cache.__file__)))
+    files = stage_cache._module_files(format_openmath_sft, root)
+    assert os.path.join(root, "data_cleaning", "arrow_text.py") in files
+    assert all(not path.endswith("datasets/__init__.py") for path in files)
+
+
+class CountingStage:
+    """Stage function counting its calls: doubles x, optionally splitting off the last rows."""
+
+    __name__ = "counting_stage"
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, dataset, factor=2, holdout=0):
+        self.calls += 1
+        doubled = dataset.map(lambda row: {"x": row["x"] * factor})
+        if holdout:
+            return (doubled.select(range(len(doubled) - holdout)),
+                    doubled.select(range(len(doubled) - holdout, len(doubled))))
+        return doubled
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return {"cache_dir": str(tmp_path / "cache"), "version": "v1"}
+
+
+def test_cache_hit(cache, tmp_path):
+    fn, dataset = CountingStage(), Dataset.from_dict({"x": [1, 2, 3]})
+    save_dirs = {"train": str(tmp_path / "train")}
+    first = run_stage("double", fn, {"dataset": dataset}, {"holdout": 1}, output_names=("train", "test"),
+                      save_dirs=save_dirs, **cache)
+    second = run_stage("double", fn, {"dataset": dataset}, {"holdout": 1}, output_names=("train", "test"),
+                       save_dirs=save_dirs, **cache)
+    assert fn.calls == 1
+    assert first["train"]["x"] == second["train"]["x"] == [2, 4] and second["test"]["x"] == [6]
+    assert Dataset.load_from_disk(save_dirs["train"])["x"] == [2, 4]
+
+
+@pytest.mark.parametrize("change", ["params", "input", "version", "key_extras"])
+def test_cache_miss(cache, change):
+    fn, dataset = CountingStage(), Dataset.from_dict({"x": [1, 2, 3]})
+    run_stage("double", fn, {"dataset": dataset}, {"factor": 2}, key_extras={"tokenizer": "a"}, **cache)
+    inputs, params, key_extras = {"dataset": dataset}, {"factor": 2}, {"tokenizer": "a"}
+    if change == "params":
+        params = {"factor": 3}
+    elif change == "input":
+        inputs = {"dataset": Dataset.from_dict({"x": [1, 2, 4]})}
+    elif change == "version":
+        cache["version"] = "v2"
+    else:
+        key_extras = {"tokenizer": "b"}
+    outputs = run_stage("double", fn, inputs, params, key_extras=key_extras, **cache)
+    assert fn.calls == 2
+    expected = {"params": [3, 6, 9], "input": [2, 4, 8]}.get(change, [2, 4, 6])
+    assert outputs["output"]["x"] == expected
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    fn = CountingStage()
+    datasets = [Dataset.from_dict({"x": list(range(i, i + 1000))}) for i in range(3)]
+    run_stage("double", fn, {"dataset": datasets[0]}, **cache)
+    entry_size = stage_cache._dir_size(stage_cache._entries(cache["cache_dir"])[0])
+    run_stage("double", fn, {"dataset": datasets[1]}, **cache)
+    run_stage("double", fn, {"dataset": datasets[0]}, **cache)  # hit: the first entry is used again
+    run_stage("double", fn, {"dataset": datasets[2]}, max_bytes=int(2.5 * entry_size), **cache)
+    assert fn.calls == 3 and len(stage_cache._entries(cache["cache_dir"])) == 2
+
+    run_stage("double", fn, {"dataset": datasets[0]}, **cache)
+    run_stage("double", fn, {"dataset": datasets[2]}, **cache)
+    assert fn.calls == 3
+    run_stage("double", fn, {"dataset": datasets[1]}, **cache)
+    assert fn.calls == 4
@@ -0,0 +1,44 @@
+import json
+import os
+
+import pyarrow as pa
+from datasets import IterableDataset
+
+from data_loading.streaming import MANIFEST_FILE, iter_shards, load_shards, write_shards
+
+
+def rows(num_rows=25, null_rows=10):
+    for i in range(num_rows):
+        yield {
+            "question": f"q{i}",
+            "expected_answer": str(i) if i >= null_rows else None,
+            "score": float(i) if i % 2 else None,
+        }
+
+
+def stream(**kwargs):
+    dataset = IterableDataset.from_generator(rows, gen_kwargs=kwargs)
+    assert dataset.features is None
+    return dataset
+
+
+def test_all_null_first_shard_without_stream_features(tmp_path):
+    save_dir = str(tmp_path / "shards")
+    dataset = write_shards(stream(), save_dir, shard_size=5)
+    assert dataset.to_list() == list(rows())
+    assert dataset.features.arrow_schema.field("expected_answer").type == pa.string()
+    with open(os.path.join(save_dir, MANIFEST_FILE)) as f:
+        assert json.load(f)["features"]["expected_answer"]["dtype"] == "string"
+
+
+def test_resume_writes_with_the_persisted_schema(tmp_path):
+    save_dir = str(tmp_path / "shards")
+    shards = iter_shards(stream(), save_dir, shard_size=5)
+    next(shards)
+    next(shards)  # interrupted after two shards, both with expected_answer all null
+    shards.close()
+
+    dataset = write_shards(stream(), save_dir, shard_size=5)
+    assert dataset.to_list() == list(rows())
+    assert dataset.features.arrow_schema.field("score").type == pa.float64()
+    assert load_shards(save_dir).to_list() == list(rows())
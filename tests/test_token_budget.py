@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from grpo import token_budget
+from grpo.token_budget import (GEMMA3_1B, NOTEBOOK_CONFIG, estimate, expected_decode_steps, fits, kv_cache_bytes,
+                               length_limit, num_params, plan, truncation_fraction)
+
+
+def test_import_is_pure_numpy():
+    code = "import sys, grpo.token_budget; print(sorted(m for m in sys.modules if m.split('.')[0] in " \
+           "('grain', 'jax', 'pyarrow', 'datasets', 'grpo')))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    assert output.strip() == "['grpo', 'grpo.token_budget']"
+
+
+def test_gemma3_1b_parameter_count():
+    assert num_params(GEMMA3_1B) == pytest.approx(1.0e9, rel=0.01)
+
+
+def test_kv_cache_bytes():
+    # keys and values x 26 layers x 1 KV head x 256 dims x 1792 tokens x 8 sequences x 2 bytes
+    assert kv_cache_bytes(GEMMA3_1B, 1792, 8) == 2 * 26 * 256 * 1792 * 8 * 2
+    assert kv_cache_bytes(GEMMA3_1B, 1792, 16) == 2 * kv_cache_bytes(GEMMA3_1B, 1792, 8)
+
+
+def test_length_limit():
+    assert length_limit([1, 2, 3, 64, 65], 0.0) == 128
+    assert length_limit([10] * 99 + [1000], 0.01) == 64
+    assert length_limit([10] * 98 + [1000] * 2, 0.01) == 1024
+    assert length_limit([], 0.05) == 64
+    lengths = np.random.default_rng(0).integers(1, 2000, 10_000)
+    for max_truncation in (0.0, 0.01, 0.1, 0.5):
+        limit = length_limit(lengths, max_truncation)
+        assert limit % 64 == 0
+        assert truncation_fraction(lengths, limit) <= max_truncation
+        assert truncation_fraction(lengths, limit - 64) > max_truncation
+
+
+@pytest.mark.parametrize("num_sequences,limit", [(1, 10_000), (8, 1024), (16, 512)])
+def test_expected_decode_steps_matches_monte_carlo(num_sequences, limit):
+    rng = np.random.default_rng(0)
+    lengths = rng.lognormal(6.2, 0.5, 20_000).astype(int)
+    longest = rng.choice(lengths, (50_000, num_sequences)).max(axis=1)
+    expected = expected_decode_steps(lengths, limit, num_sequences)
+    assert expected == pytest.approx(np.minimum(longest, limit).mean(), rel=0.01)
+    assert expected <= limit
+
+
+def test_plan_respects_truncation_and_memory():
+    rng = np.random.default_rng(1)
+    prompts = rng.lognormal(5.3, 0.4, 20_000).astype(int)
+    completions = rng.lognormal(6.2, 0.5, 20_000).astype(int)
+    recommended = plan(prompts, completions)
+    assert recommended.prompt_truncation <= token_budget.MAX_PROMPT_TRUNCATION
+    assert recommended.generation_truncation <= token_budget.MAX_GENERATION_TRUNCATION
+    assert recommended.kv_cache_size == (recommended.max_prompt_length + recommended.total_generation_steps
+                                         + token_budget.KV_CACHE_HEADROOM)
+    assert fits(recommended.estimate)
+    larger = estimate(recommended.max_prompt_length, recommended.total_generation_steps,
+                      recommended.micro_batch_size + 1, completions)
+    assert not fits(larger) or larger.samples_per_second <= recommended.estimate.samples_per_second
+
+
+def test_notebook_micro_batch_of_four_does_not_fit():
+    assert fits(estimate(**NOTEBOOK_CONFIG))
+    assert not fits(estimate(**{**NOTEBOOK_CONFIG, "micro_batch_size": 4}))
+
+
+def test_rollout_lengths_skip_rows_without_counts(tmp_path):
+    from grpo.rollout_store import RolloutWriter
+
+    with RolloutWriter(str(tmp_path / "counted")) as writer:
+        writer.append(0, "train", ["p"] * 2, ["a", "b"], [1.0, 0.0], prompt_tokens=[100, 100],
+                      completion_tokens=[300, 500])
+        writer.append(1, "train", ["q"] * 2, ["c", "d"], [0.0, 0.0])
+    prompt_lengths, completion_lengths = token_budget._load_rollout_lengths(str(tmp_path / "counted"))
+    assert prompt_lengths.tolist() == [100, 100] and completion_lengths.tolist() == [300, 500]
+
+    with RolloutWriter(str(tmp_path / "uncounted")) as writer:
+        writer.append(0, "train", ["q"] * 2, ["c", "d"], [0.0, 0.0])
+    with pytest.raises(ValueError, match="No token counts"):
+        token_budget._load_rollout_lengths(str(tmp_path / "uncounted"))
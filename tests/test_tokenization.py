@@ -0,0 +1,68 @@
+import os
+
+import pytest
+from tokenizers import Tokenizer, decoders, models, normalizers, processors, trainers
+from transformers import PreTrainedTokenizerFast
+
+from data_formatting import format_deepwriting_sft, format_openmath_sft
+from data_formatting.tokenization import TOKENIZER_NAME, encode_segments, load_tokenizer
+
+ROWS = [
+    {"question": "What is 2 + 2?", "generated_solution": "Adding two and two gives 4. " * 40,
+     "expected_answer": "4"},
+    {"question": "Solve x^2 = 9 for x > 0, then  explain\n\n the steps.  ",
+     "generated_solution": "We take\tsquare roots:\n x = 3.\n" * 30, "expected_answer": "3"},
+    {"question": "Short?", "generated_solution": "Yes.", "expected_answer": "1"},
+    {"question": "Long question " * 60, "generated_solution": "Long solution " * 60, "expected_answer": "42"},
+]
+
+
+@pytest.fixture(scope="module")
+def sentencepiece_like_tokenizer():
+    """A small BPE tokenizer without pre-tokenization, so merges cross the template boundaries like Gemma's."""
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.normalizer = normalizers.Replace(" ", "▁")
+    tokenizer.decoder = decoders.Replace("▁", " ")
+    corpus = ["".join(text for text, _ in format_openmath_sft.sft_segments(row)) for row in ROWS] * 20
+    tokenizer.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=400, max_token_length=4, special_tokens=["<unk>", "<bos>"], show_progress=False,
+    ))
+    tokenizer.post_processor = processors.TemplateProcessing(single="<bos> $A", special_tokens=[
+        ("<bos>", tokenizer.token_to_id("<bos>")),
+    ])
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<bos>", unk_token="<unk>")
+
+
+def check_encoding(examples, tokenizer, max_length):
+    encoded = encode_segments(examples, tokenizer, max_length)
+    for example, text, ids in zip(examples, encoded["text"], encoded["input_ids"]):
+        full_text = "".join(segment for segment, _ in example)
+        assert ids == tokenizer(text)["input_ids"]
+        assert len(ids) <= max_length
+        if len(tokenizer(full_text)["input_ids"]) <= max_length:
+            assert text == full_text
+        # Fixed segments survive, and truncatable ones are only cut at the end
+        assert text.endswith(example[-1][0])
+        assert example[1][0] in text
+        assert full_text.startswith(text[:text.index(example[1][0])])
+    assert encoded["num_tokens"] == [len(ids) for ids in encoded["input_ids"]]
+    return encoded
+
+
+@pytest.mark.parametrize("max_length", [40, 64, 100, 1024])
+def test_ids_match_full_tokenization(sentencepiece_like_tokenizer, max_length):
+    examples = [format_openmath_sft.sft_segments(row) for row in ROWS]
+    examples += [format_deepwriting_sft.sft_segments({"prompt": row["question"], "solution": row["generated_solution"]})
+                 for row in ROWS]
+    check_encoding(examples, sentencepiece_like_tokenizer, max_length)
+
+
+def test_fixed_segments_longer_than_max_length_raise(sentencepiece_like_tokenizer):
+    with pytest.raises(ValueError):
+        encode_segments([format_openmath_sft.sft_segments(ROWS[0])], sentencepiece_like_tokenizer, 2)
+
+
+@pytest.mark.skipif(not os.path.isdir(TOKENIZER_NAME), reason="set TOKENIZER_NAME to a local Gemma tokenizer directory")
+def test_ids_match_gemma_tokenization():
+    examples = [format_openmath_sft.sft_segments(row) for row in ROWS]
+    check_encoding(examples, load_tokenizer(TOKENIZER_NAME), 64)